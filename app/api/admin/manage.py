@@ -14,7 +14,9 @@ from pydantic import BaseModel
 
 from app.core.config import setting
 from app.core.logger import logger
+from app.core.metrics import metrics
 from app.services.grok.token import token_manager
+from app.services.grok.session_pool import session_pool
 from app.models.grok_models import TokenType
 
 
@@ -288,7 +290,7 @@ async def list_tokens(_: bool = Depends(verify_admin_session)) -> TokenListRespo
     try:
         logger.debug("[Admin] 开始获取Token列表")
 
-        all_tokens_data = token_manager.get_tokens()
+        all_tokens_data = await token_manager.query_tokens()
         token_list: List[TokenInfo] = []
 
         # 处理普通Token
@@ -705,15 +707,21 @@ async def get_stats(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
     try:
         logger.debug("[Admin] 开始获取统计信息")
 
-        all_tokens_data = token_manager.get_tokens()
+        indexed_stats = await token_manager.token_stats()
+        if indexed_stats:
+            # 存储支持索引统计（SQLite）
+            normal_stats = indexed_stats[TokenType.NORMAL.value]
+            super_stats = indexed_stats[TokenType.SUPER.value]
+        else:
+            all_tokens_data = token_manager.get_tokens()
 
-        # 统计普通Token
-        normal_tokens = all_tokens_data.get(TokenType.NORMAL.value, {})
-        normal_stats = calculate_token_stats(normal_tokens, "normal")
+            # 统计普通Token
+            normal_tokens = all_tokens_data.get(TokenType.NORMAL.value, {})
+            normal_stats = calculate_token_stats(normal_tokens, "normal")
 
-        # 统计Super Token
-        super_tokens = all_tokens_data.get(TokenType.SUPER.value, {})
-        super_stats = calculate_token_stats(super_tokens, "super")
+            # 统计Super Token
+            super_tokens = all_tokens_data.get(TokenType.SUPER.value, {})
+            super_stats = calculate_token_stats(super_tokens, "super")
 
         total_count = normal_stats["total"] + super_stats["total"]
 
@@ -742,7 +750,7 @@ async def get_storage_mode(_: bool = Depends(verify_admin_session)) -> Dict[str,
     """
     获取当前存储模式
 
-    返回当前的存储模式（file/mysql/redis）。
+    返回当前的存储模式（file/shm/sqlite/mysql/redis）。
     """
     try:
         logger.debug("[Admin] 获取存储模式")
@@ -763,3 +771,49 @@ async def get_storage_mode(_: bool = Depends(verify_admin_session)) -> Dict[str,
             status_code=500,
             detail={"error": f"获取存储模式失败: {str(e)}", "code": "STORAGE_MODE_ERROR"}
         )
+
+
+@router.get("/api/pool/sessions")
+async def get_session_pool(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """
+    获取上游会话池占用情况
+
+    返回各代理/指纹分组的会话数、活跃请求数与空闲时间。
+    """
+    try:
+        logger.debug("[Admin] 获取会话池状态")
+
+        return {
+            "success": True,
+            "data": session_pool.stats()
+        }
+
+    except Exception as e:
+        logger.error(f"[Admin] 获取会话池状态异常 - 错误: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={"error": f"获取会话池状态失败: {str(e)}", "code": "SESSION_POOL_ERROR"}
+        )
+
+
+@router.get("/api/metrics")
+async def get_metrics(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """
+    获取运行指标
+
+    返回客户端断开、流式取消、上游中止等计数器。
+    """
+    try:
+        logger.debug("[Admin] 获取运行指标")
+
+        return {
+            "success": True,
+            "data": metrics.snapshot()
+        }
+
+    except Exception as e:
+        logger.error(f"[Admin] 获取运行指标异常 - 错误: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={"error": f"获取运行指标失败: {str(e)}", "code": "METRICS_ERROR"}
+        )
@@ -5,23 +5,70 @@
 提供OpenAI兼容的聊天API接口，支持与Grok模型的交互。
 """
 
-from fastapi import APIRouter, Depends, HTTPException
-from typing import Optional
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import AsyncGenerator, Optional
 from fastapi.responses import StreamingResponse
 
 from app.core.auth import auth_manager
 from app.core.exception import GrokApiException
 from app.core.logger import logger
+from app.core.metrics import metrics
+from app.services.grok.cancel import CancelToken
 from app.services.grok.client import GrokClient
 from app.models.openai_schema import OpenAIChatRequest
 
 # 聊天路由
 router = APIRouter(prefix="/chat", tags=["聊天"])
 
+# 客户端断开检测间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# 排队优先级请求头（所有Token限流时生效，数值越大越优先）
+PRIORITY_HEADER = "X-Priority"
+
+
+def _request_priority(raw_request: Request) -> int:
+    """读取请求的排队优先级，缺失或非法时为 0"""
+    try:
+        return int(raw_request.headers.get(PRIORITY_HEADER, 0))
+    except ValueError:
+        return 0
+
+
+async def _watch_disconnect(raw_request: Request, cancel: CancelToken) -> None:
+    """轮询客户端连接状态，断开时触发取消信号"""
+    while not cancel.cancelled:
+        if await raw_request.is_disconnected():
+            logger.info("[Chat] 客户端已断开，取消上游请求")
+            metrics.inc("client.disconnected")
+            cancel.cancel("client_disconnect")
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def _stream_with_disconnect(raw_request: Request, stream: AsyncGenerator, cancel: CancelToken) -> AsyncGenerator:
+    """包装流式响应：后台监听客户端断开，结束时中止未完成的上游传输"""
+    watcher = asyncio.create_task(_watch_disconnect(raw_request, cancel))
+    completed = False
+    try:
+        async for chunk in stream:
+            yield chunk
+        completed = True
+    finally:
+        watcher.cancel()
+        # 未正常读完（客户端断开或写出失败）时同步中止上游，再回收生成器
+        if not completed:
+            cancel.cancel("stream_closed")
+        if cancel.cancelled:
+            metrics.inc("stream.cancelled")
+        await stream.aclose()
+
 
 @router.post("/completions", response_model=None)
 async def chat_completions(
     request: OpenAIChatRequest,
+    raw_request: Request,
     _: Optional[str] = Depends(auth_manager.verify)
 ):
     """
@@ -31,6 +78,7 @@ async def chat_completions(
 
     Args:
         request: OpenAI格式的聊天请求
+        raw_request: 原始请求，用于检测客户端断开
         _: 认证依赖（自动验证）
 
     Returns:
@@ -44,12 +92,18 @@ async def chat_completions(
         logger.info(f"[Chat] 聊天请求 - 模型: {request.model}")
 
         # 调用Grok客户端处理请求
-        result = await GrokClient.openai_to_grok(request.model_dump())
+        cancel = CancelToken()
+        result = await GrokClient.openai_to_grok(
+            request.model_dump(),
+            cancel=cancel,
+            priority=_request_priority(raw_request),
+            hedge=not request.stream
+        )
         
-        # 如果是流式响应，GrokClient已经返回了Iterator，直接包装为StreamingResponse
+        # 如果是流式响应，GrokClient已经返回了Iterator，包装断开检测后返回StreamingResponse
         if request.stream:
             return StreamingResponse(
-                content=result,
+                content=_stream_with_disconnect(raw_request, result, cancel),
                 media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
@@ -63,8 +117,16 @@ async def chat_completions(
         
     except GrokApiException as e:
         logger.error(f"[Chat] Grok API错误: {str(e)} - 详情: {e.details}")
+
+        # 无可用Token或排队已满时返回可重试状态码，并提示客户端退避时间
+        status_code, headers = 500, None
+        retry_after = e.details.get("retry_after")
+        if retry_after is not None:
+            status_code = 429 if e.error_code == "QUEUE_FULL" else 503
+            headers = {"Retry-After": str(retry_after)}
         raise HTTPException(
-            status_code=500,
+            status_code=status_code,
+            headers=headers,
             detail={
                 "error": {
                     "message": str(e),
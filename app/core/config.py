@@ -2,7 +2,7 @@
 
 import toml
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 
 class ConfigManager:
@@ -51,17 +51,24 @@ class ConfigManager:
         """设置存储实例"""
         self._storage = storage
 
+    async def start(self) -> None:
+        """存储支持变更通知时，订阅其他节点的配置变更（存储同步到本地文件后重新加载）"""
+        if hasattr(self._storage, "subscribe_config"):
+            await self._storage.subscribe_config(self.reload)
+
     def load(self, section: str) -> Dict[str, Any]:
         """配置加载器"""
         try:
             with open(self.config_path, "r", encoding="utf-8") as f:
                 config = toml.load(f)[section]
 
-                # 自动将 SOCKS5 转换为 SOCKS5H
-                if section == "grok" and "proxy_url" in config:
-                    proxy_url = config["proxy_url"]
-                    if proxy_url and proxy_url.startswith("socks5://"):
-                        config["proxy_url"] = proxy_url.replace("socks5://", "socks5h://", 1)
+                # 自动将 SOCKS5 转换为 SOCKS5H（逗号分隔的多个代理逐个转换）
+                if section == "grok" and config.get("proxy_url"):
+                    config["proxy_url"] = ",".join(
+                        proxy.replace("socks5://", "socks5h://", 1) if proxy.startswith("socks5://") else proxy
+                        for proxy in (p.strip() for p in config["proxy_url"].split(","))
+                        if proxy
+                    )
 
                 # 自动为 CF Clearance 添加前缀
                 if section == "grok" and "cf_clearance" in config:
@@ -120,9 +127,15 @@ class ConfigManager:
         # 重新加载配置
         await self.reload()
     
+    def get_service_proxies(self) -> List[str]:
+        """获取服务代理URL列表（proxy_url 可用逗号分隔多个代理，按顺序作为备用）"""
+        proxy_url = self.grok_config.get("proxy_url", "") or ""
+        return [p.strip() for p in proxy_url.split(",") if p.strip()]
+
     def get_service_proxy(self) -> str:
-        """获取服务代理URL（用于 client 和 upload）"""
-        return self.grok_config.get("proxy_url", "")
+        """获取服务代理URL（用于 client 和 upload），配置多个时取第一个"""
+        proxies = self.get_service_proxies()
+        return proxies[0] if proxies else ""
     
     def get_cache_proxy(self) -> str:
         """获取缓存代理URL（用于 cache）
@@ -132,7 +145,7 @@ class ConfigManager:
         - 如果同时设置了 proxy_url 和 cache_proxy_url，缓存使用 cache_proxy_url
         """
         cache_proxy = self.grok_config.get("cache_proxy_url", "")
-        service_proxy = self.grok_config.get("proxy_url", "")
+        service_proxy = self.get_service_proxy()
         
         # 如果设置了 cache_proxy_url，优先使用
         if cache_proxy:
@@ -47,7 +47,8 @@ async def http_exception_handler(_: Request, exc: StarletteHTTPException) -> JSO
 
     return JSONResponse(
         status_code=exc.status_code,
-        content=build_error_response(message, error_type)
+        content=build_error_response(message, error_type),
+        headers=getattr(exc, "headers", None)
     )
 
 
@@ -77,6 +78,8 @@ async def grok_api_exception_handler(_: Request, exc: GrokApiException) -> JSONR
         "NO_RESPONSE": status.HTTP_502_BAD_GATEWAY,
         "TOKEN_SAVE_ERROR": status.HTTP_500_INTERNAL_SERVER_ERROR,
         "NO_AVAILABLE_TOKEN": status.HTTP_503_SERVICE_UNAVAILABLE,
+        "QUEUE_FULL": status.HTTP_429_TOO_MANY_REQUESTS,
+        "UPSTREAM_TIMEOUT": status.HTTP_504_GATEWAY_TIMEOUT,
     }
 
     http_status = status_code_map.get(exc.error_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -91,13 +94,20 @@ async def grok_api_exception_handler(_: Request, exc: GrokApiException) -> JSONR
         "NO_RESPONSE": "api_error",
         "TOKEN_SAVE_ERROR": "api_error",
         "NO_AVAILABLE_TOKEN": "api_error",
+        "QUEUE_FULL": "rate_limit_error",
+        "UPSTREAM_TIMEOUT": "api_error",
     }
 
     error_type = error_type_map.get(exc.error_code, "api_error")
 
+    # 无可用Token或排队已满时提示客户端退避时间
+    retry_after = exc.details.get("retry_after")
+    headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+
     return JSONResponse(
         status_code=http_status,
-        content=build_error_response(exc.message, error_type, exc.error_code)
+        content=build_error_response(exc.message, error_type, exc.error_code),
+        headers=headers
     )
 
 
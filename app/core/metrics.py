@@ -0,0 +1,41 @@
+"""运行指标模块"""
+
+import time
+from collections import defaultdict
+from typing import Dict, Any
+
+
+class MetricsRegistry:
+    """
+    进程内运行指标
+
+    以名称为键的简单计数器，用于统计取消、重试等事件，供管理接口查看。
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._started_at = time.time()
+
+    def inc(self, name: str, value: int = 1) -> None:
+        """计数器累加"""
+        self._counters[name] += value
+
+    def get(self, name: str) -> int:
+        """获取计数器当前值"""
+        return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取所有指标快照"""
+        return {
+            "uptime_seconds": round(time.time() - self._started_at, 1),
+            "counters": dict(sorted(self._counters.items()))
+        }
+
+    def reset(self) -> None:
+        """清空所有计数器"""
+        self._counters.clear()
+        self._started_at = time.time()
+
+
+# 全局指标实例
+metrics = MetricsRegistry()
@@ -1,20 +1,124 @@
-"""存储抽象层 - 支持文件、MySQL和Redis存储"""
+"""存储抽象层 - 支持文件、共享内存、MySQL和Redis存储"""
 
 import os
 import json
+import uuid
+import fcntl
 import toml
 import asyncio
+import sqlite3
 import warnings
 import aiofiles
 from pathlib import Path
-from typing import Dict, Any, Optional, Literal
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, List, Optional, Literal, Set, Tuple
 from abc import ABC, abstractmethod
 from urllib.parse import urlparse, unquote
 
 from app.core.logger import logger
-
-
-StorageMode = Literal["file", "mysql", "redis"]
+from app.core.token_table import SharedTokenTable, DEFAULT_CAPACITY, TABLE_FIELDS
+
+
+StorageMode = Literal["file", "shm", "mysql", "redis", "sqlite"]
+
+# 常量定义
+TOKEN_TYPES = ("ssoNormal", "ssoSuper")
+REDIS_TOKEN_KEY = "grok:token:{}"  # 每个Token一个哈希，字段值为 JSON
+REDIS_TOKEN_SET_KEY = "grok:tokens:{}"  # 各类型的Token集合
+REDIS_TOKEN_CHANNEL = "grok:tokens:changed"  # Token变更通知频道
+REDIS_CONFIG_CHANNEL = "grok:settings:changed"  # 配置变更通知频道
+REDIS_LEGACY_TOKEN_KEY = "grok:tokens"  # 旧版整体JSON存储的键
+REDIS_TYPE_FIELD = "_type"
+REDIS_RESUBSCRIBE_DELAY = 3  # 订阅中断后重连间隔（秒）
+SHM_POLL_INTERVAL = 0.1  # 共享Token表变更轮询间隔（秒）
+JOURNAL_COMPACT_INTERVAL = 60  # Token日志后台压缩间隔（秒）
+JOURNAL_COMPACT_RECORDS = 5000  # Token日志记录数超过该值时提前压缩
+MYSQL_BATCH_SIZE = 500  # 批量写入/删除/读取的行数
+MYSQL_POLL_INTERVAL = 2  # 轮询变更记录的间隔（秒）
+MYSQL_CHANGE_RETENTION = 3600  # 变更记录保留时长（秒）
+MYSQL_PRUNE_EVERY = 30  # 每轮询多少次清理一次过期的变更记录
+MYSQL_CHANGE_LOOKBACK = 200  # 每次轮询回看已处理序号之前的记录数（补上晚提交的变更）
+
+# Token字段 -> 数据库Token表的列（其余字段以 JSON 存入 extra 列）
+TOKEN_COLUMNS = {
+    "status": "status",
+    "remainingQueries": "remaining_queries",
+    "heavyremainingQueries": "heavy_remaining_queries",
+    "failedCount": "failed_count",
+    "lastFailureTime": "last_failure_time",
+    "lastFailureReason": "last_failure_reason",
+    "createdTime": "created_time"
+}
+TOKEN_INT_DEFAULTS = {"remainingQueries": -1, "heavyremainingQueries": -1, "failedCount": 0}
+_TOKEN_ROW_COLUMNS = ["sso", "token_type", *TOKEN_COLUMNS.values(), "extra"]
+MYSQL_UPSERT_TOKEN_SQL = (
+    f"INSERT INTO grok_tokens ({', '.join(_TOKEN_ROW_COLUMNS)}) "
+    f"VALUES ({', '.join(['%s'] * len(_TOKEN_ROW_COLUMNS))}) "
+    f"ON DUPLICATE KEY UPDATE {', '.join(f'{c} = VALUES({c})' for c in _TOKEN_ROW_COLUMNS[1:])}"
+)
+SQLITE_UPSERT_TOKEN_SQL = (
+    f"INSERT INTO tokens ({', '.join(_TOKEN_ROW_COLUMNS)}) "
+    f"VALUES ({', '.join(['?'] * len(_TOKEN_ROW_COLUMNS))}) "
+    f"ON CONFLICT(sso) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in _TOKEN_ROW_COLUMNS[1:])}"
+)
+
+# 按Token原子写回变更并返回最新数据
+# KEYS: Token哈希, 所属类型集合, 另一类型集合
+# ARGV: 模式(replace/update/delete), Token类型, 字段值(JSON), 计数增量(JSON), sso
+# 计数增量与 GrokTokenManager 一致：非数值或负值（未知）保持不变，结果不小于 0
+REDIS_APPLY_TOKEN_SCRIPT = """
+local key, mode, sso = KEYS[1], ARGV[1], ARGV[5]
+if mode == 'delete' or mode == 'replace' then
+    redis.call('DEL', key)
+    redis.call('SREM', KEYS[2], sso)
+    redis.call('SREM', KEYS[3], sso)
+    if mode == 'delete' then
+        return false
+    end
+    redis.call('HSET', key, '_type', ARGV[2])
+    redis.call('SADD', KEYS[2], sso)
+elseif redis.call('EXISTS', key) == 0 then
+    return false
+end
+for field, value in pairs(cjson.decode(ARGV[3])) do
+    redis.call('HSET', key, field, value)
+end
+for field, delta in pairs(cjson.decode(ARGV[4])) do
+    local current = tonumber(redis.call('HGET', key, field))
+    if current and current >= 0 then
+        redis.call('HSET', key, field, math.max(0, current + delta))
+    end
+end
+return redis.call('HGETALL', key)
+"""
+
+TokenEntry = Optional[Tuple[str, Dict[str, Any]]]  # (Token类型, 数据)，Token不存在时为 None
+
+
+def _token_row(sso: str, token_type: str, data: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Token数据 -> 数据库Token表的行"""
+    values = []
+    for field in TOKEN_COLUMNS:
+        value = data.get(field)
+        if field in TOKEN_INT_DEFAULTS:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                value = TOKEN_INT_DEFAULTS[field]
+        elif field == "status":
+            value = value or "active"
+        values.append(value)
+    extra = {k: v for k, v in data.items() if k not in TOKEN_COLUMNS}
+    return (sso, token_type, *values, json.dumps(extra, ensure_ascii=False) if extra else None)
+
+
+def _row_token(row: Tuple[Any, ...]) -> Tuple[str, str, Dict[str, Any]]:
+    """数据库Token表的行 -> (sso, Token类型, 数据)"""
+    sso, token_type, *values, extra = row
+    data = dict(zip(TOKEN_COLUMNS, values))
+    if extra:
+        data.update(json.loads(extra))
+    return sso, token_type, data
 
 
 class BaseStorage(ABC):
@@ -52,9 +156,14 @@ class FileStorage(BaseStorage):
     def __init__(self, data_dir: Path):
         self.data_dir = data_dir
         self.token_file = data_dir / "token.json"
+        self.token_journal = data_dir / "token.journal"
+        self.token_lock_file = data_dir / "token.lock"
         self.config_file = data_dir / "setting.toml"
         self._token_lock = asyncio.Lock()
         self._config_lock = asyncio.Lock()
+        self._journal_records = 0
+        self._compact_event = asyncio.Event()
+        self._compact_task: Optional[asyncio.Task] = None
 
     async def init_db(self) -> None:
         """初始化文件存储"""
@@ -65,6 +174,10 @@ class FileStorage(BaseStorage):
             await self._write_file(self.token_file, json.dumps({"ssoNormal": {}, "ssoSuper": {}}, indent=2, ensure_ascii=False))
             logger.info("[Storage] 创建新的token文件")
 
+        # 上次未正常关闭时残留的日志合并进快照
+        if self.token_journal.exists():
+            await self.compact()
+
         # 初始化配置文件
         if not self.config_file.exists():
             default_config = {
@@ -98,9 +211,30 @@ class FileStorage(BaseStorage):
             return await f.read()
 
     async def _write_file(self, file_path: Path, content: str) -> None:
-        """写入文件内容"""
-        async with aiofiles.open(file_path, "w", encoding="utf-8") as f:
-            await f.write(content)
+        """写入文件内容（先写临时文件再原子替换，写入中途崩溃不会损坏原文件）"""
+        await asyncio.to_thread(self._replace_file, file_path, content)
+
+    @staticmethod
+    def _replace_file(file_path: Path, content: str) -> None:
+        """写入临时文件、fsync 后原子替换（在线程中执行，磁盘同步不阻塞事件循环）"""
+        tmp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    @staticmethod
+    def _append_file(file_path: Path, content: str) -> None:
+        """追加写入并 fsync（在线程中执行，磁盘同步不阻塞事件循环）"""
+        with open(file_path, "a", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
 
     async def _load_json(self, file_path: Path, default: Dict[str, Any], lock: asyncio.Lock) -> Dict[str, Any]:
         """加载JSON文件"""
@@ -142,13 +276,136 @@ class FileStorage(BaseStorage):
             logger.error(f"[Storage] 保存{file_path.name}失败: {e}")
             raise
 
+    @asynccontextmanager
+    async def _locked_tokens(self) -> AsyncIterator[None]:
+        """持有Token文件锁：进程内的 asyncio 锁 + 跨进程的 flock（data/token.lock）
+
+        同一数据目录下的多个 worker（shm 模式）追加日志、压缩与读取时互斥。
+        """
+        async with self._token_lock:
+            fd = os.open(self.token_lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            locking = asyncio.ensure_future(asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX))
+            try:
+                await asyncio.shield(locking)
+            except asyncio.CancelledError:
+                # 等待期间被取消：拿到锁后随即关闭以释放
+                locking.add_done_callback(lambda _: os.close(fd))
+                raise
+            try:
+                yield
+            finally:
+                os.close(fd)
+
     async def load_tokens(self) -> Dict[str, Any]:
-        """加载token数据"""
-        return await self._load_json(self.token_file, {"ssoNormal": {}, "ssoSuper": {}}, self._token_lock)
+        """加载token数据（快照 + 重放日志）"""
+        async with self._locked_tokens():
+            return await self._replay_journal()
 
     async def save_tokens(self, data: Dict[str, Any]) -> None:
-        """保存token数据"""
-        await self._save_json(self.token_file, data, self._token_lock)
+        """保存token数据（整体写入快照并清空日志）"""
+        async with self._locked_tokens():
+            await self._write_snapshot(data)
+
+    async def save_token_rows(self, upserts: Dict[str, Tuple[str, Dict[str, Any]]], deletes: List[str]) -> None:
+        """只追加变更的Token到日志，由后台任务定期压缩为快照
+
+        Args:
+            upserts: sso -> (Token类型, 数据)
+            deletes: 已删除的 sso 列表
+        """
+        records = [{"s": sso, "t": token_type, "d": data} for sso, (token_type, data) in upserts.items()]
+        records += [{"s": sso, "x": 1} for sso in deletes]
+        await self._append_journal(records)
+
+    async def _append_journal(self, records: List[Dict[str, Any]]) -> None:
+        """追加日志记录：d 为整体替换，f 为字段合并，x 为删除"""
+        lines = [json.dumps(record, ensure_ascii=False, separators=(",", ":")) for record in records]
+        if not lines:
+            return
+        try:
+            async with self._locked_tokens():
+                await asyncio.to_thread(self._append_file, self.token_journal, "\n".join(lines) + "\n")
+                self._journal_records += len(lines)
+        except Exception as e:
+            logger.error(f"[Storage] 写入{self.token_journal.name}失败: {e}")
+            raise
+
+        if not self._compact_task:
+            self._compact_task = asyncio.create_task(self._compact_loop())
+        if self._journal_records >= JOURNAL_COMPACT_RECORDS:
+            self._compact_event.set()
+
+    async def _replay_journal(self) -> Dict[str, Any]:
+        """读取快照并按顺序重放日志（调用方需持有Token文件锁）"""
+        data = {"ssoNormal": {}, "ssoSuper": {}}
+        try:
+            if self.token_file.exists():
+                data = json.loads(await self._read_file(self.token_file))
+        except Exception as e:
+            logger.error(f"[Storage] 加载{self.token_file.name}失败: {e}")
+
+        if not self.token_journal.exists():
+            self._journal_records = 0
+            return data
+
+        records = 0
+        for line in (await self._read_file(self.token_journal)).splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 崩溃时未写完的末尾记录
+                logger.warning(f"[Storage] 跳过{self.token_journal.name}中不完整的记录")
+                continue
+            records += 1
+            sso = record["s"]
+            if "f" in record:
+                # 字段合并：只覆盖写入方变更的字段，Token已删除时忽略
+                for tokens in data.values():
+                    if sso in tokens:
+                        tokens[sso].update(record["f"])
+                continue
+            for tokens in data.values():
+                tokens.pop(sso, None)
+            if not record.get("x"):
+                data.setdefault(record["t"], {})[sso] = record["d"]
+        self._journal_records = records
+        return data
+
+    async def _write_snapshot(self, data: Dict[str, Any]) -> None:
+        """原子写入快照后清空日志（调用方需持有Token文件锁）"""
+        await self._write_file(self.token_file, json.dumps(data, indent=2, ensure_ascii=False))
+        if self.token_journal.exists():
+            self.token_journal.unlink()
+        self._journal_records = 0
+
+    async def compact(self) -> None:
+        """将日志合并进快照"""
+        async with self._locked_tokens():
+            if not self._journal_records and not self.token_journal.exists():
+                return
+            await self._write_snapshot(await self._replay_journal())
+        logger.debug("[Storage] Token日志已压缩为快照")
+
+    async def _compact_loop(self) -> None:
+        """后台压缩：按间隔或日志记录数达到阈值时执行"""
+        while True:
+            try:
+                await asyncio.wait_for(self._compact_event.wait(), JOURNAL_COMPACT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._compact_event.clear()
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.warning(f"[Storage] 压缩Token日志失败: {e}")
+
+    async def close(self) -> None:
+        """停止后台压缩并将剩余日志合并进快照"""
+        if self._compact_task:
+            self._compact_task.cancel()
+            await asyncio.gather(self._compact_task, return_exceptions=True)
+            self._compact_task = None
+        await self.compact()
 
     async def load_config(self) -> Dict[str, Any]:
         """加载配置数据"""
@@ -160,13 +417,25 @@ class FileStorage(BaseStorage):
 
 
 class MysqlStorage(BaseStorage):
-    """MySQL存储实现"""
+    """MySQL存储实现
+
+    Token按每个SSO一行存储；每次写入Token或配置时追加一条变更记录（grok_changes），
+    各节点轮询自增序号大于已处理序号的记录，重新读取变更的Token或同步配置。
+    自增序号在插入时分配、提交顺序可能不同，轮询时回看最近一段序号并按序号去重，
+    补上先分配序号、后提交的变更。
+    """
 
     def __init__(self, database_url: str, data_dir: Path):
         self.database_url = database_url
         self.data_dir = data_dir
         self._pool = None
         self._file = FileStorage(data_dir)
+        self._node_id = uuid.uuid4().hex
+        self._last_change = 0
+        self._seen_changes: Set[int] = set()  # 回看窗口内已处理的序号
+        self._poll_task: Optional[asyncio.Task] = None
+        self._token_callback: Optional[Callable[[Dict[str, TokenEntry]], None]] = None
+        self._config_callback: Optional[Callable[[], Awaitable[None]]] = None
 
     async def init_db(self) -> None:
         """初始化MySQL"""
@@ -188,7 +457,8 @@ class MysqlStorage(BaseStorage):
             # 创建表
             await self._create_tables()
 
-            # 初始化文件存储和同步数据
+            # 记录当前变更序号（同步之后的变更由轮询处理），初始化文件存储和同步数据
+            await self._load_recent_changes()
             await self._file.init_db()
             await self._sync_data()
 
@@ -236,10 +506,19 @@ class MysqlStorage(BaseStorage):
         tables = {
             "grok_tokens": """
                 CREATE TABLE IF NOT EXISTS grok_tokens (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    data JSON NOT NULL,
+                    sso VARCHAR(512) CHARACTER SET ascii NOT NULL PRIMARY KEY,
+                    token_type VARCHAR(16) NOT NULL,
+                    status VARCHAR(16) NOT NULL DEFAULT 'active',
+                    remaining_queries INT NOT NULL DEFAULT -1,
+                    heavy_remaining_queries INT NOT NULL DEFAULT -1,
+                    failed_count INT NOT NULL DEFAULT 0,
+                    last_failure_time BIGINT NULL,
+                    last_failure_reason TEXT NULL,
+                    created_time BIGINT NULL,
+                    extra JSON NULL,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    KEY idx_status_remaining (status, remaining_queries),
+                    KEY idx_status_heavy_remaining (status, heavy_remaining_queries)
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
             """,
             "grok_settings": """
@@ -249,11 +528,29 @@ class MysqlStorage(BaseStorage):
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            "grok_changes": """
+                CREATE TABLE IF NOT EXISTS grok_changes (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    node CHAR(32) NOT NULL,
+                    kind VARCHAR(16) NOT NULL,
+                    sso VARCHAR(512) CHARACTER SET ascii NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    KEY idx_created (created_at)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
             """
         }
 
         async with self._pool.acquire() as conn:
             async with conn.cursor() as cursor:
+                # 旧版整表JSON的 grok_tokens 改名保留，供迁移到逐行存储
+                await cursor.execute("SHOW TABLES LIKE 'grok_tokens'")
+                if await cursor.fetchone():
+                    await cursor.execute("SHOW COLUMNS FROM grok_tokens LIKE 'sso'")
+                    if not await cursor.fetchone():
+                        await cursor.execute("RENAME TABLE grok_tokens TO grok_tokens_legacy")
+                        logger.info("[Storage] 旧版grok_tokens表已改名为grok_tokens_legacy")
+
                 with warnings.catch_warnings():
                     warnings.filterwarnings('ignore', message='.*already exists')
                     for sql in tables.values():
@@ -261,30 +558,167 @@ class MysqlStorage(BaseStorage):
                 logger.info("[Storage] MySQL表创建/验证成功")
 
     async def _sync_data(self) -> None:
-        """同步数据"""
+        """同步数据
+
+        Token：数据库中已有Token行时同步到文件；否则从旧版整表JSON或文件初始化到数据库。
+        配置：数据库与文件之间整体同步。
+        """
         try:
-            for table, key in [("grok_tokens", "sso"), ("grok_settings", "global")]:
-                data = await self._load_db(table)
-                if data:
-                    if table == "grok_tokens":
-                        await self._file.save_tokens(data)
-                    else:
-                        await self._file.save_config(data)
-                    logger.info(f"[Storage] {table.split('_')[1]}数据已从数据库同步到文件")
-                else:
-                    if table == "grok_tokens":
-                        file_data = await self._file.load_tokens()
-                        if file_data.get(key) or file_data.get("ssoSuper"):
-                            await self._save_db(table, file_data)
-                            logger.info("[Storage] Token数据已从文件初始化到数据库")
-                    else:
-                        file_data = await self._file.load_config()
-                        if file_data.get(key) or file_data.get("grok"):
-                            await self._save_db(table, file_data)
-                            logger.info("[Storage] 配置数据已从文件初始化到数据库")
+            tokens = await self._load_token_rows()
+            if any(tokens.values()):
+                await self._file.save_tokens(tokens)
+                logger.info("[Storage] tokens数据已从数据库同步到文件")
+            else:
+                legacy = await self._load_legacy_tokens()
+                source = legacy or await self._file.load_tokens()
+                if any(source.get(token_type) for token_type in TOKEN_TYPES):
+                    await self.save_tokens(source)
+                    logger.info(f"[Storage] Token数据已从{'旧版数据库表' if legacy else '文件'}初始化到数据库")
+
+            data = await self._load_db("grok_settings")
+            if data:
+                await self._file.save_config(data)
+                logger.info("[Storage] settings数据已从数据库同步到文件")
+            else:
+                file_data = await self._file.load_config()
+                if file_data.get("global") or file_data.get("grok"):
+                    await self._save_db("grok_settings", file_data)
+                    logger.info("[Storage] 配置数据已从文件初始化到数据库")
         except Exception as e:
             logger.warning(f"[Storage] 数据同步失败: {e}")
 
+    async def _load_legacy_tokens(self) -> Optional[Dict[str, Any]]:
+        """读取旧版整表JSON的Token数据（grok_tokens_legacy），不存在时返回 None"""
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SHOW TABLES LIKE 'grok_tokens_legacy'")
+                if not await cursor.fetchone():
+                    return None
+        return await self._load_db("grok_tokens_legacy")
+
+    async def _load_token_rows(self) -> Dict[str, Any]:
+        """以流式游标分批读取全部Token行"""
+        import aiomysql
+        data: Dict[str, Any] = {token_type: {} for token_type in TOKEN_TYPES}
+        async with self._pool.acquire() as conn:
+            async with conn.cursor(aiomysql.SSCursor) as cursor:
+                await cursor.execute(f"SELECT {', '.join(_TOKEN_ROW_COLUMNS)} FROM grok_tokens")
+                while rows := await cursor.fetchmany(MYSQL_BATCH_SIZE):
+                    for row in rows:
+                        sso, token_type, token_data = _row_token(row)
+                        data.setdefault(token_type, {})[sso] = token_data
+        return data
+
+    async def save_token_rows(self, upserts: Dict[str, Tuple[str, Dict[str, Any]]], deletes: List[str]) -> None:
+        """只写入变更的Token行：分批 INSERT ... ON DUPLICATE KEY UPDATE 与 DELETE
+
+        Args:
+            upserts: sso -> (Token类型, 数据)
+            deletes: 已删除的 sso 列表
+        """
+        rows = [_token_row(sso, token_type, data) for sso, (token_type, data) in upserts.items()]
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    for start in range(0, len(rows), MYSQL_BATCH_SIZE):
+                        await cursor.executemany(MYSQL_UPSERT_TOKEN_SQL, rows[start:start + MYSQL_BATCH_SIZE])
+                    for start in range(0, len(deletes), MYSQL_BATCH_SIZE):
+                        batch = deletes[start:start + MYSQL_BATCH_SIZE]
+                        await cursor.execute(
+                            f"DELETE FROM grok_tokens WHERE sso IN ({', '.join(['%s'] * len(batch))})", batch
+                        )
+                    changed = [(self._node_id, "token", sso) for sso in [*upserts, *deletes]]
+                    for start in range(0, len(changed), MYSQL_BATCH_SIZE):
+                        await cursor.executemany(
+                            "INSERT INTO grok_changes (node, kind, sso) VALUES (%s, %s, %s)", changed[start:start + MYSQL_BATCH_SIZE]
+                        )
+        except Exception as e:
+            logger.error(f"[Storage] 保存Token行到数据库失败: {e}")
+            raise
+
+    async def _load_recent_changes(self) -> None:
+        """记录当前最大序号，并将回看窗口内已可见的记录视为已处理"""
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT id FROM grok_changes ORDER BY id DESC LIMIT %s", (MYSQL_CHANGE_LOOKBACK,))
+                ids = [row[0] for row in await cursor.fetchall()]
+        self._last_change = ids[0] if ids else 0
+        self._seen_changes = set(ids)
+
+    async def subscribe_tokens(self, callback: Callable[[Dict[str, TokenEntry]], None]) -> None:
+        """订阅其他节点的Token变更，发现变更后读取最新数据并回调"""
+        self._token_callback = callback
+        self._start_polling()
+
+    async def subscribe_config(self, callback: Callable[[], Awaitable[None]]) -> None:
+        """订阅其他节点的配置变更，发现变更后同步到本地文件并回调"""
+        self._config_callback = callback
+        self._start_polling()
+
+    def _start_polling(self) -> None:
+        if not self._poll_task:
+            self._poll_task = asyncio.create_task(self._poll_changes())
+
+    async def _poll_changes(self) -> None:
+        """轮询变更记录（按自增序号，走主键索引），并定期清理过期记录"""
+        polls = 0
+        while True:
+            await asyncio.sleep(MYSQL_POLL_INTERVAL)
+            try:
+                async with self._pool.acquire() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(
+                            "SELECT id, node, kind, sso FROM grok_changes WHERE id > %s ORDER BY id LIMIT %s",
+                            (max(0, self._last_change - MYSQL_CHANGE_LOOKBACK), MYSQL_CHANGE_LOOKBACK + MYSQL_BATCH_SIZE)
+                        )
+                        rows = [row for row in await cursor.fetchall() if row[0] not in self._seen_changes]
+                        polls += 1
+                        if polls % MYSQL_PRUNE_EVERY == 0:
+                            await cursor.execute(
+                                "DELETE FROM grok_changes WHERE created_at < NOW() - INTERVAL %s SECOND", (MYSQL_CHANGE_RETENTION,)
+                            )
+                if not rows:
+                    continue
+                self._last_change = max(self._last_change, rows[-1][0])
+                self._seen_changes.update(row[0] for row in rows)
+                self._seen_changes = {i for i in self._seen_changes if i > self._last_change - MYSQL_CHANGE_LOOKBACK}
+
+                remote = [(kind, sso) for _, node, kind, sso in rows if node != self._node_id]
+                tokens = list(dict.fromkeys(sso for kind, sso in remote if kind == "token"))
+                if tokens and self._token_callback:
+                    self._token_callback(await self._load_token_entries(tokens))
+                if any(kind == "config" for kind, _ in remote):
+                    await self._refresh_config()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[Storage] 轮询数据库变更失败: {e}")
+
+    async def _load_token_entries(self, tokens: List[str]) -> Dict[str, TokenEntry]:
+        """读取指定Token的最新数据（已删除的为 None）"""
+        entries: Dict[str, TokenEntry] = dict.fromkeys(tokens)
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                for start in range(0, len(tokens), MYSQL_BATCH_SIZE):
+                    batch = tokens[start:start + MYSQL_BATCH_SIZE]
+                    await cursor.execute(
+                        f"SELECT {', '.join(_TOKEN_ROW_COLUMNS)} FROM grok_tokens WHERE sso IN ({', '.join(['%s'] * len(batch))})", batch
+                    )
+                    for row in await cursor.fetchall():
+                        sso, token_type, token_data = _row_token(row)
+                        entries[sso] = (token_type, token_data)
+        return entries
+
+    async def _refresh_config(self) -> None:
+        """将数据库中的配置同步到本地文件并回调"""
+        data = await self._load_db("grok_settings")
+        if not data:
+            return
+        await self._file.save_config(data)
+        if self._config_callback:
+            await self._config_callback()
+        logger.info("[Storage] 已同步其他节点的配置变更")
+
     async def _load_db(self, table: str) -> Optional[Dict[str, Any]]:
         """从数据库加载数据"""
         try:
@@ -316,12 +750,15 @@ class MysqlStorage(BaseStorage):
 
     async def load_tokens(self) -> Dict[str, Any]:
         """加载token数据"""
-        return await self._file.load_tokens()
+        return await self._load_token_rows()
 
     async def save_tokens(self, data: Dict[str, Any]) -> None:
-        """保存token数据"""
+        """保存token数据（整体替换：写入全部行并删除多余的行）"""
         await self._file.save_tokens(data)
-        await self._save_db("grok_tokens", data)
+        upserts = {sso: (token_type, token_data) for token_type, tokens in data.items() for sso, token_data in tokens.items()}
+        existing = await self._load_token_rows()
+        deletes = [sso for tokens in existing.values() for sso in tokens if sso not in upserts]
+        await self.save_token_rows(upserts, deletes)
 
     async def load_config(self) -> Dict[str, Any]:
         """加载配置数据"""
@@ -331,9 +768,19 @@ class MysqlStorage(BaseStorage):
         """保存配置数据"""
         await self._file.save_config(data)
         await self._save_db("grok_settings", data)
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("INSERT INTO grok_changes (node, kind) VALUES (%s, 'config')", (self._node_id,))
+        except Exception as e:
+            logger.warning(f"[Storage] 记录配置变更失败: {e}")
 
     async def close(self) -> None:
-        """关闭连接"""
+        """停止轮询并关闭连接"""
+        if self._poll_task:
+            self._poll_task.cancel()
+            await asyncio.gather(self._poll_task, return_exceptions=True)
+            self._poll_task = None
         if self._pool:
             self._pool.close()
             await self._pool.wait_closed()
@@ -341,13 +788,25 @@ class MysqlStorage(BaseStorage):
 
 
 class RedisStorage(BaseStorage):
-    """Redis存储实现"""
+    """Redis存储实现
+
+    Token按个存储为哈希（grok:token:<sso>），多个进程与节点共享同一份状态：
+    - 写回按字段进行，计数（剩余次数、失败次数）以 Lua 脚本原子累加，不会互相覆盖
+    - 每次写回后通过 pub/sub 通知其他实例重新读取变更的Token
+    - 配置保存后同样通过 pub/sub 通知其他实例同步到本地文件并重新加载
+    """
 
     def __init__(self, redis_url: str, data_dir: Path):
         self.redis_url = redis_url
         self.data_dir = data_dir
         self._redis = None
         self._file = FileStorage(data_dir)
+        self._apply_script = None
+        self._node_id = uuid.uuid4().hex
+        self._pubsub = None
+        self._listen_task: Optional[asyncio.Task] = None
+        self._token_callback: Optional[Callable[[Dict[str, TokenEntry]], None]] = None
+        self._config_callback: Optional[Callable[[], Awaitable[None]]] = None
 
     async def init_db(self) -> None:
         """初始化Redis"""
@@ -366,6 +825,7 @@ class RedisStorage(BaseStorage):
             # 测试连接
             await self._redis.ping()
             logger.info(f"[Storage] Redis连接成功: {parsed['host']}:{parsed['port']}/{parsed['db']}")
+            self._apply_script = self._redis.register_script(REDIS_APPLY_TOKEN_SCRIPT)
 
             # 初始化文件存储和同步数据
             await self._file.init_db()
@@ -398,26 +858,31 @@ class RedisStorage(BaseStorage):
         return result
 
     async def _sync_data(self) -> None:
-        """同步数据"""
+        """同步数据
+
+        Token：Redis中尚无逐Token数据时，从旧版整体JSON或文件迁移；否则同步到文件作为本地备份。
+        配置：Redis与文件之间整体同步。
+        """
         try:
-            for key, file_func, key_name in [
-                ("grok:tokens", self._file.load_tokens, "sso"),
-                ("grok:settings", self._file.load_config, "global")
-            ]:
-                data = await self._redis.get(key)
-                if data:
-                    parsed = json.loads(data)
-                    if key == "grok:tokens":
-                        await self._file.save_tokens(parsed)
-                    else:
-                        await self._file.save_config(parsed)
-                    logger.info(f"[Storage] {key.split(':')[1]}数据已从Redis同步到文件")
-                else:
-                    file_data = await file_func()
-                    if file_data.get(key_name) or (key == "grok:tokens" and file_data.get("ssoSuper")):
-                        json_data = json.dumps(file_data, ensure_ascii=False)
-                        await self._redis.set(key, json_data)
-                        logger.info(f"[Storage] {key.split(':')[1]}数据已从文件初始化到Redis")
+            if await self._token_count():
+                await self._file.save_tokens(await self.load_tokens())
+                logger.info("[Storage] tokens数据已从Redis同步到文件")
+            else:
+                legacy = await self._redis.get(REDIS_LEGACY_TOKEN_KEY)
+                file_data = json.loads(legacy) if legacy else await self._file.load_tokens()
+                if any(file_data.get(token_type) for token_type in TOKEN_TYPES):
+                    await self.save_tokens(file_data)
+                    logger.info(f"[Storage] tokens数据已从{'旧版Redis数据' if legacy else '文件'}初始化到Redis")
+
+            data = await self._redis.get("grok:settings")
+            if data:
+                await self._file.save_config(json.loads(data))
+                logger.info("[Storage] settings数据已从Redis同步到文件")
+            else:
+                file_data = await self._file.load_config()
+                if file_data.get("global"):
+                    await self._redis.set("grok:settings", json.dumps(file_data, ensure_ascii=False))
+                    logger.info("[Storage] settings数据已从文件初始化到Redis")
         except Exception as e:
             logger.warning(f"[Storage] 数据同步失败: {e}")
 
@@ -429,14 +894,148 @@ class RedisStorage(BaseStorage):
             logger.error(f"[Storage] 保存到Redis失败: {e}")
             raise
 
+    async def _token_count(self) -> int:
+        counts = await asyncio.gather(*(self._redis.scard(REDIS_TOKEN_SET_KEY.format(t)) for t in TOKEN_TYPES))
+        return sum(counts)
+
+    @staticmethod
+    def _decode_token(raw: Any) -> TokenEntry:
+        """解析Token哈希（HGETALL 结果，字典或扁平列表）"""
+        if not raw:
+            return None
+        if isinstance(raw, list):
+            raw = dict(zip(raw[::2], raw[1::2]))
+        token_type = raw.pop(REDIS_TYPE_FIELD, TOKEN_TYPES[0])
+        data = {}
+        for field, value in raw.items():
+            try:
+                data[field] = json.loads(value)
+            except (TypeError, ValueError):
+                data[field] = value
+        return token_type, data
+
+    async def load_token_entries(self, tokens: Optional[List[str]] = None) -> Dict[str, TokenEntry]:
+        """读取指定Token（未指定时为全部）的最新数据"""
+        if tokens is None:
+            members = await asyncio.gather(*(self._redis.smembers(REDIS_TOKEN_SET_KEY.format(t)) for t in TOKEN_TYPES))
+            tokens = [sso for group in members for sso in group]
+        if not tokens:
+            return {}
+        pipe = self._redis.pipeline(transaction=False)
+        for sso in tokens:
+            pipe.hgetall(REDIS_TOKEN_KEY.format(sso))
+        results = await pipe.execute()
+        return {sso: self._decode_token(raw) for sso, raw in zip(tokens, results)}
+
+    async def apply_token_changes(self, changes: List[Dict[str, Any]]) -> Dict[str, TokenEntry]:
+        """逐Token原子写回变更，通知其他实例，并返回变更后的最新数据
+
+        Args:
+            changes: 变更列表，每项包含 sso，以及 delete（删除）或 type、replace（整体替换）、
+                fields（字段值）、deltas（计数增量）
+        """
+        if not changes:
+            return {}
+        pipe = self._redis.pipeline(transaction=False)
+        for change in changes:
+            sso = change["sso"]
+            token_type = change.get("type") or TOKEN_TYPES[0]
+            other_type = TOKEN_TYPES[1] if token_type == TOKEN_TYPES[0] else TOKEN_TYPES[0]
+            mode = "delete" if change.get("delete") else "replace" if change.get("replace") else "update"
+            fields = {field: json.dumps(value, ensure_ascii=False) for field, value in change.get("fields", {}).items()}
+            await self._apply_script(
+                keys=[REDIS_TOKEN_KEY.format(sso), REDIS_TOKEN_SET_KEY.format(token_type), REDIS_TOKEN_SET_KEY.format(other_type)],
+                args=[mode, token_type, json.dumps(fields, ensure_ascii=False), json.dumps(change.get("deltas", {})), sso],
+                client=pipe
+            )
+        try:
+            results = await pipe.execute()
+        except Exception as e:
+            logger.error(f"[Storage] 写回Token变更到Redis失败: {e}")
+            raise
+
+        entries = {change["sso"]: self._decode_token(raw) for change, raw in zip(changes, results)}
+        try:
+            await self._redis.publish(REDIS_TOKEN_CHANNEL, json.dumps({"node": self._node_id, "tokens": list(entries)}))
+        except Exception as e:
+            logger.warning(f"[Storage] 发布Token变更通知失败: {e}")
+        return entries
+
+    async def subscribe_tokens(self, callback: Callable[[Dict[str, TokenEntry]], None]) -> None:
+        """订阅其他实例的Token变更，收到通知后读取最新数据并回调"""
+        self._token_callback = callback
+        await self._subscribe()
+
+    async def subscribe_config(self, callback: Callable[[], Awaitable[None]]) -> None:
+        """订阅其他实例的配置变更，收到通知后同步到本地文件并回调"""
+        self._config_callback = callback
+        await self._subscribe()
+
+    async def _subscribe(self) -> None:
+        if self._listen_task:
+            return
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(REDIS_TOKEN_CHANNEL, REDIS_CONFIG_CHANNEL)
+        self._listen_task = asyncio.create_task(self._listen_changes())
+
+    async def _listen_changes(self) -> None:
+        """处理变更通知；订阅中断时重连并全量刷新，弥补中断期间错过的通知"""
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    payload = json.loads(message["data"])
+                    if payload.get("node") == self._node_id:
+                        continue
+                    if message["channel"] == REDIS_CONFIG_CHANNEL:
+                        await self._refresh_config()
+                    elif self._token_callback:
+                        self._token_callback(await self.load_token_entries(payload.get("tokens", [])))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[Storage] 变更订阅中断，{REDIS_RESUBSCRIBE_DELAY}秒后重连: {e}")
+                await asyncio.sleep(REDIS_RESUBSCRIBE_DELAY)
+                try:
+                    await self._pubsub.subscribe(REDIS_TOKEN_CHANNEL, REDIS_CONFIG_CHANNEL)
+                    if self._token_callback:
+                        self._token_callback(await self.load_token_entries())
+                    await self._refresh_config()
+                except Exception as retry_error:
+                    logger.warning(f"[Storage] 变更订阅重连失败: {retry_error}")
+
+    async def _refresh_config(self) -> None:
+        """将Redis中的配置同步到本地文件并回调"""
+        data = await self._redis.get("grok:settings")
+        if not data:
+            return
+        await self._file.save_config(json.loads(data))
+        if self._config_callback:
+            await self._config_callback()
+        logger.info("[Storage] 已同步其他实例的配置变更")
+
     async def load_tokens(self) -> Dict[str, Any]:
         """加载token数据"""
-        return await self._file.load_tokens()
+        data: Dict[str, Any] = {token_type: {} for token_type in TOKEN_TYPES}
+        for sso, entry in (await self.load_token_entries()).items():
+            if entry:
+                token_type, token_data = entry
+                data.setdefault(token_type, {})[sso] = token_data
+        return data
 
     async def save_tokens(self, data: Dict[str, Any]) -> None:
-        """保存token数据"""
+        """保存token数据（整体替换）"""
         await self._file.save_tokens(data)
-        await self._save_redis("grok:tokens", data)
+        existing = await self.load_token_entries()
+        changes = [
+            {"sso": sso, "type": token_type, "replace": True, "fields": token_data}
+            for token_type, tokens in data.items()
+            for sso, token_data in tokens.items()
+        ]
+        kept = {change["sso"] for change in changes}
+        changes += [{"sso": sso, "delete": True} for sso in existing if sso not in kept]
+        await self.apply_token_changes(changes)
 
     async def load_config(self) -> Dict[str, Any]:
         """加载配置数据"""
@@ -446,14 +1045,313 @@ class RedisStorage(BaseStorage):
         """保存配置数据"""
         await self._file.save_config(data)
         await self._save_redis("grok:settings", data)
+        try:
+            await self._redis.publish(REDIS_CONFIG_CHANNEL, json.dumps({"node": self._node_id}))
+        except Exception as e:
+            logger.warning(f"[Storage] 发布配置变更通知失败: {e}")
 
     async def close(self) -> None:
         """关闭连接"""
+        if self._listen_task:
+            self._listen_task.cancel()
+            await asyncio.gather(self._listen_task, return_exceptions=True)
+            self._listen_task = None
+        if self._pubsub:
+            await self._pubsub.close()
         if self._redis:
             await self._redis.close()
             logger.info("[Storage] Redis连接已关闭")
 
 
+class SharedMemoryStorage(FileStorage):
+    """共享内存存储实现（单机多进程）
+
+    Token列表与其余字段仍保存在文件中；状态、剩余次数、失败次数与进行中请求数保存在
+    mmap 共享Token表（data/token_table.bin）中，同一主机上的所有 worker 进程读写同一份，
+    按条带锁原子更新，并通过轮询表的变更序号发现其他进程的修改。
+    写回文件时各进程只向共享日志追加自己变更的Token与字段（文件锁互斥），
+    不会以各自不完整的缓存覆盖整个 token.json。
+    """
+
+    def __init__(self, data_dir: Path):
+        super().__init__(data_dir)
+        capacity = int(os.getenv("TOKEN_TABLE_CAPACITY", DEFAULT_CAPACITY))
+        self._table = SharedTokenTable(data_dir / "token_table.bin", capacity)
+        self._tokens: Dict[str, Tuple[str, Dict[str, Any]]] = {}  # sso -> (类型, 完整数据)
+        self._poll_task: Optional[asyncio.Task] = None
+
+    async def init_db(self) -> None:
+        """初始化文件与共享Token表：文件中有而表中没有的Token写入表，表中多余的Token删除"""
+        await super().init_db()
+        self._table.open()
+        data = await super().load_tokens()
+        known = set()
+        for token_type, tokens in data.items():
+            for sso, token_data in tokens.items():
+                known.add(sso)
+                if self._table.get(sso) is None:
+                    self._table.upsert(sso, token_type, token_data)
+        stale = [sso for sso, entry in self._table.entries(list(self._table.versions())).items() if entry and sso not in known]
+        for sso in stale:
+            self._table.delete(sso)
+        logger.info(f"[Storage] 共享Token表已就绪 ({len(known)} 个Token)")
+
+    def _entry(self, sso: str, table_entry: Optional[Tuple[str, Dict[str, Any]]]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """合并文件字段与共享表字段"""
+        if table_entry is None:
+            self._tokens.pop(sso, None)
+            return None
+        token_type, values = table_entry
+        _, cached = self._tokens.get(sso, (token_type, {}))
+        data = {**cached, **values}
+        self._tokens[sso] = (token_type, data)
+        return token_type, dict(data)
+
+    async def load_tokens(self) -> Dict[str, Any]:
+        """加载token数据（共享表字段覆盖文件中的值）"""
+        data = await super().load_tokens()
+        result: Dict[str, Any] = {token_type: {} for token_type in TOKEN_TYPES}
+        for token_type, tokens in data.items():
+            for sso, token_data in tokens.items():
+                self._tokens[sso] = (token_type, dict(token_data))
+                entry = self._entry(sso, self._table.get(sso))
+                if entry:
+                    result.setdefault(entry[0], {})[sso] = entry[1]
+        return result
+
+    async def save_tokens(self, data: Dict[str, Any]) -> None:
+        """保存token数据（整体替换）"""
+        changes = [
+            {"sso": sso, "type": token_type, "replace": True, "fields": token_data}
+            for token_type, tokens in data.items()
+            for sso, token_data in tokens.items()
+        ]
+        kept = {change["sso"] for change in changes}
+        changes += [{"sso": sso, "delete": True} for sso in list(self._tokens) if sso not in kept]
+        await self.apply_token_changes(changes)
+
+    async def apply_token_changes(self, changes: List[Dict[str, Any]]) -> Dict[str, TokenEntry]:
+        """逐Token原子写回变更（计数在共享表中累加），写入文件并返回变更后的最新数据
+
+        Args:
+            changes: 变更列表，格式同 RedisStorage.apply_token_changes
+        """
+        entries: Dict[str, TokenEntry] = {}
+        records: List[Dict[str, Any]] = []
+        for change in changes:
+            sso = change["sso"]
+            if change.get("delete"):
+                self._table.delete(sso)
+                entries[sso] = self._entry(sso, None)
+                records.append({"s": sso, "x": 1})
+                continue
+            fields = change.get("fields", {})
+            if change.get("replace"):
+                self._tokens[sso] = (change["type"], dict(fields))
+                records.append({"s": sso, "t": change["type"], "d": dict(fields)})
+                if not self._table.upsert(sso, change["type"], fields):
+                    entries[sso] = self._tokens[sso]
+                    continue
+                table_entry = self._table.get(sso)
+            else:
+                token_type, cached = self._tokens.get(sso, (change.get("type"), {}))
+                cached.update({k: v for k, v in fields.items() if k not in TABLE_FIELDS})
+                self._tokens[sso] = (token_type, cached)
+                values = self._table.update(sso, fields, change.get("deltas", {}))
+                table_entry = (token_type, values) if values is not None else None
+            entries[sso] = self._entry(sso, table_entry)
+            if entries[sso] is not None and not change.get("replace"):
+                # 只写入本次变更的字段（计数取原子更新后的值）
+                changed = {*fields, *change.get("deltas", {})}
+                records.append({"s": sso, "t": entries[sso][0], "f": {k: v for k, v in entries[sso][1].items() if k in changed}})
+
+        await self._append_journal(records)
+        return entries
+
+    def claim_token(self, sso: str, limit: int) -> bool:
+        """占用Token的一个并发名额（所有进程合计），已达上限时返回 False"""
+        return self._table.claim(sso, limit)
+
+    def release_token_claim(self, sso: str, limit: int) -> None:
+        """归还Token的并发名额"""
+        self._table.unclaim(sso, limit)
+
+    async def subscribe_tokens(self, callback: Callable[[Dict[str, TokenEntry]], None]) -> None:
+        """轮询共享表，发现其他进程的变更后回调变更的Token"""
+        if not self._poll_task:
+            self._poll_task = asyncio.create_task(self._poll_tokens(callback))
+
+    async def _poll_tokens(self, callback: Callable[[Dict[str, TokenEntry]], None]) -> None:
+        sequence = self._table.sequence()
+        versions = self._table.versions()
+        while True:
+            await asyncio.sleep(SHM_POLL_INTERVAL)
+            try:
+                current = self._table.sequence()
+                if current == sequence:
+                    continue
+                sequence = current
+                latest = self._table.versions()
+                changed = [slot for slot, version in latest.items() if versions.get(slot) != version]
+                versions = latest
+                if changed:
+                    callback({sso: self._entry(sso, entry) for sso, entry in self._table.entries(changed).items()})
+            except Exception as e:
+                logger.warning(f"[Storage] 轮询共享Token表失败: {e}")
+
+    async def close(self) -> None:
+        """停止轮询并关闭共享表"""
+        if self._poll_task:
+            self._poll_task.cancel()
+            await asyncio.gather(self._poll_task, return_exceptions=True)
+            self._poll_task = None
+        self._table.close()
+        await super().close()
+
+
+class SqliteStorage(FileStorage):
+    """SQLite存储实现（单机）
+
+    Token按每个SSO一行保存在 data/grok.db 中（WAL 模式），仅写回变更的行，
+    并按状态与剩余次数建立索引，供管理后台统计与列表直接查询；配置仍保存在文件中。
+    """
+
+    def __init__(self, data_dir: Path):
+        super().__init__(data_dir)
+        self.db_file = data_dir / "grok.db"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = asyncio.Lock()
+
+    async def init_db(self) -> None:
+        """初始化数据库：建表建索引，数据库为空时从文件导入Token"""
+        await super().init_db()
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        await self._execute(self._create_tables)
+
+        if not await self._execute(lambda conn: conn.execute("SELECT 1 FROM tokens LIMIT 1").fetchone()):
+            data = await super().load_tokens()
+            if any(data.get(token_type) for token_type in TOKEN_TYPES):
+                await self.save_tokens(data)
+                logger.info("[Storage] Token数据已从文件初始化到SQLite")
+        logger.info(f"[Storage] SQLite数据库已就绪: {self.db_file}")
+
+    @staticmethod
+    def _create_tables(conn: sqlite3.Connection) -> None:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tokens (
+                sso TEXT PRIMARY KEY,
+                token_type TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'active',
+                remaining_queries INTEGER NOT NULL DEFAULT -1,
+                heavy_remaining_queries INTEGER NOT NULL DEFAULT -1,
+                failed_count INTEGER NOT NULL DEFAULT 0,
+                last_failure_time INTEGER,
+                last_failure_reason TEXT,
+                created_time INTEGER,
+                extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_tokens_status_remaining
+                ON tokens (token_type, status, remaining_queries, heavy_remaining_queries);
+            CREATE INDEX IF NOT EXISTS idx_tokens_status_heavy_remaining
+                ON tokens (token_type, status, heavy_remaining_queries);
+            CREATE INDEX IF NOT EXISTS idx_tokens_created
+                ON tokens (token_type, created_time);
+        """)
+
+    async def _execute(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """在线程中执行数据库操作（同一时间只有一个操作），成功时提交、失败时回滚"""
+        async with self._db_lock:
+            def run():
+                with self._conn:
+                    return func(self._conn)
+            return await asyncio.to_thread(run)
+
+    async def load_tokens(self) -> Dict[str, Any]:
+        """加载token数据"""
+        return await self.query_tokens()
+
+    async def query_tokens(self, token_type: Optional[str] = None, status: Optional[str] = None) -> Dict[str, Any]:
+        """按类型、状态查询Token（按创建时间排序），返回格式同 load_tokens"""
+        conditions, params = [], []
+        if token_type:
+            conditions.append("token_type = ?")
+            params.append(token_type)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT {', '.join(_TOKEN_ROW_COLUMNS)} FROM tokens{where} ORDER BY token_type, created_time"
+        rows = await self._execute(lambda conn: conn.execute(sql, params).fetchall())
+
+        data: Dict[str, Any] = {token_type: {} for token_type in TOKEN_TYPES}
+        for row in rows:
+            sso, row_type, token_data = _row_token(row)
+            data.setdefault(row_type, {})[sso] = token_data
+        return data
+
+    async def token_stats(self) -> Dict[str, Dict[str, int]]:
+        """按类型统计Token数量（总数/未使用/限流/失效/正常），统计口径同管理后台"""
+        sql = """
+            SELECT token_type,
+                   COUNT(*),
+                   SUM(status != 'expired' AND remaining_queries = -1
+                       AND (token_type != 'ssoSuper' OR heavy_remaining_queries = -1)),
+                   SUM(status != 'expired' AND (remaining_queries = 0
+                       OR (token_type = 'ssoSuper' AND heavy_remaining_queries = 0))),
+                   SUM(status = 'expired'),
+                   SUM(status != 'expired' AND (remaining_queries > 0
+                       OR (token_type = 'ssoSuper' AND heavy_remaining_queries > 0)))
+            FROM tokens GROUP BY token_type
+        """
+        rows = await self._execute(lambda conn: conn.execute(sql).fetchall())
+        stats = {token_type: dict.fromkeys(("total", "unused", "limited", "expired", "active"), 0) for token_type in TOKEN_TYPES}
+        for token_type, *counts in rows:
+            stats[token_type] = dict(zip(("total", "unused", "limited", "expired", "active"), (c or 0 for c in counts)))
+        return stats
+
+    async def save_tokens(self, data: Dict[str, Any]) -> None:
+        """保存token数据（整体替换：写入全部行并删除多余的行）"""
+        rows = [_token_row(sso, token_type, token_data) for token_type, tokens in data.items() for sso, token_data in tokens.items()]
+
+        def replace(conn: sqlite3.Connection) -> None:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS kept (sso TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM kept")
+            conn.executemany("INSERT OR IGNORE INTO kept VALUES (?)", [(row[0],) for row in rows])
+            conn.execute("DELETE FROM tokens WHERE sso NOT IN (SELECT sso FROM kept)")
+            conn.executemany(SQLITE_UPSERT_TOKEN_SQL, rows)
+
+        await self._execute(replace)
+
+    async def save_token_rows(self, upserts: Dict[str, Tuple[str, Dict[str, Any]]], deletes: List[str]) -> None:
+        """只写入变更的Token行（同一事务内 upsert 与删除）
+
+        Args:
+            upserts: sso -> (Token类型, 数据)
+            deletes: 已删除的 sso 列表
+        """
+        rows = [_token_row(sso, token_type, data) for sso, (token_type, data) in upserts.items()]
+
+        def write(conn: sqlite3.Connection) -> None:
+            conn.executemany(SQLITE_UPSERT_TOKEN_SQL, rows)
+            conn.executemany("DELETE FROM tokens WHERE sso = ?", [(sso,) for sso in deletes])
+
+        try:
+            await self._execute(write)
+        except Exception as e:
+            logger.error(f"[Storage] 保存Token行到SQLite失败: {e}")
+            raise
+
+    async def close(self) -> None:
+        """关闭数据库连接"""
+        if self._conn:
+            async with self._db_lock:
+                self._conn.close()
+                self._conn = None
+        await super().close()
+
+
 class StorageManager:
     """存储管理器"""
 
@@ -478,6 +1376,8 @@ class StorageManager:
         storage_classes = {
             "mysql": MysqlStorage,
             "redis": RedisStorage,
+            "shm": SharedMemoryStorage,
+            "sqlite": SqliteStorage,
             "file": FileStorage
         }
 
@@ -487,7 +1387,7 @@ class StorageManager:
 
         storage_class = storage_classes.get(mode, FileStorage)
         try:
-            self._storage = storage_class(url, data_dir) if mode != "file" else storage_class(data_dir)
+            self._storage = storage_class(url, data_dir) if mode in ("mysql", "redis") else storage_class(data_dir)
             await self._storage.init_db()
         except Exception as e:
             logger.error(f"[Storage] 初始化{mode}存储失败: {e}，回退到文件存储模式")
@@ -0,0 +1,325 @@
+"""共享内存Token表模块 - 单机多进程共享Token状态"""
+
+import os
+import mmap
+import fcntl
+import struct
+import hashlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.logger import logger
+
+# 常量定义
+MAGIC = b"GTT1"
+HEADER = struct.Struct("<4sIQ")  # 魔数, 容量, 变更序号
+RECORD = struct.Struct("<QIBBHiiii480s")  # 键, 版本, 类型, 状态, sso长度, 剩余次数, heavy剩余次数, 失败次数, 进行中请求数, sso
+RECORD_HEAD = struct.Struct("<QIBB")  # 记录开头：键, 版本, 类型, 状态
+MAX_SSO_BYTES = 480
+DEFAULT_CAPACITY = 4096  # 默认记录数（约 2MB）
+LOCK_STRIPES = 64  # 记录条带锁数量
+STRUCTURE_LOCK = LOCK_STRIPES  # 新增/删除记录的结构锁
+SEQUENCE_LOCK = LOCK_STRIPES + 1  # 变更序号锁
+
+# 记录状态
+EMPTY, ACTIVE, EXPIRED, DELETED = 0, 1, 2, 3
+TOKEN_TYPES = ("ssoNormal", "ssoSuper")
+COUNTER_FIELDS = ("remainingQueries", "heavyremainingQueries", "failedCount")
+TABLE_FIELDS = ("status",) + COUNTER_FIELDS
+
+
+def _next_version(version: int) -> int:
+    return (version + 1) & 0xFFFFFFFF
+
+
+class SharedTokenTable:
+    """
+    mmap 共享的定长Token记录表
+
+    每个Token占一条 512 字节记录（开放寻址），保存类型、状态、剩余次数、heavy剩余次数、
+    失败次数与进行中请求数；各进程映射同一文件，按 fcntl 字节区间条带锁更新，
+    更新后递增记录版本与全局变更序号，供其他进程轮询发现变更。
+
+    表容量创建后固定；所有进程退出后重新打开时清零进行中请求数（崩溃进程遗留的计数）。
+    """
+
+    def __init__(self, path: Path, capacity: int = DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self._fd: Optional[int] = None
+        self._mm: Optional[mmap.mmap] = None
+        self._slots: Dict[str, int] = {}  # sso -> 记录位置缓存
+
+    def open(self) -> None:
+        """打开（必要时创建）表文件并映射到内存"""
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        # 存活进程各持有共享锁；能取得独占锁说明没有其他进程在使用该表
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            first = True
+        except BlockingIOError:
+            first = False
+
+        with self._lock(STRUCTURE_LOCK):
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, HEADER.size + self.capacity * RECORD.size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, self.capacity, 0), 0)
+                logger.info(f"[TokenTable] 创建共享Token表: {self.path} (容量 {self.capacity})")
+            magic, capacity, _ = HEADER.unpack(os.pread(self._fd, HEADER.size, 0))
+            if magic != MAGIC:
+                raise ValueError(f"共享Token表格式不匹配: {self.path}")
+            if capacity != self.capacity:
+                logger.info(f"[TokenTable] 使用已有共享Token表容量 {capacity}")
+                self.capacity = capacity
+
+        self._mm = mmap.mmap(self._fd, HEADER.size + self.capacity * RECORD.size)
+        if first:
+            self._reset_inflight()
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+
+    def close(self) -> None:
+        """解除映射并关闭文件（同时释放本进程持有的锁）"""
+        if self._mm:
+            self._mm.close()
+            self._mm = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @contextmanager
+    def _lock(self, index: int) -> Iterator[None]:
+        """跨进程锁：锁定文件中第 index 个字节区间"""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, index)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, index)
+
+    @staticmethod
+    def _hash(sso_value: str) -> int:
+        """记录键（非 0）"""
+        return int.from_bytes(hashlib.blake2b(sso_value.encode(), digest_size=8).digest(), "little") | 1
+
+    @staticmethod
+    def _offset(slot: int) -> int:
+        return HEADER.size + slot * RECORD.size
+
+    def _read(self, slot: int) -> Tuple[Any, ...]:
+        return RECORD.unpack_from(self._mm, self._offset(slot))
+
+    def _write(self, slot: int, record: Tuple[Any, ...]) -> None:
+        RECORD.pack_into(self._mm, self._offset(slot), *record)
+
+    def _bump_sequence(self) -> None:
+        with self._lock(SEQUENCE_LOCK):
+            magic, capacity, sequence = HEADER.unpack_from(self._mm, 0)
+            HEADER.pack_into(self._mm, 0, magic, capacity, sequence + 1)
+
+    def sequence(self) -> int:
+        """全局变更序号"""
+        return HEADER.unpack_from(self._mm, 0)[2]
+
+    def _probe(self, sso_value: str) -> Iterator[int]:
+        start = self._hash(sso_value) % self.capacity
+        for i in range(self.capacity):
+            yield (start + i) % self.capacity
+
+    def _matches(self, slot: int, key: int, raw: bytes) -> bool:
+        record = self._read(slot)
+        return record[0] == key and record[3] not in (EMPTY, DELETED) and record[9][:record[4]] == raw
+
+    def _find(self, sso_value: str) -> Optional[int]:
+        """查找Token所在记录位置"""
+        key, raw = self._hash(sso_value), sso_value.encode()
+        slot = self._slots.get(sso_value)
+        if slot is not None and self._matches(slot, key, raw):
+            return slot
+        self._slots.pop(sso_value, None)
+        for slot in self._probe(sso_value):
+            record = self._read(slot)
+            if record[3] == EMPTY:
+                return None
+            if record[0] == key and record[3] != DELETED and record[9][:record[4]] == raw:
+                self._slots[sso_value] = slot
+                return slot
+        return None
+
+    @contextmanager
+    def _locked(self, sso_value: str) -> Iterator[Optional[int]]:
+        """查找Token记录并持有其条带锁，Token不存在时得到 None
+
+        查找时未持锁，期间记录可能被删除、或删除后被其他Token复用；
+        取得条带锁后复核记录仍属于该Token，否则重新查找。
+        """
+        key, raw = self._hash(sso_value), sso_value.encode()
+        while True:
+            slot = self._find(sso_value)
+            if slot is None:
+                yield None
+                return
+            with self._lock(slot % LOCK_STRIPES):
+                if self._matches(slot, key, raw):
+                    yield slot
+                    return
+            self._slots.pop(sso_value, None)
+
+    @staticmethod
+    def _encode_status(status: Any) -> int:
+        return EXPIRED if status == "expired" else ACTIVE
+
+    @staticmethod
+    def _values(record: Tuple[Any, ...]) -> Dict[str, Any]:
+        """记录中的Token字段"""
+        return {
+            "status": "expired" if record[3] == EXPIRED else "active",
+            "remainingQueries": record[5],
+            "heavyremainingQueries": record[6],
+            "failedCount": record[7]
+        }
+
+    @staticmethod
+    def _int(value: Any, default: int) -> int:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    def upsert(self, sso_value: str, token_type: str, data: Dict[str, Any]) -> bool:
+        """写入Token（已存在时覆盖其字段，保留进行中请求数），表已满或 sso 过长时返回 False"""
+        raw = sso_value.encode()
+        if len(raw) > MAX_SSO_BYTES:
+            logger.warning(f"[TokenTable] Token {sso_value[:10]}... 过长，无法写入共享Token表")
+            return False
+        with self._lock(STRUCTURE_LOCK):
+            slot = self._find(sso_value)
+            if slot is None:
+                slot = next((s for s in self._probe(sso_value) if self._read(s)[3] in (EMPTY, DELETED)), None)
+                if slot is None:
+                    logger.error(f"[TokenTable] 共享Token表已满 (容量 {self.capacity})")
+                    return False
+            with self._lock(slot % LOCK_STRIPES):
+                record = self._read(slot)
+                inflight = record[8] if record[3] not in (EMPTY, DELETED) else 0
+                self._write(slot, (
+                    self._hash(sso_value), _next_version(record[1]), TOKEN_TYPES.index(token_type) if token_type in TOKEN_TYPES else 0,
+                    self._encode_status(data.get("status")), len(raw),
+                    self._int(data.get("remainingQueries"), -1), self._int(data.get("heavyremainingQueries"), -1),
+                    self._int(data.get("failedCount"), 0), inflight, raw
+                ))
+            self._slots[sso_value] = slot
+        self._bump_sequence()
+        return True
+
+    def delete(self, sso_value: str) -> None:
+        """删除Token（保留删除标记以维持探测链）"""
+        with self._lock(STRUCTURE_LOCK):
+            slot = self._find(sso_value)
+            if slot is None:
+                return
+            with self._lock(slot % LOCK_STRIPES):
+                record = list(self._read(slot))
+                record[1] = _next_version(record[1])
+                record[3] = DELETED
+                self._write(slot, tuple(record))
+            self._slots.pop(sso_value, None)
+        self._bump_sequence()
+
+    def update(self, sso_value: str, fields: Dict[str, Any], deltas: Dict[str, int]) -> Optional[Dict[str, Any]]:
+        """原子更新Token字段与计数增量，返回更新后的字段；Token不存在时返回 None
+
+        计数增量与 GrokTokenManager 一致：负值（未知）保持不变，结果不小于 0。
+        """
+        with self._locked(sso_value) as slot:
+            if slot is None:
+                return None
+            record = list(self._read(slot))
+            if "status" in fields:
+                record[3] = self._encode_status(fields["status"])
+            for position, field in enumerate(COUNTER_FIELDS, start=5):
+                if field in fields:
+                    record[position] = self._int(fields[field], record[position])
+                if deltas.get(field) and record[position] >= 0:
+                    record[position] = max(0, record[position] + deltas[field])
+            record[1] = _next_version(record[1])
+            self._write(slot, tuple(record))
+        self._bump_sequence()
+        return self._values(tuple(record))
+
+    def get(self, sso_value: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """读取Token的 (类型, 字段)"""
+        with self._locked(sso_value) as slot:
+            if slot is None:
+                return None
+            record = self._read(slot)
+        return TOKEN_TYPES[record[2]], self._values(record)
+
+    def claim(self, sso_value: str, limit: int) -> bool:
+        """占用Token的一个并发名额（所有进程合计），已达上限时返回 False；limit 为 0 表示不限制"""
+        with self._locked(sso_value) as slot:
+            if slot is None:
+                return True
+            record = list(self._read(slot))
+            if 0 < limit <= record[8]:
+                return False
+            record[8] += 1
+            self._write(slot, tuple(record))
+        return True
+
+    def unclaim(self, sso_value: str, limit: int) -> None:
+        """归还Token的并发名额；仅在从上限回落时递增版本，通知其他进程重新参与选择
+
+        其余归还不改变任何进程的选择结果，不递增版本与变更序号，避免每次请求结束都触发其他进程全表扫描。
+        """
+        with self._locked(sso_value) as slot:
+            if slot is None:
+                return
+            record = list(self._read(slot))
+            if record[8] <= 0:
+                return
+            saturated = 0 < limit <= record[8]
+            record[8] -= 1
+            if saturated:
+                record[1] = _next_version(record[1])
+            self._write(slot, tuple(record))
+        if saturated:
+            self._bump_sequence()
+
+    def inflight(self, sso_value: str) -> int:
+        """所有进程合计的进行中请求数"""
+        with self._locked(sso_value) as slot:
+            return self._read(slot)[8] if slot is not None else 0
+
+    def versions(self) -> Dict[int, int]:
+        """所有已使用记录的版本：位置 -> 版本"""
+        versions = {}
+        for slot in range(self.capacity):
+            key, version, _, status = RECORD_HEAD.unpack_from(self._mm, self._offset(slot))
+            if status != EMPTY:
+                versions[slot] = version
+        return versions
+
+    def entries(self, slots: List[int]) -> Dict[str, Optional[Tuple[str, Dict[str, Any]]]]:
+        """读取指定位置的记录：sso -> (类型, 字段)，已删除的Token为 None"""
+        result = {}
+        for slot in slots:
+            with self._lock(slot % LOCK_STRIPES):
+                record = self._read(slot)
+            if record[3] == EMPTY:
+                continue
+            sso_value = record[9][:record[4]].decode()
+            if record[3] != DELETED:
+                result[sso_value] = (TOKEN_TYPES[record[2]], self._values(record))
+            elif result.get(sso_value) is None:
+                # 删除后重新加入的Token以新记录为准
+                result[sso_value] = None
+        return result
+
+    def _reset_inflight(self) -> None:
+        """清零所有进行中请求数（仅在没有其他进程使用该表时调用）"""
+        for slot in range(self.capacity):
+            record = self._read(slot)
+            if record[8]:
+                self._write(slot, record[:8] + (0,) + record[9:])
+        logger.debug("[TokenTable] 已清零遗留的进行中请求数")
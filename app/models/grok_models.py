@@ -120,4 +120,10 @@ class Models(Enum):
     def to_rate_limit(cls, model: str) -> str:
         """转换为速率限制接口模型名"""
         config = _MODEL_CONFIG.get(model)
-        return config["rate_limit_model"] if config else model
\ No newline at end of file
+        return config["rate_limit_model"] if config else model
+
+    @classmethod
+    def get_cost(cls, model: str) -> int:
+        """获取模型单次调用计费次数"""
+        config = _MODEL_CONFIG.get(model)
+        return int(config["cost"].get("multiplier", 1)) if config else 1
\ No newline at end of file
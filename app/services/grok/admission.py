@@ -0,0 +1,210 @@
+"""Token 准入排队模块"""
+
+import math
+import heapq
+import asyncio
+import itertools
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.core.exception import GrokApiException
+from app.services.grok.recovery import quota_recovery
+from app.services.grok.token import TokenLease, token_manager
+
+# 常量定义
+DEFAULT_QUEUE_SIZE = 100  # 排队请求上限，0 表示不排队
+DEFAULT_MAX_WAIT = 30  # 单个请求最长排队时间（秒）
+MIN_RETRY_AFTER = 1  # Retry-After 最小值（秒）
+
+
+class _Waiter:
+    """排队中的请求"""
+    __slots__ = ("model", "future")
+
+    def __init__(self, model: str, future: asyncio.Future):
+        self.model = model
+        self.future = future
+
+
+class AdmissionQueue:
+    """
+    Token 准入队列
+
+    所有 Token 都已限流或并发已满时，请求不再立即失败，而是按优先级（相同优先级先到先得）排队，
+    直到有 Token 重新可选或超过排队期限：
+    - 预计恢复时间（并发名额归还、配额恢复探测、Token冷却结束）超过排队期限、或无可预计的恢复时，立即拒绝并给出 Retry-After
+    - 队列已满时拒绝并给出 Retry-After，避免客户端反复重试
+    - Token 重新进入选择索引时按顺序唤醒排队请求，同一类配额已无 Token 时跳过同类请求
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[int, int, _Waiter]] = []  # (-优先级, 序号, 请求)
+        self._seq = itertools.count()
+        self._waiting: Dict[str, int] = {}  # 剩余次数字段 -> 排队数
+        self._dispatch_scheduled = False
+        self._listening = False
+
+    @staticmethod
+    def _queue_size() -> int:
+        return int(setting.grok_config.get("admission_queue_size", DEFAULT_QUEUE_SIZE))
+
+    @staticmethod
+    def _max_wait() -> float:
+        return float(setting.grok_config.get("admission_max_wait", DEFAULT_MAX_WAIT))
+
+    @staticmethod
+    def _predict_recovery(model: str) -> Optional[float]:
+        """预计最早有Token重新可选的秒数：最近的配额恢复探测或Token冷却结束，未知时返回 None
+
+        有Token仅因并发已满而暂停分配时，租约归还后即可选，视为 0。
+        """
+        if token_manager.has_saturated(model):
+            return 0.0
+        times = [t for t in (quota_recovery.next_due_in(model), token_manager.next_cooldown_end_in()) if t is not None]
+        return min(times) if times else None
+
+    def _retry_after(self, model: str) -> int:
+        """建议客户端的重试等待秒数：预计最早的恢复时间，未知时取排队期限"""
+        predicted = self._predict_recovery(model)
+        if predicted is None:
+            predicted = self._max_wait()
+        return max(MIN_RETRY_AFTER, math.ceil(predicted))
+
+    def _reject(self, model: str, message: str, error_code: str) -> GrokApiException:
+        retry_after = self._retry_after(model)
+        return GrokApiException(message, error_code, {"model": model, "retry_after": retry_after})
+
+    async def acquire(self, model: str, priority: int = 0, exclude: Optional[Set[str]] = None) -> TokenLease:
+        """获取模型可用的Token租约，必要时排队等待
+
+        Args:
+            model: 模型名称
+            priority: 优先级，数值越大越先获得Token
+            exclude: 本次请求中已失败、应优先避开的 sso 集合
+
+        Returns:
+            Token租约（用完后需调用 token_manager.release 归还）
+
+        Raises:
+            GrokApiException: 排队已满（QUEUE_FULL）或期限内无可用Token（NO_AVAILABLE_TOKEN）
+        """
+        field = token_manager.remaining_field(model)
+
+        # 同类配额无人排队时直接选择，否则排在已有请求之后
+        if not self._waiting.get(field):
+            try:
+                return token_manager.acquire(model, exclude)
+            except GrokApiException as e:
+                if e.error_code != "NO_AVAILABLE_TOKEN":
+                    raise
+
+        max_wait = self._max_wait()
+        predicted = self._predict_recovery(model)
+        if predicted is None or predicted > max_wait:
+            metrics.inc("admission.rejected")
+            raise self._reject(model, f"没有可用Token用于模型 {model}，请稍后重试", "NO_AVAILABLE_TOKEN")
+
+        if sum(self._waiting.values()) >= self._queue_size():
+            metrics.inc("admission.queue_full")
+            logger.warning(f"[Admission] 排队已满，拒绝模型 {model} 的请求")
+            raise self._reject(model, "请求排队已满，请稍后重试", "QUEUE_FULL")
+
+        return await self._wait(model, field, priority, max_wait)
+
+    async def _wait(self, model: str, field: str, priority: int, max_wait: float) -> TokenLease:
+        """排队等待Token"""
+        self._ensure_listener()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (-priority, next(self._seq), _Waiter(model, future)))
+        self._waiting[field] = self._waiting.get(field, 0) + 1
+        metrics.inc("admission.queued")
+        logger.debug(f"[Admission] 模型 {model} 无可用Token，排队等待 (排队中: {sum(self._waiting.values())})")
+
+        # 入队时可能已有Token恢复
+        self._schedule_dispatch()
+        try:
+            async with asyncio.timeout(max_wait):
+                lease = await future
+            metrics.inc("admission.served")
+            return lease
+        except TimeoutError:
+            if future.done() and not future.cancelled():
+                # 超时触发前的同一轮事件循环内已分配到Token：照常使用，不能丢弃已占用的租约
+                metrics.inc("admission.served")
+                return future.result()
+            metrics.inc("admission.timeout")
+            logger.warning(f"[Admission] 模型 {model} 排队 {max_wait:.0f} 秒后仍无可用Token")
+            raise self._reject(model, f"排队 {max_wait:.0f} 秒后仍没有可用Token用于模型 {model}", "NO_AVAILABLE_TOKEN")
+        except asyncio.CancelledError:
+            # 已分配Token但请求被取消时归还
+            if future.done() and not future.cancelled():
+                token_manager.release(future.result())
+            raise
+        finally:
+            future.cancel()
+            self._waiting[field] -= 1
+            if not self._waiting[field]:
+                del self._waiting[field]
+            if not self._waiting:
+                # 丢弃已超时或取消的残留项
+                self._heap.clear()
+
+    def _ensure_listener(self) -> None:
+        if not self._listening:
+            token_manager.add_available_listener(self._on_available)
+            self._listening = True
+
+    def _on_available(self, token_type: str, sso_value: str) -> None:
+        """Token重新可选"""
+        if self._heap:
+            self._schedule_dispatch()
+
+    def _schedule_dispatch(self) -> None:
+        """合并同一轮事件循环内的多次通知"""
+        if self._dispatch_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._dispatch_scheduled = True
+        loop.call_soon(self._dispatch)
+
+    def _dispatch(self) -> None:
+        """按顺序为排队请求分配Token"""
+        self._dispatch_scheduled = False
+        blocked: Set[str] = set()
+        kept: List[Tuple[int, int, _Waiter]] = []
+
+        while self._heap and len(blocked) < len(self._waiting):
+            entry = heapq.heappop(self._heap)
+            waiter = entry[2]
+            if waiter.future.done():
+                continue
+            field = token_manager.remaining_field(waiter.model)
+            if field in blocked:
+                kept.append(entry)
+                continue
+            try:
+                lease = token_manager.acquire(waiter.model)
+            except GrokApiException:
+                blocked.add(field)
+                kept.append(entry)
+                continue
+            waiter.future.set_result(lease)
+
+        for entry in kept:
+            heapq.heappush(self._heap, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """排队状态"""
+        return {
+            "waiting": sum(self._waiting.values()),
+            "by_field": dict(self._waiting)
+        }
+
+
+# 全局准入队列实例
+admission_queue = AdmissionQueue()
@@ -87,7 +87,8 @@ class CacheService:
                     logger.error(f"[{self.cache_type.upper()}Cache] 下载失败，状态码: {response.status_code}")
                     return None
 
-                cache_path.write_bytes(response.content)
+                # 文件写入放到线程中执行，避免大文件阻塞事件循环
+                await asyncio.to_thread(cache_path.write_bytes, response.content)
                 logger.debug(f"[{self.cache_type.upper()}Cache] 文件已缓存: {cache_path} ({len(response.content)} bytes)")
                 asyncio.create_task(self.cleanup_cache())
                 return cache_path
@@ -102,6 +103,10 @@ class CacheService:
 
     async def cleanup_cache(self):
         """清理缓存目录，确保不超过配置的大小限制"""
+        await asyncio.to_thread(self._cleanup_cache_sync)
+
+    def _cleanup_cache_sync(self):
+        """清理缓存目录（同步实现，在线程中执行）"""
         try:
             max_size_mb = setting.global_config.get(f"{self.cache_type}_cache_max_size_mb", 500)
             max_size_bytes = max_size_mb * 1024 * 1024
@@ -169,7 +174,7 @@ class ImageCacheService(CacheService):
             if not cache_path:
                 return None
 
-            base64_str = self.to_base64(cache_path)
+            base64_str = await asyncio.to_thread(self.to_base64, cache_path)
 
             try:
                 cache_path.unlink()
@@ -0,0 +1,50 @@
+"""请求取消信号模块"""
+
+from typing import Callable, List
+
+from app.core.logger import logger
+
+
+class CancelToken:
+    """
+    请求级取消信号
+
+    由路由层在客户端断开时触发，回调同步执行，
+    保证即使当前任务正被取消也能立即中止上游传输。
+    """
+
+    def __init__(self):
+        self._callbacks: List[Callable[[], None]] = []
+        self.cancelled = False
+        self.reason = ""
+
+    def cancel(self, reason: str = "client_disconnect") -> None:
+        """触发取消（重复调用无效）"""
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.reason = reason
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"[Cancel] 执行取消回调失败: {e}")
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """注册取消回调，已取消时立即执行"""
+        if self.cancelled:
+            callback()
+        else:
+            self._callbacks.append(callback)
+
+    def child(self) -> "CancelToken":
+        """派生子信号：本信号触发时子信号随之触发，子信号也可单独触发"""
+        child = CancelToken()
+        self.add_callback(lambda: child.cancel(self.reason))
+        return child
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        """移除取消回调"""
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
@@ -0,0 +1,246 @@
+"""Token 与代理熔断器模块"""
+
+import time
+import random
+from collections import deque
+from enum import Enum
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.services.grok.latency import latency_tracker
+from app.services.grok.token import token_manager
+
+# 常量定义
+DEFAULT_WINDOW = 60  # 滚动统计窗口（秒）
+DEFAULT_MIN_REQUESTS = 5  # 窗口内最少请求数，不足时不熔断
+DEFAULT_ERROR_RATE = 0.5  # 熔断错误率阈值
+DEFAULT_SLOW_SECONDS = 20  # 首字节超过该时间视为失败（秒）
+DEFAULT_OPEN_SECONDS = 30  # 熔断持续时间（秒）
+DEFAULT_PROBE_SECONDS = 30  # 半开探测结果的最长等待时间（秒），超时未出结果时允许新的探测
+
+
+class CircuitState(Enum):
+    """熔断器状态"""
+    CLOSED = "closed"        # 正常放行
+    OPEN = "open"            # 熔断，跳过该资源
+    HALF_OPEN = "half_open"  # 熔断到期，放行单个探测请求
+
+
+class CircuitBreaker:
+    """
+    单个资源（Token 或代理）的熔断器
+
+    在滚动时间窗口内统计失败率（超时、网络错误、5xx、首字节过慢），
+    达到阈值后熔断；熔断到期进入半开状态，同一时间只放行一个探测请求，
+    探测成功则恢复，失败则再次熔断。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CircuitState.CLOSED
+        self.opened_until = 0.0
+        self.probe_until = 0.0  # 进行中的半开探测的等待期限
+        self._samples: Deque[Tuple[float, bool]] = deque()  # (时间, 是否失败)
+        self._failures = 0
+
+    def _evict(self, now: float, window: float) -> None:
+        """移出窗口外的样本"""
+        while self._samples and self._samples[0][0] < now - window:
+            _, failed = self._samples.popleft()
+            self._failures -= failed
+
+    def current_state(self) -> CircuitState:
+        """当前状态（熔断到期后视为半开）"""
+        if self.state is CircuitState.OPEN and time.monotonic() >= self.opened_until:
+            self.state = CircuitState.HALF_OPEN
+            metrics.inc("circuit.half_open")
+            logger.debug(f"[Circuit] {self.name} 熔断到期，进入半开状态")
+        return self.state
+
+    def allows(self) -> bool:
+        """是否放行请求（半开状态下已有探测进行中时不放行）"""
+        state = self.current_state()
+        if state is CircuitState.HALF_OPEN:
+            return time.monotonic() >= self.probe_until
+        return state is CircuitState.CLOSED
+
+    @staticmethod
+    def probe_seconds() -> float:
+        return float(setting.grok_config.get("circuit_probe_seconds", DEFAULT_PROBE_SECONDS))
+
+    def start_probe(self) -> bool:
+        """半开状态下占用探测名额，返回本次请求是否为探测请求"""
+        if not self.allows() or self.state is not CircuitState.HALF_OPEN:
+            return False
+        self.probe_until = time.monotonic() + self.probe_seconds()
+        metrics.inc("circuit.probe")
+        logger.debug(f"[Circuit] {self.name} 发起半开探测")
+        return True
+
+    def record(self, ok: bool) -> bool:
+        """记录一次请求结果，返回是否因此进入熔断"""
+        config = setting.grok_config
+        now = time.monotonic()
+        state = self.current_state()
+
+        if state is CircuitState.HALF_OPEN:
+            if ok:
+                self._close()
+                return False
+            self._open(now, "半开探测失败")
+            return True
+
+        window = float(config.get("circuit_window", DEFAULT_WINDOW))
+        self._samples.append((now, not ok))
+        self._failures += not ok
+        self._evict(now, window)
+
+        if state is CircuitState.OPEN or ok:
+            return False
+        total = len(self._samples)
+        min_requests = int(config.get("circuit_min_requests", DEFAULT_MIN_REQUESTS))
+        error_rate = float(config.get("circuit_error_rate", DEFAULT_ERROR_RATE))
+        if total >= min_requests and self._failures / total >= error_rate:
+            self._open(now, f"{window:.0f}秒内失败 {self._failures}/{total}")
+            return True
+        return False
+
+    def _open(self, now: float, reason: str) -> None:
+        open_seconds = float(setting.grok_config.get("circuit_open_seconds", DEFAULT_OPEN_SECONDS))
+        self.state = CircuitState.OPEN
+        self.opened_until = now + open_seconds
+        self.probe_until = 0.0
+        metrics.inc("circuit.opened")
+        logger.warning(f"[Circuit] {self.name} 熔断 {open_seconds:.0f} 秒 ({reason})")
+
+    def _close(self) -> None:
+        self.state = CircuitState.CLOSED
+        self.probe_until = 0.0
+        self._samples.clear()
+        self._failures = 0
+        metrics.inc("circuit.closed")
+        logger.info(f"[Circuit] {self.name} 已恢复")
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.current_state()
+        return {
+            "state": state.value,
+            "requests": len(self._samples),
+            "failures": self._failures,
+            "open_seconds_left": round(max(0.0, self.opened_until - time.monotonic()), 1) if state is CircuitState.OPEN else 0
+        }
+
+
+class CircuitBreakerRegistry:
+    """
+    Token 与上游代理的熔断器集合
+
+    Token 熔断时移出选择索引（复用 Token 冷却），到期后重新参与选择，
+    被选中作为半开探测后再次移出索引，直至探测出结果；
+    代理熔断或半开探测进行中时，代理选择跳过该代理。
+    """
+
+    def __init__(self):
+        self._tokens: Dict[str, CircuitBreaker] = {}
+        self._proxies: Dict[str, CircuitBreaker] = {}
+        token_manager.add_acquire_listener(self._on_acquire)
+
+    def _on_acquire(self, lease) -> None:
+        """半开的Token被选中时作为探测请求，探测期间暂停分配"""
+        breaker = self._tokens.get(lease.sso_value)
+        if breaker is not None and breaker.start_probe():
+            token_manager.cool_down(lease.sso_value, breaker.probe_seconds())
+
+    @staticmethod
+    def _mask(proxy_url: str) -> str:
+        return proxy_url.split("@")[-1] if "@" in proxy_url else proxy_url
+
+    @staticmethod
+    def is_failure(error_code: Optional[str], status: Optional[int] = None) -> bool:
+        """错误是否计入熔断（超时、网络错误、5xx）；401/429 等与资源健康无关的错误不计入"""
+        if error_code in ("UPSTREAM_TIMEOUT", "NETWORK_ERROR", "STREAM_ERROR", "NO_RESPONSE"):
+            return True
+        return error_code == "HTTP_ERROR" and status is not None and status >= 500
+
+    def record(self, sso_value: Optional[str], proxy_url: str, ok: bool, latency: Optional[float] = None) -> None:
+        """记录一次上游请求结果；成功但首字节过慢同样计为失败"""
+        if ok and latency is not None:
+            slow = float(setting.grok_config.get("circuit_slow_seconds", DEFAULT_SLOW_SECONDS))
+            if latency > slow:
+                metrics.inc("circuit.slow")
+                ok = False
+
+        if sso_value:
+            breaker = self._tokens.get(sso_value)
+            if breaker is None:
+                breaker = self._tokens[sso_value] = CircuitBreaker(f"Token {sso_value[:10]}...")
+            probing = breaker.current_state() is CircuitState.HALF_OPEN
+            if breaker.record(ok):
+                token_manager.cool_down(sso_value, breaker.opened_until - time.monotonic())
+            elif probing:
+                # 探测成功，结束探测期间的暂停
+                token_manager.end_cool_down(sso_value)
+
+        if proxy_url:
+            breaker = self._proxies.get(proxy_url)
+            if breaker is None:
+                breaker = self._proxies[proxy_url] = CircuitBreaker(f"代理 {self._mask(proxy_url)}")
+            breaker.record(ok)
+
+    def choose_proxy(self, proxies: List[str], probe: bool = False) -> str:
+        """选择未熔断的代理；全部熔断时仍使用第一个
+
+        proxy_select_policy 为 ordered（默认）时按配置顺序取第一个，
+        为 fastest 时取估算耗时最短者（无样本者优先，并以一定概率随机探索）。
+
+        Args:
+            probe: 调用方会记录请求结果；选中半开的代理时占用其探测名额
+        """
+        proxy_url = self._choose_proxy(proxies)
+        breaker = self._proxies.get(proxy_url)
+        if probe and breaker is not None:
+            breaker.start_probe()
+        return proxy_url
+
+    def _choose_proxy(self, proxies: List[str]) -> str:
+        allowed = []
+        for proxy_url in proxies:
+            breaker = self._proxies.get(proxy_url)
+            if breaker is None or breaker.allows():
+                allowed.append(proxy_url)
+        if not allowed:
+            if proxies:
+                logger.warning("[Circuit] 所有代理均已熔断，使用首个代理")
+                return proxies[0]
+            return ""
+
+        if len(allowed) > 1 and setting.grok_config.get("proxy_select_policy", "ordered") == "fastest":
+            if random.random() < latency_tracker.explore_rate():
+                return random.choice(allowed)
+            def cost(proxy_url: str) -> float:
+                estimate = latency_tracker.proxy_estimate(proxy_url)
+                return -1.0 if estimate is None else estimate
+
+            return min(allowed, key=cost)
+        return allowed[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """非关闭状态或有失败记录的熔断器"""
+        def collect(breakers: Dict[str, CircuitBreaker], mask) -> Dict[str, Any]:
+            result = {}
+            for key, breaker in breakers.items():
+                info = breaker.stats()
+                if info["state"] != CircuitState.CLOSED.value or info["failures"]:
+                    result[mask(key)] = info
+            return result
+
+        return {
+            "tokens": collect(self._tokens, lambda sso: f"{sso[:10]}..."),
+            "proxies": collect(self._proxies, self._mask)
+        }
+
+
+# 全局熔断器实例
+circuit_breakers = CircuitBreakerRegistry()
@@ -2,18 +2,29 @@
 
 import asyncio
 import json
-from typing import Dict, List, Tuple, Any
+import time
+import random
+from typing import AsyncGenerator, Callable, Dict, List, Optional, Set, Tuple, Any
 
 from curl_cffi import requests as curl_requests
 
 from app.core.config import setting
 from app.core.logger import logger
+from app.core.metrics import metrics
 from app.models.grok_models import Models
-from app.services.grok.processer import GrokResponseProcessor
+from app.services.grok.processer import GrokResponseProcessor, StreamOutcome, StreamStatus
 from app.services.grok.statsig import get_dynamic_headers
-from app.services.grok.token import token_manager
+from app.services.grok.token import LeaseOutcome, TokenLease, token_manager
 from app.services.grok.upload import ImageUploadManager
 from app.services.grok.cloudflare import CloudflareClearance
+from app.services.grok.session_pool import session_pool
+from app.services.grok.cancel import CancelToken
+from app.services.grok.quota import quota_ledger
+from app.services.grok.rate_limit import rate_limit_refresher
+from app.services.grok.admission import admission_queue
+from app.services.grok.circuit import circuit_breakers
+from app.services.grok.latency import latency_tracker
+from app.services.grok.hedge import hedge_policy
 from app.core.exception import GrokApiException
 
 # 常量定义
@@ -21,14 +32,39 @@ GROK_API_ENDPOINT = "https://grok.com/rest/app-chat/conversations/new"
 REQUEST_TIMEOUT = 120
 IMPERSONATE_BROWSER = "chrome133a"
 MAX_RETRY = 3  # 最大重试次数
+RETRYABLE_STATUS = (401, 403, 429)  # 可重试的上游状态码
+DEFAULT_BACKOFF_BASE = 0.5  # 退避基准时间（秒）
+DEFAULT_BACKOFF_MAX = 8  # 退避上限（秒）
+
+
+class _Attempt:
+    """对冲中的一次请求尝试"""
+    __slots__ = ("lease", "cancel", "first_byte", "task")
+
+    def __init__(self, lease: TokenLease, cancel: CancelToken):
+        self.lease = lease
+        self.cancel = cancel
+        self.first_byte = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
 
 
 class GrokClient:
     """Grok API 客户端"""
 
+    # 对冲落败后仍在收尾的后台任务（保持引用直至结束）
+    _background: Set[asyncio.Task] = set()
+
     @staticmethod
-    async def openai_to_grok(openai_request: dict):
-        """转换OpenAI请求为Grok请求并处理响应"""
+    async def openai_to_grok(openai_request: dict, cancel: Optional[CancelToken] = None, priority: int = 0,
+                             hedge: bool = False):
+        """转换OpenAI请求为Grok请求并处理响应
+
+        Args:
+            openai_request: OpenAI格式请求
+            cancel: 请求取消信号（流式请求客户端断开时触发）
+            priority: Token排队优先级（所有Token限流时生效，数值越大越优先）
+            hedge: 是否允许对冲请求（需同时开启 hedge_enabled，含图片的请求不对冲）
+        """
         model = openai_request["model"]
         messages = openai_request["messages"]
         stream = openai_request.get("stream", False)
@@ -49,63 +85,245 @@ class GrokClient:
             logger.debug(f"[Client] 视频模型文本处理: {content}")
 
         # 重试逻辑
-        return await GrokClient._try(model, content, image_urls, model_name, model_mode, is_video_model, stream)
+        # 图片附件归属于上传所用的Token，无法换Token对冲
+        hedge = hedge and not image_urls and hedge_policy.enabled()
+        return await GrokClient._try(model, content, image_urls, model_name, model_mode, is_video_model, stream, cancel, priority, hedge)
 
     @staticmethod
-    async def _try(model: str, content: str, image_urls: List[str], model_name: str, model_mode: str, is_video: bool, stream: bool):
-        """带重试的请求执行"""
+    async def _try(model: str, content: str, image_urls: List[str], model_name: str, model_mode: str, is_video: bool, stream: bool,
+                   cancel: Optional[CancelToken] = None, priority: int = 0, hedge: bool = False):
+        """带重试的请求执行
+
+        401/429 后将失败的Token加入本次请求的排除集合，重试立即切换到其他Token；
+        无其他Token可切换或因 403 重试时，按指数退避（全抖动）等待后重试。
+        """
         last_err = None
+        failed: Set[str] = set()  # 本次请求中已失败的Token
+        backoff = False  # 下一次尝试前是否必须退避
         
         for i in range(MAX_RETRY):
             try:
-                # 获取token
-                auth_token = token_manager.get_token(model)
+                # 获取Token租约（占用并发名额，请求结束后按结果归还；全部限流或并发已满时排队等待）
+                lease = await admission_queue.acquire(model, priority, failed)
+                auth_token = lease.auth_token
+                try:
+                    if i > 0:
+                        if backoff or lease.sso_value in failed:
+                            await asyncio.sleep(GrokClient._backoff_delay(i))
+                        else:
+                            metrics.inc("retry.failover")
+
+                    # 确保 Cloudflare cf_clearance 可用
+                    await CloudflareClearance.ensure()
+
+                    # 上传图片
+                    imgs = await GrokClient._upload_imgs(image_urls, auth_token)
+
+                    # 构建并发送请求
+                    payload = GrokClient._build_payload(content, model_name, model_mode, imgs, is_video)
+                    outcome = StreamOutcome() if stream else None
+                    if hedge:
+                        result = await GrokClient._send_hedged(payload, lease, model, stream, cancel, failed, outcome)
+                    else:
+                        result = await GrokClient._send_request(payload, auth_token, model, stream, cancel, outcome=outcome)
+                except BaseException as e:
+                    GrokClient._release_failed(lease, e)
+                    raise
 
-                # 确保 Cloudflare cf_clearance 可用
-                await CloudflareClearance.ensure()
-                
-                # 上传图片
-                imgs = await GrokClient._upload_imgs(image_urls, auth_token)
-                
-                # 构建并发送请求
-                payload = GrokClient._build_payload(content, model_name, model_mode, imgs, is_video)
-                return await GrokClient._send_request(payload, auth_token, model, stream)
+                # 流式响应在读取结束（或被取消）后才按结束状态归还租约
+                if stream:
+                    return GrokClient._release_on_close(result, lambda: GrokClient._release_stream(lease, outcome))
+                token_manager.release(lease, LeaseOutcome.SUCCESS)
+                return result
                 
             except GrokApiException as e:
                 last_err = e
-                # 允许处理 HTTP 错误，其他错误直接抛出
-                if e.error_code not in ["HTTP_ERROR", "NO_AVAILABLE_TOKEN"]:
+                # 允许处理 HTTP 错误，其他错误（含排队超时、排队已满）直接抛出
+                if e.error_code != "HTTP_ERROR":
                     raise
 
-                # 检查是否为可重试的状态码
-                status = e.context.get("status") if e.context else None
+                # 检查是否为可重试的状态码，其他状态码不重试
+                status = e.details.get("status")
+                if status not in RETRYABLE_STATUS:
+                    raise
+                metrics.inc(f"retry.{status}")
 
-                # 针对 Cloudflare 403，尝试自动获取 cf_clearance 后重试
                 if status == 403:
+                    # 针对 Cloudflare 403，尝试自动获取 cf_clearance 后退避重试（与Token无关）
                     logger.warning("[Client] 收到 403，尝试自动获取 cf_clearance 后重试")
                     await CloudflareClearance.refresh()
-                    if i < MAX_RETRY - 1:
-                        await asyncio.sleep(0.5)
-                        continue
-                    else:
-                        logger.error(f"[Client] 重试{MAX_RETRY}次后仍失败 (403)")
-                        break
-
-                # 401/429 可重试
-                if status in [401, 429]:
-                    if i < MAX_RETRY - 1:
-                        logger.warning(f"[Client] 请求失败(状态码:{status}), 重试 {i+1}/{MAX_RETRY}")
-                        await asyncio.sleep(0.5)  # 短暂延迟
-                        continue
-                    else:
-                        logger.error(f"[Client] 重试{MAX_RETRY}次后仍失败")
-                        break
-
-                # 其他状态码不重试
-                raise
+                    backoff = True
+                else:
+                    # 401/429：排除该Token，换用其他Token重试
+                    failed.add(lease.sso_value)
+                    backoff = False
+
+                if i < MAX_RETRY - 1:
+                    logger.warning(f"[Client] 请求失败(状态码:{status}), 重试 {i+1}/{MAX_RETRY}")
+                    continue
+                metrics.inc("retry.exhausted")
+                logger.error(f"[Client] 重试{MAX_RETRY}次后仍失败 ({status})")
         
         raise last_err if last_err else GrokApiException("请求失败", "REQUEST_ERROR")
 
+    @staticmethod
+    async def _send_hedged(payload: dict, lease: TokenLease, model: str, stream: bool, cancel: Optional[CancelToken],
+                           failed: Set[str], outcome: Optional[StreamOutcome] = None):
+        """发送请求；超过最近首字节耗时分位数仍未收到响应头时，换用另一个Token发起对冲请求
+
+        先收到响应头的请求胜出，其余请求通过各自的取消信号中止；对冲次数受预算限制。
+        对冲请求因 401/429 失败时其Token同样计入本次请求的排除集合。
+        对冲请求胜出时，主请求的租约在此按其结果归还。
+
+        Args:
+            outcome: 主请求的流式响应结果（对冲请求各自使用独立的结果）
+        """
+        hedge_policy.on_request()
+        delay = hedge_policy.delay()
+        if delay is None:
+            return await GrokClient._send_request(payload, lease.auth_token, model, stream, cancel, outcome=outcome)
+
+        parent = cancel or CancelToken()
+        attempts: List[_Attempt] = []
+
+        def launch(attempt_lease: TokenLease) -> None:
+            attempt = _Attempt(attempt_lease, parent.child())
+            attempt_outcome = outcome if attempt_lease is lease else StreamOutcome()
+            coro = GrokClient._send_request(payload, attempt_lease.auth_token, model, stream, attempt.cancel,
+                                            attempt.first_byte, attempt_outcome)
+            if attempt_lease is not lease:
+                coro = GrokClient._hedge_attempt(coro, attempt_lease, stream, attempt_outcome)
+            attempt.task = asyncio.create_task(coro)
+            attempts.append(attempt)
+
+        launch(lease)
+        loop = asyncio.get_running_loop()
+        hedge_at = loop.time() + delay
+        hedged = False
+        primary_error = None  # 主请求的失败
+        last_error = None
+        winner = None
+        try:
+            while True:
+                winner = next((a for a in attempts if a.first_byte.is_set()), None)
+                if winner:
+                    break
+
+                # 未收到响应头即失败的尝试
+                for attempt in [a for a in attempts if a.task.done()]:
+                    attempts.remove(attempt)
+                    error = attempt.task.exception()
+                    if attempt.lease is lease:
+                        primary_error = error
+                    elif isinstance(error, GrokApiException) and error.details.get("status") in (401, 429):
+                        failed.add(attempt.lease.sso_value)
+                    last_error = error
+                if not attempts:
+                    raise primary_error or last_error
+
+                waiters = [asyncio.create_task(a.first_byte.wait()) for a in attempts]
+                try:
+                    timeout = None if hedged else max(0.0, hedge_at - loop.time())
+                    done, _ = await asyncio.wait([a.task for a in attempts] + waiters, timeout=timeout,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for waiter in waiters:
+                        waiter.cancel()
+
+                if not done and not hedged:
+                    hedged = True
+                    if hedge_lease := GrokClient._hedge_lease(model, lease, failed):
+                        logger.debug(f"[Client] {delay:.2f} 秒内未收到响应头，发起对冲请求")
+                        metrics.inc("hedge.launched")
+                        launch(hedge_lease)
+
+            if winner.lease is not lease:
+                metrics.inc("hedge.won")
+                if primary_error is not None:
+                    GrokClient._release_failed(lease, primary_error)
+                else:
+                    token_manager.release(lease)
+        finally:
+            # 中止落败或未完成的尝试，后台回收
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel.cancel("hedge_lost")
+                    GrokClient._discard_attempt(attempt.task, stream)
+
+        return await winner.task
+
+    @staticmethod
+    def _hedge_lease(model: str, lease: TokenLease, failed: Set[str]) -> Optional[TokenLease]:
+        """为对冲请求获取另一个Token的租约，无其他可用Token或预算不足时返回 None"""
+        try:
+            hedge_lease = token_manager.acquire(model, failed | {lease.sso_value})
+        except GrokApiException:
+            return None
+        if hedge_lease.sso_value == lease.sso_value or not hedge_policy.try_spend():
+            token_manager.release(hedge_lease)
+            return None
+        return hedge_lease
+
+    @staticmethod
+    async def _hedge_attempt(coro, lease: TokenLease, stream: bool, outcome: StreamOutcome):
+        """对冲请求：结束（或流式响应关闭）时按结果归还其租约"""
+        try:
+            result = await coro
+        except BaseException as e:
+            GrokClient._release_failed(lease, e)
+            raise
+        if stream:
+            return GrokClient._release_on_close(result, lambda: GrokClient._release_stream(lease, outcome))
+        token_manager.release(lease, LeaseOutcome.SUCCESS)
+        return result
+
+    @staticmethod
+    def _release_stream(lease: TokenLease, outcome: StreamOutcome) -> None:
+        """流式响应关闭后按结束状态归还租约：正常结束计为成功，超时或上游出错计入Token失败，提前关闭或取消不影响Token状态"""
+        if outcome.status is StreamStatus.COMPLETED:
+            token_manager.release(lease, LeaseOutcome.SUCCESS)
+        elif outcome.status in (StreamStatus.STALLED, StreamStatus.ERROR):
+            token_manager.release(lease, LeaseOutcome.FAILED, reason=f"stream {outcome.status.value}: {outcome.reason}"[:200])
+        else:
+            token_manager.release(lease, LeaseOutcome.CANCELLED)
+
+    @staticmethod
+    def _release_failed(lease: TokenLease, error: BaseException) -> None:
+        """按失败原因归还租约：上游错误状态码计入Token失败（429 另行冷却），取消、超时等不影响Token状态"""
+        if isinstance(error, GrokApiException) and error.error_code == "HTTP_ERROR":
+            status = error.details.get("status")
+            outcome = LeaseOutcome.RATE_LIMITED if status == 429 else LeaseOutcome.FAILED
+            token_manager.release(lease, outcome, status, str(error.details.get("data", ""))[:200])
+        else:
+            token_manager.release(lease)
+
+    @staticmethod
+    def _discard_attempt(task: asyncio.Task, stream: bool) -> None:
+        """回收落败的尝试：流式结果需读取一次以中止上游并归还会话与Token"""
+        async def reap() -> None:
+            try:
+                result = await task
+                if stream:
+                    async for _ in result:
+                        pass
+            except (GrokApiException, asyncio.CancelledError):
+                pass
+            except Exception as e:
+                logger.debug(f"[Client] 回收对冲请求出错: {e}")
+
+        if task.done() and (task.cancelled() or task.exception() is not None):
+            return
+        reaper = asyncio.create_task(reap())
+        GrokClient._background.add(reaper)
+        reaper.add_done_callback(GrokClient._background.discard)
+
+    @staticmethod
+    def _backoff_delay(attempt: int) -> float:
+        """第 attempt 次重试的退避时间：指数增长并全抖动"""
+        base = float(setting.grok_config.get("retry_backoff_base", DEFAULT_BACKOFF_BASE))
+        cap = float(setting.grok_config.get("retry_backoff_max", DEFAULT_BACKOFF_MAX))
+        return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
     @staticmethod
     def _extract_content(messages: List[Dict]) -> Tuple[str, List[str]]:
         """提取消息内容和图片URL"""
@@ -184,18 +402,28 @@ class GrokClient:
         return payload
 
     @staticmethod
-    async def _send_request(payload: dict, auth_token: str, model: str, stream: bool):
-        """发送HTTP请求到Grok API"""
+    async def _send_request(payload: dict, auth_token: str, model: str, stream: bool, cancel: Optional[CancelToken] = None,
+                            first_byte: Optional[asyncio.Event] = None, outcome: Optional[StreamOutcome] = None):
+        """发送HTTP请求到Grok API
+
+        Args:
+            first_byte: 收到成功响应头时置位（对冲请求据此判定胜者）
+            outcome: 流式响应结果，流结束时写入状态
+        """
         # 验证认证令牌
         if not auth_token:
             raise GrokApiException("认证令牌缺失", "NO_AUTH_TOKEN")
 
+        pooled = None
+        handed_off = False
+        sso_value = token_manager._extract_sso(auth_token)
+        started = time.monotonic()
+        # 使用未熔断的服务代理；若未配置代理，明确传入空字典以禁用环境代理
+        proxy_url = circuit_breakers.choose_proxy(setting.get_service_proxies(), probe=True)
         try:
             # 构建请求头
             headers = GrokClient._build_headers(auth_token)
             
-            # 使用服务代理；若未配置代理，明确传入空字典以禁用环境代理
-            proxy_url = setting.get_service_proxy()
             proxies = {"http": proxy_url, "https": proxy_url} if proxy_url else {}
             
             if proxy_url:
@@ -203,37 +431,85 @@ class GrokClient:
             else:
                 logger.debug("[Client] 未配置服务代理，已禁用环境代理变量")
 
-            # 构建请求参数
+            # 构建请求参数（不在共享会话中保存响应 Cookie，避免不同 SSO 串号）
             request_kwargs = {
                 "headers": headers,
                 "data": json.dumps(payload),
                 "impersonate": IMPERSONATE_BROWSER,
                 "timeout": REQUEST_TIMEOUT,
                 "stream": True,
-                "proxies": proxies
+                "proxies": proxies,
+                "discard_cookies": True
             }
 
-            # 在线程池中执行同步HTTP请求，避免阻塞事件循环
-            response = await asyncio.to_thread(
-                curl_requests.post,
-                GROK_API_ENDPOINT,
-                **request_kwargs
-            )
+            # 从会话池取出长连接会话发送异步请求，复用 keep-alive 与 TLS 会话
+            pooled = await session_pool.checkout(proxy_url, IMPERSONATE_BROWSER)
+            first_response_timeout = setting.grok_config.get("stream_first_response_timeout", 30)
+            # 等待响应头期间请求被取消（客户端断开、对冲落败）时立即中止，不占用会话直至超时
+            post, transfer = session_pool.post(pooled, GROK_API_ENDPOINT, **request_kwargs)
+
+            def abort_post() -> None:
+                # 取消回调同步执行：客户端断开的瞬间就移除 curl 句柄，不依赖当前任务恢复运行
+                post.cancel()
+                transfer.abort()
+
+            if cancel is not None:
+                cancel.add_callback(abort_post)
+            try:
+                # 等待响应头同样受首次响应超时约束
+                async with asyncio.timeout(first_response_timeout):
+                    response = await post
+            except asyncio.CancelledError:
+                # 取消 post 只会放弃等待，curl 传输仍在后台进行，需从 curl_multi 中移除才会真正中止
+                transfer.abort()
+                # 仅转换由请求取消引起的中止，当前任务自身被取消时继续向上抛出
+                if cancel is not None and cancel.cancelled and not asyncio.current_task().cancelling():
+                    raise GrokApiException(f"请求已取消: {cancel.reason}", "REQUEST_CANCELLED")
+                raise
+            except TimeoutError as e:
+                transfer.abort()
+                logger.warning(f"[Client] 上游 {first_response_timeout} 秒内未返回响应头，已中止传输")
+                raise GrokApiException(f"上游响应超时 ({first_response_timeout}秒)", "UPSTREAM_TIMEOUT") from e
+            finally:
+                if cancel is not None:
+                    cancel.remove_callback(abort_post)
+                if not post.done():
+                    post.cancel()
 
             logger.debug(f"[Client] API响应状态码: {response.status_code}")
 
             # 处理非成功响应
             if response.status_code != 200:
-                GrokClient._handle_error(response, auth_token)
+                await GrokClient._handle_error(response, auth_token, model)
 
-            # 请求成功，重置失败计数
-            asyncio.create_task(token_manager.reset_failure(auth_token))
+            # 响应头到达，按首字节耗时计入熔断与速度统计（已取消的尝试不计入）
+            ttfb = time.monotonic() - started
+            if cancel is None or not cancel.cancelled:
+                circuit_breakers.record(sso_value, proxy_url, True, ttfb)
+                latency_tracker.record_ttfb(sso_value, proxy_url, ttfb)
+            if first_byte is not None:
+                first_byte.set()
 
             # 处理并返回响应
-            return await GrokClient._process_response(response, auth_token, model, stream)
-
+            outcome = outcome or StreamOutcome()
+            result = await GrokClient._process_response(response, auth_token, model, stream, cancel, outcome)
+
+            # 流式响应在读取结束后才归还会话
+            if stream:
+                handed_off = True
+                result = GrokClient._observe_stream(result, sso_value, proxy_url, outcome)
+                return GrokClient._release_on_close(result, lambda: session_pool.checkin(pooled))
+            return result
+
+        except GrokApiException as e:
+            cancelled = cancel is not None and cancel.cancelled
+            if not cancelled and circuit_breakers.is_failure(e.error_code, e.details.get("status")):
+                circuit_breakers.record(sso_value, proxy_url, False)
+            raise
         except curl_requests.RequestsError as e:
             logger.error(f"[Client] 网络请求错误: {e}")
+            if cancel is None or not cancel.cancelled:
+                circuit_breakers.record(sso_value, proxy_url, False)
             raise GrokApiException(f"网络错误: {e}", "NETWORK_ERROR") from e
         except json.JSONDecodeError as e:
             logger.error(f"[Client] JSON解析错误: {e}")
@@ -241,6 +517,43 @@ class GrokClient:
         except Exception as e:
             logger.error(f"[Client] 未知请求错误: {type(e).__name__}: {e}")
             raise GrokApiException(f"请求处理错误: {e}", "REQUEST_ERROR") from e
+        finally:
+            if pooled and not handed_off:
+                session_pool.checkin(pooled)
+
+    @staticmethod
+    async def _observe_stream(stream: AsyncGenerator, sso_value: Optional[str], proxy_url: str,
+                              outcome: StreamOutcome) -> AsyncGenerator:
+        """包装流式生成器：正常结束时记录吞吐量，中途超时或出错时计入熔断统计（按 outcome 判断）"""
+        size = 0
+        first_at = None
+        try:
+            async for chunk in stream:
+                if first_at is None:
+                    first_at = time.monotonic()
+                size += len(chunk)
+                yield chunk
+        finally:
+            if outcome.status is StreamStatus.COMPLETED:
+                if first_at is not None:
+                    latency_tracker.record_throughput(sso_value, proxy_url, size, time.monotonic() - first_at)
+            elif outcome.status in (StreamStatus.STALLED, StreamStatus.ERROR):
+                metrics.inc(f"stream.{outcome.status.value}")
+                circuit_breakers.record(sso_value, proxy_url, False)
+            await stream.aclose()
+
+    @staticmethod
+    async def _release_on_close(stream: AsyncGenerator, release: Callable[[], None]) -> AsyncGenerator:
+        """包装流式生成器，结束或被取消时执行释放回调"""
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            # 关闭过程中可能再次被取消，释放回调必须始终执行
+            try:
+                await stream.aclose()
+            finally:
+                release()
 
     @staticmethod
     def _build_headers(auth_token: str) -> Dict[str, str]:
@@ -254,18 +567,24 @@ class GrokClient:
         return headers
 
     @staticmethod
-    def _handle_error(response, auth_token: str):
+    async def _handle_error(response, auth_token: str, model: str):
         """处理错误响应"""
         try:
-            error_data = response.json()
+            body = await response.acontent()
+        except Exception:
+            body = b""
+
+        try:
+            error_data = json.loads(body)
             error_message = str(error_data)
         except Exception:
             # 如果响应不是JSON格式（如HTML或空响应），使用响应文本
-            error_data = response.text
+            error_data = body.decode("utf-8", errors="replace")
             error_message = error_data[:200] if error_data else f"HTTP {response.status_code}"
 
-        # 记录Token失败
-        asyncio.create_task(token_manager.record_failure(auth_token, response.status_code, error_message))
+        # 429：立即与上游对账（失败计数、冷却与本地耗尽标记在归还租约时处理）
+        if response.status_code == 429:
+            rate_limit_refresher.schedule(auth_token, model, force=True)
 
         raise GrokApiException(
             f"请求失败: {response.status_code} - {error_message}",
@@ -274,21 +593,16 @@ class GrokClient:
         )
 
     @staticmethod
-    async def _process_response(response, auth_token: str, model: str, stream: bool):
+    async def _process_response(response, auth_token: str, model: str, stream: bool, cancel: Optional[CancelToken] = None,
+                                outcome: Optional[StreamOutcome] = None):
         """处理API响应"""
         if stream:
-            result = GrokResponseProcessor.process_stream(response, auth_token)
-            asyncio.create_task(GrokClient._update_rate_limits(auth_token, model))
+            result = GrokResponseProcessor.process_stream(response, auth_token, cancel, outcome)
         else:
-            result = await GrokResponseProcessor.process_normal(response, auth_token, model)
-            asyncio.create_task(GrokClient._update_rate_limits(auth_token, model))
+            result = await GrokResponseProcessor.process_normal(response, auth_token, model, cancel)
 
-        return result
+        # 本地按计费倍数扣减配额，仅在需要时与上游对账
+        if quota_ledger.charge(auth_token, model):
+            rate_limit_refresher.schedule(auth_token, model)
 
-    @staticmethod
-    async def _update_rate_limits(auth_token: str, model: str):
-        """异步更新速率限制信息"""
-        try:
-            await token_manager.check_limits(auth_token, model)
-        except Exception as e:
-            logger.error(f"[Client] 更新速率限制失败: {e}")
\ No newline at end of file
+        return result
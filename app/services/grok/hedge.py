@@ -0,0 +1,56 @@
+"""对冲请求策略模块"""
+
+from typing import Any, Dict, Optional
+
+from app.core.config import setting
+from app.core.metrics import metrics
+from app.services.grok.latency import latency_tracker
+
+# 常量定义
+DEFAULT_PERCENTILE = 95  # 超过最近首字节耗时的该分位数仍无响应时发起对冲
+DEFAULT_BUDGET_PERCENT = 10  # 对冲请求占可对冲请求的最大比例（%）
+BUDGET_BURST = 10  # 预算最多累积的对冲次数
+MIN_HEDGE_DELAY = 0.05  # 最短对冲延迟（秒）
+
+
+class HedgePolicy:
+    """
+    对冲请求策略
+
+    - 延迟：最近全局首字节耗时的分位数，样本不足时不对冲
+    - 预算：每个可对冲请求积累 budget% 次对冲额度，发起对冲消耗 1 次，
+      保证对冲带来的额外配额消耗不超过设定比例（允许少量突发）
+    """
+
+    def __init__(self):
+        self._credits = 0.0
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(setting.grok_config.get("hedge_enabled", False))
+
+    def on_request(self) -> None:
+        """记录一次可对冲的请求，积累对冲额度"""
+        ratio = float(setting.grok_config.get("hedge_budget_percent", DEFAULT_BUDGET_PERCENT)) / 100
+        self._credits = min(float(BUDGET_BURST), self._credits + ratio)
+
+    def delay(self) -> Optional[float]:
+        """发起对冲前的等待时间（秒），样本不足时返回 None"""
+        percentile = float(setting.grok_config.get("hedge_percentile", DEFAULT_PERCENTILE))
+        threshold = latency_tracker.ttfb_percentile(percentile)
+        return None if threshold is None else max(MIN_HEDGE_DELAY, threshold)
+
+    def try_spend(self) -> bool:
+        """消耗一次对冲额度，额度不足时返回 False"""
+        if self._credits < 1:
+            metrics.inc("hedge.budget_exhausted")
+            return False
+        self._credits -= 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {"credits": round(self._credits, 2), "delay": self.delay()}
+
+
+# 全局对冲策略实例
+hedge_policy = HedgePolicy()
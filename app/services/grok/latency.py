@@ -0,0 +1,109 @@
+"""Token 与代理响应速度统计模块"""
+
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from app.core.config import setting
+
+# 常量定义
+DEFAULT_ALPHA = 0.2  # EWMA 平滑系数，越大越偏重最近的样本
+REFERENCE_BYTES = 4096  # 估算耗时时参考的响应大小（字节）
+MIN_STREAM_SECONDS = 0.05  # 计算吞吐量的最短传输时间（秒），过短的流不计入
+DEFAULT_EXPLORE_RATE = 0.05  # 按速度选择时随机探索的概率
+RECENT_TTFB_SAMPLES = 200  # 全局首字节耗时分位数的样本窗口
+MIN_PERCENTILE_SAMPLES = 20  # 计算分位数所需的最少样本数
+
+LatencyKey = Tuple[str, str]  # (资源类型 token/proxy, 标识)
+
+
+class _Ewma:
+    """指数加权移动平均"""
+    __slots__ = ("value", "samples")
+
+    def __init__(self):
+        self.value: Optional[float] = None
+        self.samples = 0
+
+    def add(self, sample: float, alpha: float) -> None:
+        self.value = sample if self.value is None else self.value + alpha * (sample - self.value)
+        self.samples += 1
+
+
+class LatencyTracker:
+    """
+    记录每个 Token 与代理的首字节耗时（TTFB）与流式吞吐量的 EWMA
+
+    估算耗时 = TTFB + 参考大小 / 吞吐量，供选择策略优先使用更快的资源；
+    尚无样本的资源返回 None，由调用方按需优先探索。
+    """
+
+    def __init__(self):
+        self._ttfb: Dict[LatencyKey, _Ewma] = {}
+        self._throughput: Dict[LatencyKey, _Ewma] = {}  # 字节/秒
+        self._recent_ttfb: Deque[float] = deque(maxlen=RECENT_TTFB_SAMPLES)
+
+    @staticmethod
+    def _alpha() -> float:
+        return float(setting.grok_config.get("latency_ewma_alpha", DEFAULT_ALPHA))
+
+    @staticmethod
+    def _add(table: Dict[LatencyKey, _Ewma], key: LatencyKey, sample: float, alpha: float) -> None:
+        ewma = table.get(key)
+        if ewma is None:
+            ewma = table[key] = _Ewma()
+        ewma.add(sample, alpha)
+
+    def record_ttfb(self, sso_value: Optional[str], proxy_url: str, seconds: float) -> None:
+        """记录一次首字节耗时"""
+        self._recent_ttfb.append(seconds)
+        alpha = self._alpha()
+        if sso_value:
+            self._add(self._ttfb, ("token", sso_value), seconds, alpha)
+        if proxy_url:
+            self._add(self._ttfb, ("proxy", proxy_url), seconds, alpha)
+
+    def record_throughput(self, sso_value: Optional[str], proxy_url: str, size: int, seconds: float) -> None:
+        """记录一次流式传输的吞吐量"""
+        if seconds < MIN_STREAM_SECONDS or size <= 0:
+            return
+        alpha = self._alpha()
+        rate = size / seconds
+        if sso_value:
+            self._add(self._throughput, ("token", sso_value), rate, alpha)
+        if proxy_url:
+            self._add(self._throughput, ("proxy", proxy_url), rate, alpha)
+
+    def estimate(self, kind: str, name: str) -> Optional[float]:
+        """资源的估算耗时（秒），无首字节样本时返回 None"""
+        ttfb = self._ttfb.get((kind, name))
+        if ttfb is None:
+            return None
+        throughput = self._throughput.get((kind, name))
+        if throughput is None or not throughput.value:
+            return ttfb.value
+        return ttfb.value + REFERENCE_BYTES / throughput.value
+
+    def ttfb_percentile(self, percentile: float) -> Optional[float]:
+        """最近请求首字节耗时的分位数（秒），样本不足时返回 None"""
+        if len(self._recent_ttfb) < MIN_PERCENTILE_SAMPLES:
+            return None
+        samples = sorted(self._recent_ttfb)
+        rank = min(len(samples) - 1, max(0, int(len(samples) * percentile / 100)))
+        return samples[rank]
+
+    @staticmethod
+    def explore_rate() -> float:
+        """按速度选择时随机探索的概率"""
+        return float(setting.grok_config.get("latency_explore_rate", DEFAULT_EXPLORE_RATE))
+
+    def token_estimate(self, sso_value: str) -> Optional[float]:
+        """Token 的估算耗时（秒）"""
+        return self.estimate("token", sso_value)
+
+    def proxy_estimate(self, proxy_url: str) -> Optional[float]:
+        """代理的估算耗时（秒）"""
+        return self.estimate("proxy", proxy_url)
+
+
+# 全局响应速度统计实例
+latency_tracker = LatencyTracker()
@@ -0,0 +1,64 @@
+"""上游 NDJSON 行解析模块"""
+
+import json
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from app.core.logger import logger
+
+_decoder = json.JSONDecoder()
+
+
+def _json_loads(line: bytes) -> Any:
+    """标准库解析：显式按 UTF-8 解码，跳过 json.loads(bytes) 的编码探测与参数处理"""
+    return _decoder.decode(line.decode("utf-8"))
+
+
+# 可用解析器（orjson.JSONDecodeError 继承自 json.JSONDecodeError，调用方异常处理无需区分）
+PARSERS: Dict[str, Callable[[bytes], Any]] = {"json": _json_loads}
+if orjson is not None:
+    PARSERS["orjson"] = orjson.loads
+
+_loads: Callable[[bytes], Any] = PARSERS.get("orjson", _json_loads)
+_parser_name = "orjson" if orjson is not None else "json"
+
+
+def use_parser(name: str) -> None:
+    """切换解析器（json / orjson）"""
+    global _loads, _parser_name
+    if name not in PARSERS:
+        raise ValueError(f"解析器不可用: {name}")
+    _loads = PARSERS[name]
+    _parser_name = name
+    logger.debug(f"[NDJSON] 使用解析器: {name}")
+
+
+def parser_name() -> str:
+    """当前解析器名称"""
+    return _parser_name
+
+
+def parse_line(line: bytes) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    解析一行上游数据，orjson 可用时直接解析 bytes（无需先解码为 str）
+
+    一次取出处理器需要的字段，返回 (error, result.response)；
+    字段缺失或类型不符时 response 为空字典。
+    """
+    data = _loads(line)
+    try:
+        # 常见行结构直接取值
+        response = data["result"]["response"]
+        if type(response) is dict:
+            return data.get("error"), response
+    except (KeyError, TypeError):
+        pass
+    if not isinstance(data, dict):
+        return None, {}
+    result = data.get("result")
+    response = result.get("response") if isinstance(result, dict) else None
+    return data.get("error"), response if isinstance(response, dict) else {}
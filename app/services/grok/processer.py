@@ -4,24 +4,51 @@ import json
 import uuid
 import time
 import asyncio
-from typing import AsyncGenerator
+from enum import Enum
+from typing import AsyncGenerator, Optional
 
 from app.core.config import setting
 from app.core.exception import GrokApiException
 from app.core.logger import logger
+from app.core.metrics import metrics
 from app.models.openai_schema import (
     OpenAIChatCompletionResponse,
     OpenAIChatCompletionChoice,
-    OpenAIChatCompletionMessage,
-    OpenAIChatCompletionChunkResponse,
-    OpenAIChatCompletionChunkChoice,
-    OpenAIChatCompletionChunkMessage
+    OpenAIChatCompletionMessage
 )
 from app.services.grok.cache import image_cache_service, video_cache_service
+from app.services.grok.cancel import CancelToken
+from app.services.grok.ndjson import parse_line
+from app.services.grok.sse import SSEChunkEncoder, DeltaCoalescer, SSE_DONE
+
+
+class StreamStatus(Enum):
+    """流式响应的结束状态"""
+    COMPLETED = "completed"  # 正常结束
+    STALLED = "stalled"      # 首次响应、块间隔或总时长超时
+    ERROR = "error"          # 上游返回错误或处理出错
+    CANCELLED = "cancelled"  # 客户端断开或请求被取消
+
+
+class StreamOutcome:
+    """流式响应的结果，由 process_stream 在结束时写入；流被提前关闭时保持为 None"""
+    __slots__ = ("status", "reason")
+
+    def __init__(self):
+        self.status: Optional[StreamStatus] = None
+        self.reason = ""
+
+    def set(self, status: StreamStatus, reason: str = "") -> None:
+        self.status = status
+        self.reason = reason
 
 
 class StreamTimeoutManager:
-    """流式响应超时管理器"""
+    """流式响应超时管理器
+
+    基于截止时间计算每次读取的等待预算，读取方用 asyncio.timeout_at
+    等待上游数据，上游完全静默时超时也能按时触发。
+    """
     
     def __init__(self, chunk_timeout: int = 120, first_response_timeout: int = 30, total_timeout: int = 600):
         """初始化超时管理器
@@ -35,9 +62,35 @@ class StreamTimeoutManager:
         self.first_response_timeout = first_response_timeout
         self.total_timeout = total_timeout
         
-        self.start_time = asyncio.get_event_loop().time()
+        self._loop = asyncio.get_running_loop()
+        self.start_time = self._loop.time()
         self.last_chunk_time = self.start_time
         self.first_chunk_received = False
+
+    @classmethod
+    def from_settings(cls) -> "StreamTimeoutManager":
+        """按当前配置创建超时管理器"""
+        return cls(
+            chunk_timeout=setting.grok_config.get("stream_chunk_timeout", 120),
+            first_response_timeout=setting.grok_config.get("stream_first_response_timeout", 30),
+            total_timeout=setting.grok_config.get("stream_total_timeout", 600)
+        )
+
+    def next_deadline(self) -> tuple[float, str]:
+        """获取最近的截止时间（事件循环时间）及其超时信息"""
+        if not self.first_chunk_received:
+            deadline = self.start_time + self.first_response_timeout
+            message = f"首次响应超时 ({self.first_response_timeout}秒未收到首个数据块)"
+        else:
+            deadline = self.last_chunk_time + self.chunk_timeout
+            message = f"数据块间隔超时 ({self.chunk_timeout}秒无新数据)"
+
+        # 总超时更早到期时以总超时为准
+        if self.total_timeout > 0 and self.start_time + self.total_timeout < deadline:
+            deadline = self.start_time + self.total_timeout
+            message = f"流式响应总超时 ({self.total_timeout}秒)"
+
+        return deadline, message
     
     def check_timeout(self) -> tuple[bool, str]:
         """检查是否超时
@@ -45,60 +98,209 @@ class StreamTimeoutManager:
         Returns:
             (is_timeout, timeout_message): 是否超时及超时信息
         """
-        current_time = asyncio.get_event_loop().time()
-        
-        # 检查首次响应超时
-        if not self.first_chunk_received:
-            if current_time - self.start_time > self.first_response_timeout:
-                return True, f"首次响应超时 ({self.first_response_timeout}秒未收到首个数据块)"
-        
-        # 检查总超时
-        if self.total_timeout > 0:
-            if current_time - self.start_time > self.total_timeout:
-                return True, f"流式响应总超时 ({self.total_timeout}秒)"
-        
-        # 检查数据块间隔超时
-        if self.first_chunk_received:
-            if current_time - self.last_chunk_time > self.chunk_timeout:
-                return True, f"数据块间隔超时 ({self.chunk_timeout}秒无新数据)"
-        
+        deadline, message = self.next_deadline()
+        if self._loop.time() > deadline:
+            return True, message
         return False, ""
     
     def mark_chunk_received(self):
         """标记收到数据块"""
-        self.last_chunk_time = asyncio.get_event_loop().time()
+        self.last_chunk_time = self._loop.time()
         self.first_chunk_received = True
     
     def get_total_duration(self) -> float:
         """获取总耗时（秒）"""
-        return asyncio.get_event_loop().time() - self.start_time
+        return self._loop.time() - self.start_time
+
+
+def _abort_transfer(response) -> Optional[asyncio.Task]:
+    """同步中止上游传输，返回待回收的传输任务
+
+    不包含 await，调用方正被取消时也能保证上游连接被立即断开。
+    """
+    if quit_now := getattr(response, "quit_now", None):
+        quit_now.set()
+    task = getattr(response, "astream_task", None)
+    if task is not None and not task.done():
+        task.cancel()
+        metrics.inc("upstream.aborted")
+    return task
+
+
+async def _abort_response(response) -> None:
+    """关闭上游流式响应，未读完时立即中止传输"""
+    if (task := _abort_transfer(response)) is not None:
+        await asyncio.gather(task, return_exceptions=True)
+
+
+class UpstreamLineReader:
+    """上游 NDJSON 异步行读取器
+
+    后台任务按块读取流式响应并切分为行，放入有界 asyncio.Queue；
+    处理方只在队列上等待，不会阻塞事件循环，多个并发流可交错处理。
+    """
+
+    _EOF = object()
+
+    def __init__(self, response, max_lines: int = 256, cancel: Optional[CancelToken] = None):
+        self._response = response
+        self._queue: asyncio.Queue = asyncio.Queue(max_lines)
+        self._eof = False
+        self._aborted = False
+        self._closed = False
+        self._task = asyncio.create_task(self._pump())
+        self._cancel = cancel
+        if cancel is not None:
+            cancel.add_callback(self.abort)
+
+    async def _pump(self) -> None:
+        """读取数据块并按换行切分"""
+        buffer = bytearray()
+        try:
+            async for chunk in self._response.aiter_content():
+                buffer += chunk
+                if b"\n" not in chunk:
+                    continue
+                *lines, rest = bytes(buffer).split(b"\n")
+                buffer = bytearray(rest)
+                for line in lines:
+                    if line:
+                        await self._queue.put(line)
+            if buffer:
+                await self._queue.put(bytes(buffer))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._queue.put(e)
+        # 等待队列有空位后再放入 EOF，保证处理方较慢时结束标记也不会丢失（中止时由 abort 放入）
+        await self._queue.put(self._EOF)
+
+    async def readline(self, deadline: Optional[float] = None) -> Optional[bytes]:
+        """读取下一行，流结束时返回 None
+
+        Args:
+            deadline: 截止时间（事件循环时间），到期仍无数据时抛出 TimeoutError
+        """
+        if self._eof or self._aborted:
+            return None
+        async with asyncio.timeout_at(deadline):
+            item = await self._queue.get()
+        if item is self._EOF or self._aborted:
+            self._eof = True
+            return None
+        if isinstance(item, Exception):
+            self._eof = True
+            raise item
+        return item
+
+    def __aiter__(self) -> "UpstreamLineReader":
+        return self
+
+    async def __anext__(self) -> bytes:
+        line = await self.readline()
+        if line is None:
+            raise StopAsyncIteration
+        return line
+
+    def abort(self) -> None:
+        """立即停止读取并中止上游传输（同步，可在取消回调中调用）
+
+        同时放入 EOF 唤醒等待中的 readline，使其随即返回 None。
+        """
+        self._aborted = True
+        if not self._task.done():
+            self._task.cancel()
+        _abort_transfer(self._response)
+        try:
+            self._queue.put_nowait(self._EOF)
+        except asyncio.QueueFull:
+            pass
+
+    async def close(self) -> None:
+        """停止读取并关闭上游响应（可重复调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._cancel is not None:
+            self._cancel.remove_callback(self.abort)
+        # 先同步中止，再回收任务；回收过程被取消也不会留下未中止的传输
+        self.abort()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await _abort_response(self._response)
 
 
 class GrokResponseProcessor:
     """Grok API 响应处理器"""
 
     @staticmethod
-    async def process_normal(response, auth_token: str, model: str = None) -> OpenAIChatCompletionResponse:
-        """处理非流式响应"""
-        response_closed = False
+    async def _download_unless_cancelled(coro, cancel: Optional[CancelToken] = None):
+        """执行媒体下载；请求已取消时跳过，下载中途取消时立即中止（均返回 None）"""
+        if cancel is None:
+            return await coro
+        if cancel.cancelled:
+            coro.close()
+            metrics.inc("media.skipped")
+            return None
+        task = asyncio.ensure_future(coro)
+        cancel.add_callback(task.cancel)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # 仅吞掉由请求取消引起的中止，当前任务自身被取消时继续向上抛出
+            if cancel.cancelled and not asyncio.current_task().cancelling():
+                metrics.inc("media.skipped")
+                return None
+            raise
+        finally:
+            cancel.remove_callback(task.cancel)
+
+    @staticmethod
+    async def _prefetch_images(images: list, auth_token: str, image_mode: str, cancel: Optional[CancelToken] = None) -> list:
+        """并发下载所有生成图片，按原顺序返回结果（失败项为异常对象）"""
+        if image_mode == "base64":
+            tasks = [image_cache_service.download_base64(f"/{img}", auth_token) for img in images]
+        else:
+            tasks = [image_cache_service.download_image(f"/{img}", auth_token) for img in images]
+        return await asyncio.gather(
+            *(GrokResponseProcessor._download_unless_cancelled(task, cancel) for task in tasks),
+            return_exceptions=True
+        )
+
+    @staticmethod
+    async def process_normal(response, auth_token: str, model: str = None,
+                             cancel: Optional[CancelToken] = None) -> OpenAIChatCompletionResponse:
+        """处理非流式响应
+
+        Args:
+            cancel: 请求取消信号（如对冲请求落败），触发后立即中止上游传输
+        """
+        reader = UpstreamLineReader(response, cancel=cancel)
+        timeout_manager = StreamTimeoutManager.from_settings()
         try:
-            for chunk in response.iter_lines():
+            while True:
+                # 按截止时间等待下一行，上游静默超时后中止请求
+                deadline, timeout_msg = timeout_manager.next_deadline()
+                try:
+                    chunk = await reader.readline(deadline)
+                except TimeoutError:
+                    logger.warning(f"[Processor] {timeout_msg}")
+                    raise GrokApiException(f"上游响应超时: {timeout_msg}", "UPSTREAM_TIMEOUT")
+                if chunk is None:
+                    break
+                timeout_manager.mark_chunk_received()
                 if not chunk:
                     continue
 
-                data = json.loads(chunk.decode("utf-8"))
+                error, grok_resp = parse_line(chunk)
 
                 # 错误检查
-                if error := data.get("error"):
+                if error:
                     raise GrokApiException(
                         f"API错误: {error.get('message', '未知错误')}",
                         "API_ERROR",
                         {"code": error.get("code")}
                     )
 
-                # 提取响应数据
-                grok_resp = data.get("result", {}).get("response", {})
-                
                 # 提取视频数据
                 if video_resp := grok_resp.get("streamingVideoGenerationResponse"):
                     if video_url := video_resp.get("videoUrl"):
@@ -135,8 +337,6 @@ class GrokResponseProcessor:
                             )],
                             usage=None
                         )
-                        response_closed = True
-                        response.close()
                         return result
 
                 # 提取模型响应
@@ -159,19 +359,22 @@ class GrokResponseProcessor:
                 if images := model_response.get("generatedImageUrls"):
                     # 获取图片返回模式
                     image_mode = setting.global_config.get("image_mode", "url")
+                    fetched = await GrokResponseProcessor._prefetch_images(images, auth_token, image_mode, cancel)
 
-                    for img in images:
+                    for img, result in zip(images, fetched):
                         try:
+                            if isinstance(result, Exception):
+                                raise result
                             if image_mode == "base64":
                                 # base64 模式：下载并转换为 base64
-                                base64_str = await image_cache_service.download_base64(f"/{img}", auth_token)
+                                base64_str = result
                                 if base64_str:
                                     content += f"\n![Generated Image]({base64_str})"
                                 else:
                                     content += f"\n![Generated Image](https://assets.grok.com/{img})"
                             else:
                                 # url 模式：缓存并返回链接
-                                cache_path = await image_cache_service.download_image(f"/{img}", auth_token)
+                                cache_path = result
                                 if cache_path:
                                     img_path = img.replace('/', '-')
                                     base_url = setting.global_config.get("base_url", "")
@@ -199,12 +402,14 @@ class GrokResponseProcessor:
                     )],
                     usage=None
                 )
-                response_closed = True
-                response.close()
                 return result
 
+            if cancel is not None and cancel.cancelled:
+                raise GrokApiException(f"请求已取消: {cancel.reason}", "REQUEST_CANCELLED")
             raise GrokApiException("无响应数据", "NO_RESPONSE")
 
+        except GrokApiException:
+            raise
         except json.JSONDecodeError as e:
             logger.error(f"[Processor] JSON解析失败: {e}")
             raise GrokApiException(f"JSON解析失败: {e}", "JSON_ERROR") from e
@@ -212,16 +417,24 @@ class GrokResponseProcessor:
             logger.error(f"[Processor] 处理响应时发生未知错误: {type(e).__name__}: {e}")
             raise GrokApiException(f"响应处理错误: {e}", "PROCESS_ERROR") from e
         finally:
-            # 确保响应对象被关闭，避免双重释放
-            if not response_closed and hasattr(response, 'close'):
-                try:
-                    response.close()
-                except Exception as e:
-                    logger.warning(f"[Processor] 关闭响应对象时出错: {e}")
+            # 确保响应对象被关闭（提前返回时中止剩余传输）
+            try:
+                await reader.close()
+            except Exception as e:
+                logger.warning(f"[Processor] 关闭响应对象时出错: {e}")
 
     @staticmethod
-    async def process_stream(response, auth_token: str) -> AsyncGenerator[str, None]:
-        """处理流式响应"""
+    async def process_stream(response, auth_token: str, cancel: Optional[CancelToken] = None,
+                             outcome: Optional[StreamOutcome] = None) -> AsyncGenerator[bytes, None]:
+        """处理流式响应
+
+        超时与错误以 SSE 结束块返回给客户端，不向外抛出；结束状态写入 outcome 供调用方统计。
+
+        Args:
+            cancel: 请求取消信号，客户端断开时触发，立即中止上游传输并跳过未开始的媒体下载
+            outcome: 流式响应结果，结束时写入状态
+        """
+        outcome = outcome or StreamOutcome()
         # 流式生成状态
         is_image = False
         is_thinking = False
@@ -231,60 +444,62 @@ class GrokResponseProcessor:
         filtered_tags = setting.grok_config.get("filtered_tags", "").split(",")
         video_progress_started = False
         last_video_progress = -1
-        response_closed = False
 
         # 初始化超时管理器
-        timeout_manager = StreamTimeoutManager(
-            chunk_timeout=setting.grok_config.get("stream_chunk_timeout", 120),
-            first_response_timeout=setting.grok_config.get("stream_first_response_timeout", 30),
-            total_timeout=setting.grok_config.get("stream_total_timeout", 600)
-        )
-
-        def make_chunk(chunk_content: str, finish: str = None):
-            """生成OpenAI格式的响应块"""
-            chunk_data = OpenAIChatCompletionChunkResponse(
-                id=f"chatcmpl-{uuid.uuid4()}",
-                created=int(time.time()),
-                model=model or "grok-4-mini-thinking-tahoe",
-                choices=[OpenAIChatCompletionChunkChoice(
-                    index=chunk_index,
-                    delta=OpenAIChatCompletionChunkMessage(
-                        role="assistant",
-                        content=chunk_content
-                    ) if chunk_content else {},
-                    finish_reason=finish
-                )]
-            ).model_dump()
-            # SSE 格式返回
-            return f"data: {json.dumps(chunk_data)}\n\n"
-
+        timeout_manager = StreamTimeoutManager.from_settings()
+
+        # 每个流共用一个字节模板编码器；可选的增量合并器
+        encoder = SSEChunkEncoder()
+        coalescer = DeltaCoalescer.from_settings()
+
+        def make_chunk(chunk_content: str, finish: str = None) -> bytes:
+            """生成OpenAI格式的SSE响应块（先带出合并器中暂存的内容）"""
+            encoder.set_model(model)
+            if coalescer is not None and coalescer.pending:
+                pending = coalescer.take()
+                if finish is not None:
+                    return encoder.encode(pending, None, chunk_index) + encoder.encode(chunk_content, finish, chunk_index)
+                chunk_content = pending + chunk_content
+            return encoder.encode(chunk_content, finish, chunk_index)
+
+        reader = UpstreamLineReader(response, cancel=cancel)
         try:
-            for chunk in response.iter_lines():
-                # 超时检查
-                is_timeout, timeout_msg = timeout_manager.check_timeout()
-                if is_timeout:
+            while True:
+                # 按截止时间等待下一行，超时后立即结束并中止上游传输
+                deadline, timeout_msg = timeout_manager.next_deadline()
+                # 有暂存增量时，最迟在合并窗口到期时醒来发送
+                flush_at = coalescer.flush_deadline() if coalescer is not None else None
+                try:
+                    chunk = await reader.readline(deadline if flush_at is None else min(deadline, flush_at))
+                except TimeoutError:
+                    if flush_at is not None and flush_at < deadline:
+                        yield make_chunk("")
+                        chunk_index += 1
+                        continue
                     logger.warning(f"[Processor] {timeout_msg}")
+                    outcome.set(StreamStatus.STALLED, timeout_msg)
                     yield make_chunk("", "stop")
-                    yield "data: [DONE]\n\n"
+                    yield SSE_DONE
                     return
+                if chunk is None:
+                    break
 
                 logger.debug(f"[Processor] 接收到数据块: {len(chunk)} bytes")
                 if not chunk:
                     continue
 
                 try:
-                    data = json.loads(chunk.decode("utf-8"))
+                    error, grok_resp = parse_line(chunk)
 
                     # 错误检查
-                    if error := data.get("error"):
+                    if error:
                         error_msg = error.get('message', '未知错误')
                         logger.error(f"[Processor] Grok API返回错误: {error_msg}")
+                        outcome.set(StreamStatus.ERROR, error_msg)
                         yield make_chunk(f"Error: {error_msg}", "stop")
-                        yield "data: [DONE]\n\n"
+                        yield SSE_DONE
                         return
 
-                    # 提取响应数据
-                    grok_resp = data.get("result", {}).get("response", {})
                     logger.debug(f"[Processor] 解析响应数据: {len(grok_resp)} 字段")
                     if not grok_resp:
                         continue
@@ -317,7 +532,9 @@ class GrokResponseProcessor:
                                     full_video_url = f"https://assets.grok.com/{v_url}"
                                     
                                     try:
-                                        cache_path = await video_cache_service.download_video(f"/{v_url}", auth_token)
+                                        cache_path = await GrokResponseProcessor._download_unless_cancelled(
+                                            video_cache_service.download_video(f"/{v_url}", auth_token), cancel
+                                        )
                                         if cache_path:
                                             video_path = v_url.replace('/', '-')
                                             base_url = setting.global_config.get("base_url", "")
@@ -351,12 +568,16 @@ class GrokResponseProcessor:
                             # 初始化内容变量
                             content = ""
 
-                            # 生成图片链接并缓存
-                            for img in model_resp.get("generatedImageUrls", []):
+                            # 生成图片链接并缓存（并发下载，按顺序输出）
+                            images = model_resp.get("generatedImageUrls", [])
+                            fetched = await GrokResponseProcessor._prefetch_images(images, auth_token, image_mode, cancel)
+                            for img, result in zip(images, fetched):
                                 try:
+                                    if isinstance(result, Exception):
+                                        raise result
                                     if image_mode == "base64":
                                         # base64 模式：下载并转换为 base64
-                                        base64_str = await image_cache_service.download_base64(f"/{img}", auth_token)
+                                        base64_str = result
                                         if base64_str:
                                             # 分块发送 base64 数据，每 8KB 一个 chunk
                                             markdown_prefix = "![Generated Image](data:"
@@ -400,7 +621,6 @@ class GrokResponseProcessor:
                                             chunk_index += 1
                                     else:
                                         # url 模式：缓存并返回链接
-                                        await image_cache_service.download_image(f"/{img}", auth_token)
                                         # 本地图片路径
                                         img_path = img.replace('/', '-')
                                         base_url = setting.global_config.get("base_url", "")
@@ -413,6 +633,7 @@ class GrokResponseProcessor:
                             # 发送内容
                             yield make_chunk(content.strip(), "stop")
                             timeout_manager.mark_chunk_received()
+                            outcome.set(StreamStatus.COMPLETED)
                             return
                         elif token:
                             yield make_chunk(token)
@@ -470,9 +691,15 @@ class GrokResponseProcessor:
                                 content = f"\n</think>\n{content}"
                                 thinking_finished = True
 
-                            yield make_chunk(content)
+                            # 思考/标题切换不参与合并，连同已暂存内容立即发送
+                            transition = message_tag == "header" or is_thinking != current_is_thinking
+                            if coalescer is None or transition:
+                                yield make_chunk(content)
+                                chunk_index += 1
+                            elif coalescer.add(content):
+                                yield make_chunk("")
+                                chunk_index += 1
                             timeout_manager.mark_chunk_received()
-                            chunk_index += 1
                             is_thinking = current_is_thinking
 
                 except (json.JSONDecodeError, UnicodeDecodeError) as e:
@@ -482,25 +709,36 @@ class GrokResponseProcessor:
                     logger.warning(f"[Processor] 处理chunk出错: {e}")
                     continue
 
+            # 客户端已断开：上游已中止，无需再发送结束块
+            if cancel is not None and cancel.cancelled:
+                logger.info(f"[Processor] 客户端已断开，流式响应已取消，耗时: {timeout_manager.get_total_duration():.2f}秒")
+                outcome.set(StreamStatus.CANCELLED, cancel.reason)
+                return
+
             # 发送结束块
             yield make_chunk("", "stop")
 
             # 发送流结束标记
-            yield "data: [DONE]\n\n"
-            
+            yield SSE_DONE
+            outcome.set(StreamStatus.COMPLETED)
+
             # 记录流式响应统计
             logger.info(f"[Processor] 流式响应完成，总耗时: {timeout_manager.get_total_duration():.2f}秒")
 
+        except asyncio.CancelledError:
+            logger.info("[Processor] 流式响应任务被取消，已中止上游传输")
+            outcome.set(StreamStatus.CANCELLED, "task_cancelled")
+            raise
         except Exception as e:
             logger.error(f"[Processor] 流式处理严重错误: {e}")
+            outcome.set(StreamStatus.ERROR, str(e))
             yield make_chunk(f"处理错误: {e}", "error")
             # 发送流结束标记
-            yield "data: [DONE]\n\n"
+            yield SSE_DONE
         finally:
             # 确保响应对象被关闭
-            if not response_closed and hasattr(response, 'close'):
-                try:
-                    response.close()
-                    logger.debug("[Processor] 流式响应对象已关闭")
-                except Exception as e:
-                    logger.warning(f"[Processor] 关闭流式响应对象时出错: {e}")
\ No newline at end of file
+            try:
+                await reader.close()
+                logger.debug("[Processor] 流式响应对象已关闭")
+            except Exception as e:
+                logger.warning(f"[Processor] 关闭流式响应对象时出错: {e}")
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""本地配额账本模块"""
+
+import time
+from typing import Dict, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.models.grok_models import Models
+from app.services.grok.token import LeaseOutcome, TokenLease, token_manager
+
+# 常量定义
+DEFAULT_RECONCILE_INTERVAL = 300  # 与上游速率限制接口对账的间隔（秒）
+
+
+class QuotaLedger:
+    """
+    本地配额账本
+
+    请求完成后按模型计费倍数在本地乐观扣减剩余次数，
+    仅在长时间未对账、剩余次数未知或耗尽、收到 429 时才向上游速率限制接口对账。
+    Token租约以 429 结束时，本地标记为耗尽。
+    """
+
+    def __init__(self):
+        # (sso, 速率限制模型) -> 上次对账时间
+        self._reconciled: Dict[Tuple[str, str], float] = {}
+        token_manager.add_release_listener(self._on_release)
+
+    @staticmethod
+    def _key(sso_value: str, model: str) -> Tuple[str, str]:
+        return sso_value, Models.to_rate_limit(model)
+
+    @staticmethod
+    def _interval() -> float:
+        return float(setting.grok_config.get("quota_reconcile_interval", DEFAULT_RECONCILE_INTERVAL))
+
+    def charge(self, auth_token: str, model: str) -> bool:
+        """记录一次成功调用，返回是否需要与上游对账"""
+        sso_value = token_manager._extract_sso(auth_token)
+        if not sso_value:
+            return False
+
+        cost = Models.get_cost(model)
+        remaining = token_manager.consume_quota(sso_value, model, cost)
+        metrics.inc("quota.charged", cost)
+        if remaining is None:
+            return False
+
+        # 剩余次数未知或已耗尽时立即对账，否则按间隔对账
+        if remaining <= 0:
+            return True
+        last = self._reconciled.get(self._key(sso_value, model))
+        return last is None or time.monotonic() - last >= self._interval()
+
+    def mark_reconciled(self, auth_token: str, model: str) -> None:
+        """记录已与上游完成对账"""
+        if sso_value := token_manager._extract_sso(auth_token):
+            self._reconciled[self._key(sso_value, model)] = time.monotonic()
+
+    def _on_release(self, lease: TokenLease, outcome: LeaseOutcome) -> None:
+        """租约归还：收到 429 时本地标记为耗尽并要求下次对账"""
+        if outcome is not LeaseOutcome.RATE_LIMITED:
+            return
+        sso_value, model = lease.sso_value, lease.model
+        token_manager.mark_exhausted(sso_value, model)
+        self._reconciled.pop(self._key(sso_value, model), None)
+        metrics.inc("quota.rate_limited")
+        logger.debug(f"[Quota] Token {sso_value[:10]}... 收到429，已本地标记为耗尽")
+
+
+# 全局配额账本实例
+quota_ledger = QuotaLedger()
@@ -0,0 +1,151 @@
+"""速率限制刷新调度模块"""
+
+import time
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.models.grok_models import Models
+from app.services.grok.quota import quota_ledger
+from app.services.grok.token import token_manager
+
+# 常量定义
+DEFAULT_MIN_INTERVAL = 10  # 同一 Token+模型 两次刷新的最小间隔（秒）
+DEFAULT_CONCURRENCY = 4  # 后台刷新并发数
+DEFAULT_QUEUE_SIZE = 1000  # 后台刷新队列上限
+
+RefreshKey = Tuple[str, str]
+
+
+class RateLimitRefresher:
+    """
+    速率限制刷新调度器
+
+    - 按 (Token, 速率限制模型) 合并刷新请求，同一键同时只有一个刷新在执行
+    - 同一键在最小间隔内不重复刷新（强制刷新除外）
+    - 后台由固定数量的 worker 消费有界队列，队列满时丢弃并计数
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._pending: Dict[RefreshKey, Tuple[str, str]] = {}  # 已入队待执行
+        self._running: Dict[RefreshKey, asyncio.Future] = {}  # 正在执行
+        self._last: Dict[RefreshKey, float] = {}  # 上次刷新完成时间
+
+    @staticmethod
+    def _key(auth_token: str, model: str) -> Optional[RefreshKey]:
+        sso_value = token_manager._extract_sso(auth_token)
+        return (sso_value, Models.to_rate_limit(model)) if sso_value else None
+
+    @staticmethod
+    def _min_interval() -> float:
+        return float(setting.grok_config.get("rate_limit_min_interval", DEFAULT_MIN_INTERVAL))
+
+    def _ensure_workers(self) -> None:
+        """惰性启动后台 worker（需要运行中的事件循环）"""
+        if self._queue is None:
+            size = int(setting.grok_config.get("rate_limit_queue_size", DEFAULT_QUEUE_SIZE))
+            self._queue = asyncio.Queue(max(1, size))
+        self._workers = [w for w in self._workers if not w.done()]
+        concurrency = max(1, int(setting.grok_config.get("rate_limit_refresh_concurrency", DEFAULT_CONCURRENCY)))
+        while len(self._workers) < concurrency:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    def schedule(self, auth_token: str, model: str, force: bool = False) -> bool:
+        """安排后台刷新（不等待），返回是否已入队
+
+        Args:
+            force: 忽略最小间隔（如收到 429 时），仍与进行中的刷新合并
+        """
+        key = self._key(auth_token, model)
+        if key is None:
+            return False
+
+        if key in self._pending or key in self._running:
+            metrics.inc("rate_limit.coalesced")
+            return False
+        last = self._last.get(key)
+        if not force and last is not None and time.monotonic() - last < self._min_interval():
+            metrics.inc("rate_limit.throttled")
+            return False
+
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait(key)
+        except asyncio.QueueFull:
+            metrics.inc("rate_limit.dropped")
+            logger.warning(f"[RateLimit] 刷新队列已满，丢弃 Token {key[0][:10]}... 的刷新")
+            return False
+        self._pending[key] = (auth_token, model)
+        return True
+
+    async def refresh(self, auth_token: str, model: str) -> Optional[Dict[str, Any]]:
+        """立即刷新并等待结果；同一键已有刷新在执行时等待其结果"""
+        key = self._key(auth_token, model)
+        if key is None:
+            return None
+
+        if running := self._running.get(key):
+            metrics.inc("rate_limit.coalesced")
+            return await asyncio.shield(running)
+
+        future = asyncio.get_running_loop().create_future()
+        self._running[key] = future
+        try:
+            metrics.inc("rate_limit.refreshed")
+            result = await token_manager.check_limits(auth_token, model)
+            if result is not None:
+                quota_ledger.mark_reconciled(auth_token, model)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 避免无人等待时出现未获取异常的警告
+            future.exception()
+            raise
+        finally:
+            self._last[key] = time.monotonic()
+            self._running.pop(key, None)
+
+    async def _worker(self) -> None:
+        """后台消费刷新队列"""
+        while True:
+            key = await self._queue.get()
+            try:
+                auth_token, model = self._pending.pop(key, (None, None))
+                if auth_token:
+                    await self.refresh(auth_token, model)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[RateLimit] 刷新速率限制失败: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        """停止后台 worker"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        self._pending.clear()
+        self._queue = None
+
+    def stats(self) -> Dict[str, Any]:
+        """调度器状态"""
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": len(self._running),
+            "workers": len([w for w in self._workers if not w.done()]),
+            "tracked_keys": len(self._last)
+        }
+
+
+# 全局速率限制刷新调度器实例
+rate_limit_refresher = RateLimitRefresher()
@@ -0,0 +1,159 @@
+"""配额窗口恢复调度模块"""
+
+import time
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.models.grok_models import TokenType
+from app.services.grok.rate_limit import rate_limit_refresher
+from app.services.grok.token import token_manager
+
+# 常量定义
+DEFAULT_RECOVERY_INTERVAL = 1800  # 耗尽 Token 两次探测的最长间隔（秒）
+DEFAULT_RECOVERY_CONCURRENCY = 2  # 后台探测并发数
+STARTUP_PROBE_DELAY = 60  # 启动时已耗尽 Token 的首次探测延迟（秒）
+RETRY_DELAY = 300  # 探测失败后的重试延迟（秒）
+CHECK_INTERVAL = 30  # 到期检查间隔（秒）
+
+# 启动扫描时各字段对应的探测模型
+FIELD_PROBE_MODELS = {
+    "remainingQueries": "grok-3-fast",
+    "heavyremainingQueries": "grok-4-heavy",
+}
+
+RecoveryKey = Tuple[str, str]
+
+
+class QuotaRecovery:
+    """
+    配额窗口恢复调度器
+
+    记录每个 Token 配额耗尽的时间，在上游窗口应当重置后（或最长间隔到期时）
+    于后台以有限并发重新探测速率限制；恢复的 Token 由 update_limits 自动重新进入轮换。
+    """
+
+    def __init__(self):
+        self._due: Dict[RecoveryKey, float] = {}  # (sso, 模型) -> 下次探测时间
+        self._task: Optional[asyncio.Task] = None
+        self._started = False
+
+    @staticmethod
+    def _max_interval() -> float:
+        return float(setting.grok_config.get("quota_recovery_interval", DEFAULT_RECOVERY_INTERVAL))
+
+    def track(self, sso_value: str, model: str, window: Optional[int] = None) -> None:
+        """记录配额耗尽，按上游窗口与最长间隔安排探测"""
+        delay = self._max_interval()
+        if window and window > 0:
+            delay = min(delay, float(window))
+        key = (sso_value, model)
+        if key not in self._due:
+            metrics.inc("recovery.tracked")
+            logger.debug(f"[Recovery] Token {sso_value[:10]}... 在 {model} 上配额耗尽，{delay:.0f}秒后探测")
+        self._due[key] = time.monotonic() + delay
+
+    def start(self) -> None:
+        """注册耗尽监听、扫描已耗尽的 Token 并启动后台任务"""
+        if not self._started:
+            token_manager.add_exhausted_listener(self.track)
+            self._started = True
+
+        # 启动前已耗尽的 Token 窗口未知，延迟后探测
+        due = time.monotonic() + STARTUP_PROBE_DELAY
+        for token_type in (TokenType.NORMAL.value, TokenType.SUPER.value):
+            for sso_value, data in token_manager.token_data.get(token_type, {}).items():
+                if data.get("status") == "expired":
+                    continue
+                for field, model in FIELD_PROBE_MODELS.items():
+                    if data.get(field) == 0:
+                        self._due.setdefault((sso_value, model), due)
+
+        if self._due:
+            logger.info(f"[Recovery] 待恢复的耗尽配额: {len(self._due)} 个")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            try:
+                await self.run_due()
+            except Exception as e:
+                logger.error(f"[Recovery] 配额恢复检查出错: {e}")
+
+    async def run_due(self) -> int:
+        """探测所有到期的 Token，返回恢复数量"""
+        now = time.monotonic()
+        due = [key for key, at in self._due.items() if at <= now]
+        if not due:
+            return 0
+        for key in due:
+            self._due.pop(key, None)
+
+        concurrency = max(1, int(setting.grok_config.get("quota_recovery_concurrency", DEFAULT_RECOVERY_CONCURRENCY)))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def probe(key: RecoveryKey) -> bool:
+            async with semaphore:
+                return await self._probe(*key)
+
+        results = await asyncio.gather(*(probe(key) for key in due), return_exceptions=True)
+        recovered = sum(1 for r in results if r is True)
+        if recovered:
+            logger.info(f"[Recovery] 已恢复 {recovered}/{len(due)} 个耗尽的Token配额")
+        return recovered
+
+    async def _probe(self, sso_value: str, model: str) -> bool:
+        """探测单个 Token；仍耗尽时由耗尽通知重新安排，失败时延迟重试"""
+        _, data = token_manager._find_token(sso_value)
+        if not data or data.get("status") == "expired":
+            return False
+        if data.get(token_manager.remaining_field(model)) != 0:
+            # 已通过对账等途径恢复
+            return False
+
+        metrics.inc("recovery.probed")
+        result = await rate_limit_refresher.refresh(f"sso-rw={sso_value};sso={sso_value}", model)
+        if result is None:
+            self._due[(sso_value, model)] = time.monotonic() + RETRY_DELAY
+            return False
+
+        if (sso_value, model) in self._due:
+            # 仍耗尽，已按窗口重新安排
+            return False
+        metrics.inc("recovery.recovered")
+        logger.info(f"[Recovery] Token {sso_value[:10]}... 在 {model} 上的配额已恢复")
+        return True
+
+    async def close(self) -> None:
+        """停止后台任务"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def next_due_in(self, model: Optional[str] = None) -> Optional[float]:
+        """距下一次恢复探测的秒数（可按模型的剩余次数字段过滤），无待探测时返回 None"""
+        if model is None:
+            times = list(self._due.values())
+        else:
+            field = token_manager.remaining_field(model)
+            times = [at for (_, m), at in self._due.items() if token_manager.remaining_field(m) == field]
+        if not times:
+            return None
+        return max(0.0, min(times) - time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        """恢复调度状态"""
+        next_due = self.next_due_in()
+        return {
+            "tracked": len(self._due),
+            "next_probe_seconds": round(next_due, 1) if next_due is not None else None
+        }
+
+
+# 全局配额恢复调度器实例
+quota_recovery = QuotaRecovery()
@@ -0,0 +1,245 @@
+"""上游会话池模块"""
+
+import time
+import asyncio
+import contextvars
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Any
+
+from curl_cffi.requests import AsyncSession
+
+from app.core.config import setting
+from app.core.logger import logger
+
+# 常量定义
+IMPERSONATE_BROWSER = "chrome133a"
+DEFAULT_MAX_SESSIONS_PER_KEY = 4  # 每个(代理, 指纹)最多保持的会话数
+DEFAULT_MAX_TOTAL_SESSIONS = 32  # 全局最多保持的会话数
+DEFAULT_SESSION_MAX_CLIENTS = 64  # 单个会话内的 curl 句柄数（并发上限）
+DEFAULT_IDLE_TIMEOUT = 300  # 空闲会话回收时间（秒）
+EVICT_INTERVAL = 60  # 回收检查间隔（秒）
+
+PoolKey = Tuple[str, str]
+
+
+class UpstreamTransfer:
+    """
+    单次上游请求占用的 curl 句柄
+
+    curl_cffi 在收到首个响应数据前不暴露传输任务，仅取消 session.post 的等待并不会停止传输；
+    会话取出句柄时登记到这里，需要时从 curl_multi 中移除句柄以真正中止传输。
+    """
+    __slots__ = ("session", "curl")
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.curl = None
+
+    def abort(self) -> bool:
+        """中止仍在进行的传输，句柄已归还时不做任何事"""
+        curl, self.curl = self.curl, None
+        if curl is None:
+            return False
+        self.session.acurl.remove_handle(curl)
+        return True
+
+
+# 发起请求的任务所属的传输（由 SessionPool.post 在独立上下文中设置）
+_current_transfer: contextvars.ContextVar[Optional[UpstreamTransfer]] = contextvars.ContextVar(
+    "upstream_transfer", default=None
+)
+
+
+class TrackedAsyncSession(AsyncSession):
+    """记录每个请求所用 curl 句柄的 AsyncSession"""
+
+    async def pop_curl(self):
+        curl = await super().pop_curl()
+        if (transfer := _current_transfer.get()) is not None:
+            transfer.curl = curl
+        return curl
+
+    def release_curl(self, curl):
+        # 句柄归还后可能被其它请求复用，不能再经由原传输中止
+        if (transfer := _current_transfer.get()) is not None and transfer.curl is curl:
+            transfer.curl = None
+        super().release_curl(curl)
+
+
+@dataclass
+class PooledSession:
+    """池化会话"""
+    key: PoolKey
+    session: AsyncSession
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    active: int = 0
+    total_requests: int = 0
+
+
+class SessionPool:
+    """
+    curl_cffi AsyncSession 会话池
+
+    按 (代理, 浏览器指纹) 分组保持长连接会话，复用 keep-alive 连接与 TLS 会话，
+    避免每个请求都占用一个线程并重新握手。
+    """
+
+    def __init__(self):
+        self._sessions: Dict[PoolKey, List[PooledSession]] = {}
+        self._lock = asyncio.Lock()
+        self._evict_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _limits() -> Tuple[int, int, int, int]:
+        """读取池配置 (每组上限, 全局上限, 单会话并发, 空闲超时)"""
+        cfg = setting.grok_config
+        return (
+            max(1, int(cfg.get("session_pool_per_key", DEFAULT_MAX_SESSIONS_PER_KEY))),
+            max(1, int(cfg.get("session_pool_max_total", DEFAULT_MAX_TOTAL_SESSIONS))),
+            max(1, int(cfg.get("session_max_clients", DEFAULT_SESSION_MAX_CLIENTS))),
+            max(1, int(cfg.get("session_idle_timeout", DEFAULT_IDLE_TIMEOUT))),
+        )
+
+    @staticmethod
+    def _mask(proxy_url: str) -> str:
+        if not proxy_url:
+            return "direct"
+        return proxy_url.split("@")[-1] if "@" in proxy_url else proxy_url
+
+    def _total(self) -> int:
+        return sum(len(items) for items in self._sessions.values())
+
+    async def checkout(self, proxy_url: str = "", impersonate: str = IMPERSONATE_BROWSER) -> PooledSession:
+        """取出一个会话（调用方用完后必须 checkin）"""
+        self._ensure_evictor()
+        key = (proxy_url or "", impersonate)
+        per_key, max_total, max_clients, _ = self._limits()
+
+        async with self._lock:
+            items = self._sessions.setdefault(key, [])
+            pooled = min(items, key=lambda p: p.active) if items else None
+
+            # 所有会话都已满载且未达上限时新建会话
+            if pooled is None or (pooled.active >= max_clients and len(items) < per_key):
+                # 达到全局上限时先回收其它分组的空闲会话；当前分组没有会话时总是新建
+                has_room = self._total() < max_total or await self._evict_one(exclude=key)
+                if pooled is None or has_room:
+                    pooled = PooledSession(key=key, session=TrackedAsyncSession(impersonate=impersonate, max_clients=max_clients))
+                    items.append(pooled)
+                    logger.debug(f"[SessionPool] 新建会话: {self._mask(key[0])}/{impersonate}, 当前 {len(items)} 个")
+
+            pooled.active += 1
+            pooled.total_requests += 1
+            pooled.last_used = time.monotonic()
+            return pooled
+
+    @staticmethod
+    def post(pooled: PooledSession, url: str, **kwargs) -> Tuple[asyncio.Task, UpstreamTransfer]:
+        """在独立任务中发起 POST 请求，返回 (请求任务, 传输句柄)"""
+        transfer = UpstreamTransfer(pooled.session)
+        context = contextvars.copy_context()
+        context.run(_current_transfer.set, transfer)
+        task = asyncio.create_task(pooled.session.post(url, **kwargs), context=context)
+        return task, transfer
+
+    def checkin(self, pooled: PooledSession) -> None:
+        """归还会话"""
+        pooled.active = max(0, pooled.active - 1)
+        pooled.last_used = time.monotonic()
+
+    async def _evict_one(self, exclude: PoolKey) -> bool:
+        """为新分组腾出位置：关闭其它分组中最久未用的空闲会话"""
+        idle = [p for k, items in self._sessions.items() if k != exclude for p in items if p.active == 0]
+        if not idle:
+            return False
+        victim = min(idle, key=lambda p: p.last_used)
+        await self._discard(victim)
+        return True
+
+    async def _discard(self, pooled: PooledSession) -> None:
+        """移除并关闭会话"""
+        items = self._sessions.get(pooled.key, [])
+        if pooled in items:
+            items.remove(pooled)
+        if not items:
+            self._sessions.pop(pooled.key, None)
+        try:
+            await pooled.session.close()
+        except Exception as e:
+            logger.warning(f"[SessionPool] 关闭会话失败: {e}")
+
+    async def evict_idle(self) -> int:
+        """回收空闲超时的会话"""
+        _, _, _, idle_timeout = self._limits()
+        now = time.monotonic()
+        async with self._lock:
+            expired = [
+                p for items in self._sessions.values() for p in items
+                if p.active == 0 and now - p.last_used > idle_timeout
+            ]
+            for pooled in expired:
+                await self._discard(pooled)
+        if expired:
+            logger.debug(f"[SessionPool] 已回收 {len(expired)} 个空闲会话")
+        return len(expired)
+
+    def _ensure_evictor(self) -> None:
+        """惰性启动回收任务（需要运行中的事件循环）"""
+        if self._evict_task is None or self._evict_task.done():
+            self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def _evict_loop(self) -> None:
+        while True:
+            await asyncio.sleep(EVICT_INTERVAL)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.warning(f"[SessionPool] 回收空闲会话出错: {e}")
+
+    async def close(self) -> None:
+        """关闭所有会话"""
+        if self._evict_task:
+            self._evict_task.cancel()
+            self._evict_task = None
+        async with self._lock:
+            for items in list(self._sessions.values()):
+                for pooled in list(items):
+                    await self._discard(pooled)
+        logger.info("[SessionPool] 会话池已关闭")
+
+    def stats(self) -> Dict[str, Any]:
+        """会话池占用情况"""
+        per_key, max_total, max_clients, idle_timeout = self._limits()
+        now = time.monotonic()
+        groups = []
+        for (proxy_url, impersonate), items in self._sessions.items():
+            groups.append({
+                "proxy": self._mask(proxy_url),
+                "impersonate": impersonate,
+                "sessions": [
+                    {
+                        "active": p.active,
+                        "capacity": max_clients,
+                        "total_requests": p.total_requests,
+                        "idle_seconds": round(now - p.last_used, 1) if p.active == 0 else 0,
+                        "age_seconds": round(now - p.created_at, 1),
+                    }
+                    for p in items
+                ],
+            })
+        return {
+            "total_sessions": self._total(),
+            "active_requests": sum(p.active for items in self._sessions.values() for p in items),
+            "limits": {
+                "per_key": per_key,
+                "max_total": max_total,
+                "max_clients": max_clients,
+                "idle_timeout": idle_timeout,
+            },
+            "groups": groups,
+        }
+
+
+# 全局会话池实例
+session_pool = SessionPool()
@@ -0,0 +1,111 @@
+"""SSE 响应块编码模块"""
+
+import time
+import uuid
+import asyncio
+from json.encoder import encode_basestring
+from typing import List, Optional
+
+from app.core.config import setting
+
+# 常量定义
+DEFAULT_STREAM_MODEL = "grok-4-mini-thinking-tahoe"
+SSE_DONE = b"data: [DONE]\n\n"
+DEFAULT_COALESCE_BYTES = 256  # 合并字节窗口
+
+
+class SSEChunkEncoder:
+    """
+    OpenAI 流式响应块编码器
+
+    每个流只构建一次字节模板（固定 chunk id 与创建时间），
+    编码时仅转义 delta 内容并直接填充模板输出 bytes，
+    避免逐 token 构建 pydantic 模型、model_dump、json.dumps 和生成 uuid。
+    """
+
+    __slots__ = ("chunk_id", "created", "model", "_content_tpl", "_empty_tpl")
+
+    def __init__(self, model: Optional[str] = None, chunk_id: Optional[str] = None, created: Optional[int] = None):
+        self.chunk_id = chunk_id or f"chatcmpl-{uuid.uuid4()}"
+        self.created = created or int(time.time())
+        self.model = None
+        self.set_model(model)
+
+    def set_model(self, model: Optional[str]) -> None:
+        """设置模型名称（变化时重建模板）"""
+        model = model or DEFAULT_STREAM_MODEL
+        if model == self.model:
+            return
+        self.model = model
+
+        head = (
+            f'data: {{"id":{encode_basestring(self.chunk_id)},"object":"chat.completion.chunk",'
+            f'"created":{self.created},"model":{encode_basestring(model)},'
+            f'"system_fingerprint":null,"choices":[{{"index":'
+        ).encode("utf-8").replace(b"%", b"%%")
+        self._content_tpl = head + b'%d,"delta":{"role":"assistant","content":%s},"finish_reason":%s}]}\n\n'
+        self._empty_tpl = head + b'%d,"delta":{},"finish_reason":%s}]}\n\n'
+
+    def encode(self, content: str, finish: Optional[str] = None, index: int = 0) -> bytes:
+        """编码单个响应块
+
+        Args:
+            content: delta 内容，为空时输出空 delta
+            finish: 完成原因
+            index: 选项索引
+        """
+        finish_reason = b"null" if finish is None else encode_basestring(finish).encode("utf-8")
+        if content:
+            return self._content_tpl % (index, encode_basestring(content).encode("utf-8"), finish_reason)
+        return self._empty_tpl % (index, finish_reason)
+
+
+class DeltaCoalescer:
+    """
+    流式增量合并器
+
+    暂存连续的小 token，在时间窗口到期或累计字节达到上限时合并为一个 SSE 块发送，
+    减少帧数与 socket 写入次数，延迟上限为时间窗口。
+    """
+
+    def __init__(self, window_ms: float, max_bytes: int = DEFAULT_COALESCE_BYTES):
+        self._loop = asyncio.get_running_loop()
+        self.window = window_ms / 1000
+        self.max_bytes = max_bytes
+        self._parts: List[str] = []
+        self._size = 0
+        self._first_at = 0.0
+
+    @classmethod
+    def from_settings(cls) -> Optional["DeltaCoalescer"]:
+        """按配置创建合并器，未启用时返回 None"""
+        window_ms = float(setting.grok_config.get("stream_coalesce_ms", 0) or 0)
+        if window_ms <= 0:
+            return None
+        max_bytes = int(setting.grok_config.get("stream_coalesce_bytes", DEFAULT_COALESCE_BYTES) or DEFAULT_COALESCE_BYTES)
+        return cls(window_ms, max(1, max_bytes))
+
+    @property
+    def pending(self) -> bool:
+        """是否有暂存内容"""
+        return bool(self._parts)
+
+    def add(self, text: str) -> bool:
+        """暂存增量，返回是否应立即发送（字节或时间窗口已满）"""
+        now = self._loop.time()
+        if not self._parts:
+            self._first_at = now
+        self._parts.append(text)
+        self._size += len(text.encode("utf-8"))
+        return self._size >= self.max_bytes or now - self._first_at >= self.window
+
+    def flush_deadline(self) -> Optional[float]:
+        """暂存内容的发送截止时间（事件循环时间），无暂存时返回 None"""
+        return self._first_at + self.window if self._parts else None
+
+    def take(self) -> str:
+        """取出并清空暂存内容"""
+        text = "".join(self._parts)
+        self._parts.clear()
+        self._size = 0
+        return text
@@ -3,10 +3,11 @@
 import json
 import time
 import asyncio
+import weakref
 import aiofiles
+from enum import Enum
 from pathlib import Path
-from curl_cffi.requests import AsyncSession
-from typing import Dict, Any, Optional, Tuple
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
 
 from app.models.grok_models import TokenType, Models
 from app.core.exception import GrokApiException
@@ -14,6 +15,9 @@ from app.core.logger import logger
 from app.core.config import setting
 from app.services.grok.statsig import get_dynamic_headers
 from app.services.grok.cloudflare import CloudflareClearance
+from app.services.grok.session_pool import session_pool
+from app.services.grok.token_index import TokenIndex, UNUSED
+from app.services.grok.token_policy import TokenSelectPolicy, choose
 
 # 常量定义
 RATE_LIMIT_ENDPOINT = "https://grok.com/rest/rate-limits"
@@ -22,6 +26,55 @@ IMPERSONATE_BROWSER = "chrome133a"
 MAX_FAILURE_COUNT = 3
 TOKEN_INVALID_CODE = 401  # SSO Token失效
 STATSIG_INVALID_CODE = 403  # x-statsig-id失效
+REMAINING_FIELDS = ("remainingQueries", "heavyremainingQueries")
+DEFAULT_SAVE_INTERVAL_MS = 500  # 写回合并间隔（毫秒）
+DEFAULT_MAX_CONCURRENCY = 8  # 单个Token最大并发请求数，0 表示不限制
+DEFAULT_RATE_LIMIT_COOLDOWN = 60  # 收到 429 后Token冷却时间（秒）
+
+
+class LeaseOutcome(Enum):
+    """Token租约的结束结果"""
+    SUCCESS = "success"            # 上游成功响应，清除失败计数
+    FAILED = "failed"              # 上游返回错误状态码，计入失败次数
+    RATE_LIMITED = "rate_limited"  # 上游返回 429，计入失败次数并冷却、标记配额耗尽
+    CANCELLED = "cancelled"        # 请求取消、网络错误等与Token状态无关的结束
+
+
+class TokenLease:
+    """
+    Token租约
+
+    由 acquire 获取，占用Token的一个并发名额，请求结束时必须调用 release 归还（重复归还无效）；
+    未归还即被回收时（如流式响应始终未被读取）自动归还名额。
+    """
+    __slots__ = ("sso_value", "model", "acquired_at", "released", "_finalizer", "__weakref__")
+
+    def __init__(self, sso_value: str, model: str, on_leak: Callable[[str], None]):
+        self.sso_value = sso_value
+        self.model = model
+        self.acquired_at = time.monotonic()
+        self.released = False
+        self._finalizer = weakref.finalize(self, on_leak, sso_value)
+
+    def close(self) -> bool:
+        """标记为已归还，返回是否为首次归还"""
+        if self.released:
+            return False
+        self.released = True
+        self._finalizer.detach()
+        return True
+
+    @property
+    def auth_token(self) -> str:
+        """请求上游使用的认证令牌"""
+        return f"sso-rw={self.sso_value};sso={self.sso_value}"
+
+
+def _apply_delta(value: Any, amount: int) -> Any:
+    """计数字段增量：非数值或负值（未知）保持不变，结果不小于 0（与共享存储中的原子累加一致）"""
+    if not isinstance(value, int) or value < 0:
+        return value
+    return max(0, value + amount)
 
 
 class GrokTokenManager:
@@ -54,6 +107,36 @@ class GrokTokenManager:
         self.token_file.parent.mkdir(parents=True, exist_ok=True)
         self._storage = None
 
+        # 进行中请求数：sso -> 数量；达到并发上限的Token不进入选择索引
+        self._inflight: Dict[str, int] = {}
+        self._saturated: Set[str] = set()
+
+        # 延迟批量写回：待持久化的变更（sso -> 变更字段，None 表示整个Token）、计数增量与写回任务
+        self._dirty: Dict[str, Optional[Set[str]]] = {}
+        self._deltas: Dict[str, Dict[str, int]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        # 429 冷却：sso -> 冷却结束时间（冷却期间不进入选择索引）
+        self._cooldown_until: Dict[str, float] = {}
+
+        # 配额耗尽监听器：(sso, 模型, 上游窗口秒数)
+        self._exhausted_listeners: List[Callable[[str, str, Optional[int]], None]] = []
+
+        # Token重新可选监听器：(Token类型, sso)
+        self._available_listeners: List[Callable[[str, str], None]] = []
+
+        # 租约归还监听器：(租约, 结果)
+        self._release_listeners: List[Callable[[TokenLease, LeaseOutcome], None]] = []
+        self._acquire_listeners: List[Callable[[TokenLease], None]] = []
+
+        # 选择索引：(Token类型, 剩余次数字段) -> TokenIndex
+        self._indexes: Dict[Tuple[str, str], TokenIndex] = {
+            (token_type.value, field): TokenIndex(field, self._inflight)
+            for token_type in (TokenType.NORMAL, TokenType.SUPER)
+            for field in REMAINING_FIELDS
+        }
+
         # 同步加载初始数据
         self._load_data()
         self._initialized = True
@@ -64,6 +147,19 @@ class GrokTokenManager:
         """设置存储实例"""
         self._storage = storage
 
+    def _shared_storage(self) -> bool:
+        """存储是否为多实例共享的逐Token存储（按字段写回、计数原子累加）"""
+        return hasattr(self._storage, "apply_token_changes")
+
+    async def start(self) -> None:
+        """使用共享存储或可查询的数据库存储时，从存储加载Token数据并预热选择索引；存储支持变更通知时订阅其他实例的变更"""
+        if self._shared_storage() or hasattr(self._storage, "query_tokens"):
+            self.token_data = await self._storage.load_tokens()
+            self._reindex()
+            logger.info(f"[Token] 已从存储加载 {sum(len(t) for t in self.token_data.values())} 个Token")
+        if hasattr(self._storage, "subscribe_tokens"):
+            await self._storage.subscribe_tokens(self._on_remote_changes)
+
     def _load_data(self) -> None:
         """同步加载Token数据（仅用于初始化）"""
         default_data = {
@@ -82,17 +178,53 @@ class GrokTokenManager:
             logger.error(f"[Token] 加载Token数据失败: {str(e)}")
             self.token_data = default_data
 
+        self._reindex()
+
+    def _reindex(self) -> None:
+        """根据当前Token数据重建全部选择索引"""
+        for (token_type, _), index in self._indexes.items():
+            index.clear()
+            for token, data in self.token_data.get(token_type, {}).items():
+                if self._selectable(token):
+                    index.update(token, data)
+
+    def _index_token(self, token_type: str, token: str) -> None:
+        """Token数据变化后更新其索引（Token已删除、冷却中或并发已满时移除）"""
+        data = self.token_data.get(token_type, {}).get(token)
+        if data is not None and not self._selectable(token):
+            data = None
+        became_available = False
+        for field in REMAINING_FIELDS:
+            index = self._indexes[(token_type, field)]
+            if data is None:
+                index.remove(token)
+            else:
+                was_indexed = token in index
+                index.update(token, data)
+                became_available |= not was_indexed and token in index
+        if became_available:
+            self._notify_available(token_type, token)
+
+    def _snapshot(self) -> Dict[str, Any]:
+        """复制当前Token数据，供后台序列化时不受并发修改影响"""
+        return {
+            token_type: {token: dict(data) for token, data in tokens.items()}
+            for token_type, tokens in self.token_data.items()
+        }
+
     async def _save_data(self) -> None:
-        """异步保存Token数据到存储"""
+        """异步保存Token数据到存储（整体写入，序列化在线程中进行）"""
+        snapshot = self._snapshot()
         try:
             if not self._storage:
                 # 如果没有设置存储，使用传统文件保存方式（向后兼容）
+                content = await asyncio.to_thread(json.dumps, snapshot, indent=2, ensure_ascii=False)
                 async with self._file_lock:
                     async with aiofiles.open(self.token_file, "w", encoding="utf-8") as f:
-                        await f.write(json.dumps(self.token_data, indent=2, ensure_ascii=False))
+                        await f.write(content)
             else:
                 # 使用存储抽象层
-                await self._storage.save_tokens(self.token_data)
+                await self._storage.save_tokens(snapshot)
         except IOError as e:
             logger.error(f"[Token] 保存Token数据失败: {str(e)}")
             raise GrokApiException(
@@ -101,6 +233,156 @@ class GrokTokenManager:
                 {"file_path": str(self.token_file)}
             )
 
+    def _mark_dirty(self, sso_value: str, *fields: str) -> None:
+        """记录待持久化的Token变更（指定字段，未指定时为整个Token），并安排延迟批量写回（不等待 I/O）"""
+        self._merge_dirty(sso_value, set(fields) or None)
+        self._schedule_flush()
+
+    def _mark_delta(self, sso_value: str, field: str, amount: int) -> None:
+        """记录计数字段的增量（共享存储中原子累加，避免多实例互相覆盖）"""
+        fields = self._dirty.get(sso_value, ())
+        if fields is None or field in fields:
+            # 该字段将按当前值整体写回
+            return
+        deltas = self._deltas.setdefault(sso_value, {})
+        deltas[field] = deltas.get(field, 0) + amount
+        self._schedule_flush()
+
+    def _merge_dirty(self, sso_value: str, fields: Optional[Set[str]]) -> None:
+        """合并待写回的变更字段；整体写回或按值写回的字段不再需要增量"""
+        if fields is None:
+            self._dirty[sso_value] = None
+            self._deltas.pop(sso_value, None)
+            return
+        pending = self._dirty.setdefault(sso_value, set())
+        if pending is None:
+            return
+        pending |= fields
+        deltas = self._deltas.get(sso_value)
+        if deltas:
+            for field in fields:
+                deltas.pop(field, None)
+            if not deltas:
+                del self._deltas[sso_value]
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    @staticmethod
+    def _save_interval() -> float:
+        """写回合并间隔（秒）"""
+        interval = setting.grok_config.get("token_save_interval_ms", DEFAULT_SAVE_INTERVAL_MS)
+        return max(0, float(interval or 0)) / 1000
+
+    async def _flush_later(self) -> None:
+        """后台写回：等待合并间隔后写入，期间新增的变更在下一轮写入"""
+        while self._dirty or self._deltas:
+            await asyncio.sleep(self._save_interval())
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"[Token] 后台写回Token数据失败，稍后重试: {e}")
+
+    async def flush(self) -> None:
+        """立即写入所有待持久化的变更"""
+        async with self._flush_lock:
+            if not self._dirty and not self._deltas:
+                return
+            dirty, self._dirty = self._dirty, {}
+            deltas, self._deltas = self._deltas, {}
+            try:
+                if self._shared_storage():
+                    await self._apply_changes(dirty, deltas)
+                elif hasattr(self._storage, "save_token_rows"):
+                    await self._save_rows(dirty.keys() | deltas.keys())
+                else:
+                    await self._save_data()
+            except Exception:
+                # 写入失败时保留变更，等待下次写回
+                for sso_value, fields in dirty.items():
+                    self._merge_dirty(sso_value, fields)
+                for sso_value, changes in deltas.items():
+                    for field, amount in changes.items():
+                        self._mark_delta(sso_value, field, amount)
+                raise
+            logger.debug(f"[Token] 已写回 {len(dirty.keys() | deltas.keys())} 个Token的变更")
+
+    async def _save_rows(self, tokens: Set[str]) -> None:
+        """只写回变更的Token（逐行存储），已删除的Token删除对应行"""
+        upserts, deletes = {}, []
+        for sso_value in tokens:
+            token_type, data = self._find_token(sso_value)
+            if data is None:
+                deletes.append(sso_value)
+            else:
+                upserts[sso_value] = (token_type, dict(data))
+        await self._storage.save_token_rows(upserts, deletes)
+
+    async def _apply_changes(self, dirty: Dict[str, Optional[Set[str]]], deltas: Dict[str, Dict[str, int]]) -> None:
+        """按Token写回变更到共享存储，并以存储返回的最新数据更新本地"""
+        changes = []
+        for sso_value in dirty.keys() | deltas.keys():
+            token_type, data = self._find_token(sso_value)
+            if data is None:
+                if sso_value in dirty:
+                    changes.append({"sso": sso_value, "delete": True})
+                continue
+            fields = dirty.get(sso_value, set())
+            changes.append({
+                "sso": sso_value,
+                "type": token_type,
+                "replace": fields is None,
+                "fields": dict(data) if fields is None else {field: data.get(field) for field in fields},
+                "deltas": deltas.get(sso_value, {})
+            })
+        self._on_remote_changes(await self._storage.apply_token_changes(changes))
+
+    def _on_remote_changes(self, entries: Dict[str, Optional[Tuple[str, Dict[str, Any]]]]) -> None:
+        """以共享存储中的最新数据覆盖本地Token（保留尚未写回的本地变更）
+
+        Args:
+            entries: sso -> (Token类型, 数据)，Token已删除时为 None
+        """
+        for sso_value, entry in entries.items():
+            pending = self._dirty.get(sso_value, set())
+            if pending is None:
+                # 本地整体变更（新增、删除）尚未写回，以本地为准
+                continue
+            token_type, data = self._find_token(sso_value)
+            if entry is None:
+                if token_type:
+                    del self.token_data[token_type][sso_value]
+                    self._index_token(token_type, sso_value)
+                continue
+
+            remote_type, remote = entry
+            if data is not None:
+                for field in pending:
+                    remote[field] = data.get(field)
+            for field, amount in self._deltas.get(sso_value, {}).items():
+                remote[field] = _apply_delta(remote.get(field), amount)
+            if token_type and token_type != remote_type:
+                del self.token_data[token_type][sso_value]
+                self._index_token(token_type, sso_value)
+            self.token_data.setdefault(remote_type, {})[sso_value] = remote
+            if sso_value in self._saturated and self._inflight.get(sso_value, 0) < self._max_concurrency():
+                # 因其他进程占满而暂停的Token：其他进程有变更时重新参与选择（再次占用失败时重新暂停）
+                self._saturated.discard(sso_value)
+            self._index_token(remote_type, sso_value)
+
+    async def shutdown(self) -> None:
+        """停止后台写回并写入剩余变更"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        self._flush_task = None
+        try:
+            await self.flush()
+            logger.info("[Token] Token数据已写回")
+        except Exception as e:
+            logger.error(f"[Token] 关闭时写回Token数据失败: {e}")
+
     @staticmethod
     def _extract_sso(auth_token: str) -> Optional[str]:
         """从认证令牌中提取SSO值"""
@@ -137,9 +419,11 @@ class GrokTokenManager:
                 "lastFailureTime": None,
                 "lastFailureReason": None
             }
+            self._index_token(token_type.value, token)
+            self._mark_dirty(token)
             added_count += 1
 
-        await self._save_data()
+        await self.flush()
         logger.info(f"[Token] 成功添加 {added_count} 个 {token_type.value} Token")
 
     async def delete_token(self, tokens: list[str], token_type: TokenType) -> None:
@@ -152,80 +436,194 @@ class GrokTokenManager:
         for token in tokens:
             if token in self.token_data[token_type.value]:
                 del self.token_data[token_type.value][token]
+                self._index_token(token_type.value, token)
+                self._mark_dirty(token)
                 deleted_count += 1
             else:
                 logger.debug(f"[Token] Token不存在: {token[:10]}...")
 
-        await self._save_data()
+        await self.flush()
         logger.info(f"[Token] 成功删除 {deleted_count} 个 {token_type.value} Token")
     
     def get_tokens(self) -> Dict[str, Any]:
         """获取所有Token数据"""
         return self.token_data.copy()
 
-    def get_token(self, model: str) -> str:
-        """获取指定模型的Token"""
-        jwt_token = self.select_token(model)
-        return f"sso-rw={jwt_token};sso={jwt_token}"
-    
-    def select_token(self, model: str) -> str:
-        """根据模型类型和剩余次数选择最优Token"""
-        def select_best_token(tokens_dict: Dict[str, Any]) -> Tuple[Optional[str], Optional[int]]:
-            """从 token 字典中选择最佳 token"""
-            unused_tokens = []  # remaining = -1 的 token
-            used_tokens = []    # remaining > 0 的 token
-
-            for token_key, token_data in tokens_dict.items():
-                # 跳过已失效的Token
-                if token_data.get("status") == "expired":
-                    continue
-
-                remaining = int(token_data.get(remaining_field, -1))
-
-                # 跳过已限流的 token
-                if remaining == 0:
-                    continue
-
-                # 分类存储
-                if remaining == -1:
-                    unused_tokens.append(token_key)
-                elif remaining > 0:
-                    used_tokens.append((token_key, remaining))
-
-            # 优先返回尚未使用的 token
-            if unused_tokens:
-                return unused_tokens[0], -1
-
-            # 否则返回次数最多的 token
-            if used_tokens:
-                used_tokens.sort(key=lambda x: x[1], reverse=True)
-                return used_tokens[0][0], used_tokens[0][1]
-
-            return None, None
-
-        max_token_key = None
-        max_remaining = None
-
-        # 深拷贝
-        token_data_snapshot = {
-            TokenType.NORMAL.value: self.token_data[TokenType.NORMAL.value].copy(),
-            TokenType.SUPER.value: self.token_data[TokenType.SUPER.value].copy()
-        }
+    async def query_tokens(self) -> Dict[str, Any]:
+        """获取所有Token数据：存储支持查询时写回待持久化的变更后从存储查询，否则同 get_tokens"""
+        if not hasattr(self._storage, "query_tokens"):
+            return self.get_tokens()
+        await self.flush()
+        return await self._storage.query_tokens()
+
+    async def token_stats(self) -> Optional[Dict[str, Dict[str, int]]]:
+        """由存储按索引统计各类型Token数量，存储不支持时返回 None"""
+        if not hasattr(self._storage, "token_stats"):
+            return None
+        await self.flush()
+        return await self._storage.token_stats()
+
+    def acquire(self, model: str, exclude: Optional[Set[str]] = None) -> TokenLease:
+        """获取指定模型的Token租约（占用一个并发名额，用完后需调用 release 归还）
+
+        Args:
+            exclude: 本次请求中已失败、应优先避开的 sso 集合
+        """
+        while True:
+            sso_value = self.select_token(model, exclude)
+            if self._claim(sso_value):
+                break
+            # 其他进程已占满该Token的并发名额，暂停分配后重新选择（直至其他进程归还）
+            self._saturated.add(sso_value)
+            self._index_token(self._find_token(sso_value)[0], sso_value)
+        self._set_inflight(sso_value, self._inflight.get(sso_value, 0) + 1)
+        lease = TokenLease(sso_value, model, self._reclaim)
+        for listener in self._acquire_listeners:
+            try:
+                listener(lease)
+            except Exception as e:
+                logger.warning(f"[Token] 租约获取通知失败: {e}")
+        return lease
+
+    def release(self, lease: TokenLease, outcome: LeaseOutcome = LeaseOutcome.CANCELLED,
+                status_code: Optional[int] = None, reason: str = "") -> None:
+        """归还Token租约，并按结果更新Token状态（重复归还无效）
+
+        Args:
+            lease: acquire 返回的租约
+            outcome: 请求结果
+            status_code: 上游错误状态码（FAILED / RATE_LIMITED 时）
+            reason: 失败原因
+        """
+        if not lease.close():
+            return
+        sso_value = lease.sso_value
+        self._decrement_inflight(sso_value)
+
+        if outcome is LeaseOutcome.SUCCESS:
+            self._clear_failures(sso_value)
+        elif outcome is LeaseOutcome.FAILED:
+            self._count_failure(sso_value, status_code, reason)
+        elif outcome is LeaseOutcome.RATE_LIMITED:
+            self._count_failure(sso_value, status_code or 429, reason)
+            cooldown = float(setting.grok_config.get("rate_limit_cooldown", DEFAULT_RATE_LIMIT_COOLDOWN))
+            self.cool_down(sso_value, cooldown)
+
+        for listener in self._release_listeners:
+            try:
+                listener(lease, outcome)
+            except Exception as e:
+                logger.warning(f"[Token] 租约归还通知失败: {e}")
+
+    def _claim(self, sso_value: str) -> bool:
+        """在多进程共享的存储中占用并发名额（存储不支持时总是成功）"""
+        claim = getattr(self._storage, "claim_token", None)
+        return claim is None or claim(sso_value, self._max_concurrency())
+
+    def _decrement_inflight(self, sso_value: str) -> None:
+        if self._inflight.get(sso_value, 0) > 0:
+            self._set_inflight(sso_value, self._inflight[sso_value] - 1)
+            release_claim = getattr(self._storage, "release_token_claim", None)
+            if release_claim:
+                release_claim(sso_value, self._max_concurrency())
+
+    def _reclaim(self, sso_value: str) -> None:
+        """未归还的租约被回收，归还其并发名额"""
+        logger.warning(f"[Token] Token {sso_value[:10]}... 的租约未归还即被回收，已自动归还")
+        self._decrement_inflight(sso_value)
+
+    def add_release_listener(self, listener: Callable[[TokenLease, LeaseOutcome], None]) -> None:
+        """注册租约归还监听器（配额记账等）"""
+        self._release_listeners.append(listener)
+
+    def add_acquire_listener(self, listener: Callable[[TokenLease], None]) -> None:
+        """注册租约获取监听器（熔断半开探测等），在 acquire 返回前同步执行"""
+        self._acquire_listeners.append(listener)
+
+    def get_inflight(self, sso_value: str) -> int:
+        """获取Token的进行中请求数"""
+        return self._inflight.get(sso_value, 0)
+
+    @staticmethod
+    def _max_concurrency() -> int:
+        """单个Token最大并发请求数，0 表示不限制"""
+        return int(setting.grok_config.get("token_max_concurrency", DEFAULT_MAX_CONCURRENCY) or 0)
+
+    def _selectable(self, sso_value: str) -> bool:
+        """Token是否可进入选择索引（未冷却且并发未满）"""
+        return sso_value not in self._saturated and not self._is_cooling(sso_value)
+
+    def _set_inflight(self, sso_value: str, count: int) -> None:
+        """更新进行中请求数并同步到选择索引；达到并发上限时移出索引，低于上限时恢复"""
+        if count > 0:
+            self._inflight[sso_value] = count
+        else:
+            self._inflight.pop(sso_value, None)
+        token_type, _ = self._find_token(sso_value)
+        if not token_type:
+            self._saturated.discard(sso_value)
+            return
+        for field in REMAINING_FIELDS:
+            self._indexes[(token_type, field)].set_load(sso_value, count)
+
+        limit = self._max_concurrency()
+        saturated = 0 < limit <= count
+        if saturated != (sso_value in self._saturated):
+            if saturated:
+                self._saturated.add(sso_value)
+                logger.debug(f"[Token] Token {sso_value[:10]}... 并发已满 ({count}/{limit})，暂停分配")
+            else:
+                self._saturated.discard(sso_value)
+            self._index_token(token_type, sso_value)
+
+    def has_saturated(self, model: str) -> bool:
+        """是否有因并发已满而暂停分配、且仍可用于该模型的Token（归还租约后即可选）"""
+        field = self.remaining_field(model)
+        for sso_value in self._saturated:
+            token_type, data = self._find_token(sso_value)
+            if not data or (model == "grok-4-heavy" and token_type != TokenType.SUPER.value):
+                continue
+            if data.get("status") != "expired" and data.get(field, -1) != 0 and not self._is_cooling(sso_value):
+                return True
+        return False
+
+    def select_token(self, model: str, exclude: Optional[Set[str]] = None) -> str:
+        """根据模型类型和选择策略选择Token（基于增量索引，不随Token数量增长）
+
+        Args:
+            exclude: 应优先避开的 sso 集合；避开后无可选Token时回退为不排除
+        """
+        if exclude:
+            # 临时移出索引后选择（排除集合很小，开销为 O(k log n)）
+            hidden = []
+            for token in exclude:
+                token_type, _ = self._find_token(token)
+                if token_type:
+                    hidden.append((token_type, token))
+                    for field in REMAINING_FIELDS:
+                        self._indexes[(token_type, field)].remove(token)
+            try:
+                return self.select_token(model)
+            except GrokApiException as e:
+                if e.error_code != "NO_AVAILABLE_TOKEN":
+                    raise
+                logger.debug(f"[Token] 排除已失败的Token后模型 {model} 无可用Token，回退为不排除")
+            finally:
+                for token_type, token in hidden:
+                    self._reindex_quietly(token_type, token)
+
+        policy = TokenSelectPolicy.parse(setting.grok_config.get("token_select_policy", TokenSelectPolicy.BEST.value))
 
         if model == "grok-4-heavy":
             # grok-4-heavy 只能使用Super Token + heavy remaining queries
-            remaining_field = "heavyremainingQueries"
-            max_token_key, max_remaining = select_best_token(token_data_snapshot[TokenType.SUPER.value])
+            max_token_key, max_remaining = choose(self._indexes[(TokenType.SUPER.value, "heavyremainingQueries")], policy)
         else:
-            # 其他模型使用 remaining Queries
-            remaining_field = "remainingQueries"
-
-            # 优先使用普通Token
-            max_token_key, max_remaining = select_best_token(token_data_snapshot[TokenType.NORMAL.value])
+            # 其他模型使用 remaining Queries，优先使用普通Token
+            max_token_key, max_remaining = choose(self._indexes[(TokenType.NORMAL.value, "remainingQueries")], policy)
 
             # 如果普通Token没有可用的，尝试使用Super Token
             if max_token_key is None:
-                max_token_key, max_remaining = select_best_token(token_data_snapshot[TokenType.SUPER.value])
+                max_token_key, max_remaining = choose(self._indexes[(TokenType.SUPER.value, "remainingQueries")], policy)
 
         if max_token_key is None:
             raise GrokApiException(
@@ -233,13 +631,13 @@ class GrokTokenManager:
                 "NO_AVAILABLE_TOKEN",
                 {
                     "model": model,
-                    "normal_count": len(token_data_snapshot[TokenType.NORMAL.value]),
-                    "super_count": len(token_data_snapshot[TokenType.SUPER.value])
+                    "normal_count": len(self.token_data[TokenType.NORMAL.value]),
+                    "super_count": len(self.token_data[TokenType.SUPER.value])
                 }
             )
 
-        status_text = "未使用" if max_remaining == -1 else f"剩余{max_remaining}次"
-        logger.debug(f"[Token] 为模型 {model} 选择Token ({status_text})")
+        status_text = "未使用" if max_remaining == UNUSED else f"剩余{max_remaining}次"
+        logger.debug(f"[Token] 为模型 {model} 选择Token ({policy.value}, {status_text})")
         return max_token_key
     
     async def check_limits(self, auth_token: str, model: str) -> Optional[Dict[str, Any]]:
@@ -260,8 +658,9 @@ class GrokTokenManager:
             headers = get_dynamic_headers("/rest/rate-limits")
             headers["Cookie"] = cookie
 
-            # 获取代理配置
-            proxy_url = setting.grok_config.get("proxy_url", "")
+            # 获取代理配置（多个代理时跳过已熔断的；circuit 模块依赖本模块，在此处导入）
+            from app.services.grok.circuit import circuit_breakers
+            proxy_url = circuit_breakers.choose_proxy(setting.get_service_proxies())
             proxies = {"http": proxy_url, "https": proxy_url} if proxy_url else {}
             
             if proxy_url:
@@ -269,40 +668,164 @@ class GrokTokenManager:
             else:
                 logger.debug("[Token] 未配置代理，已禁用环境代理变量")
 
-            # 发送异步请求
-            async with AsyncSession() as session:
-                response = await session.post(
+            # 使用会话池中的共享会话发送异步请求
+            pooled = await session_pool.checkout(proxy_url, IMPERSONATE_BROWSER)
+            try:
+                response = await pooled.session.post(
                     RATE_LIMIT_ENDPOINT,
                     headers=headers,
                     json=payload,
                     impersonate=IMPERSONATE_BROWSER,
                     timeout=REQUEST_TIMEOUT,
-                    proxies=proxies
+                    proxies=proxies,
+                    discard_cookies=True
                 )
-
-                if response.status_code == 200:
-                    rate_limit_data = response.json()
-                    logger.debug(f"[Token] 成功获取速率限制信息")
-
-                    # 保存速率限制信息
-                    sso_value = self._extract_sso(auth_token)
-                    if sso_value:
-                        if model == "grok-4-heavy":
-                            await self.update_limits(sso_value, normal=None, heavy=rate_limit_data.get("remainingQueries", -1))
-                            logger.info(f"[Token] 已更新限制: sso={sso_value[:10]}..., heavy={rate_limit_data.get('remainingQueries', -1)}")
-                        else:
-                            await self.update_limits(sso_value, normal=rate_limit_data.get("remainingTokens", -1), heavy=None)
-                            logger.info(f"[Token] 已更新限制: sso={sso_value[:10]}..., 通用={rate_limit_data.get('remainingTokens', -1)}")
-
-                    return rate_limit_data
-                else:
-                    logger.warning(f"[Token] 获取速率限制失败，状态码: {response.status_code}")
-                    return None
+            finally:
+                session_pool.checkin(pooled)
+
+            if response.status_code == 200:
+                rate_limit_data = response.json()
+                logger.debug(f"[Token] 成功获取速率限制信息")
+
+                # 保存速率限制信息
+                sso_value = self._extract_sso(auth_token)
+                if sso_value:
+                    if model == "grok-4-heavy":
+                        remaining = rate_limit_data.get("remainingQueries", -1)
+                        await self.update_limits(sso_value, normal=None, heavy=remaining)
+                        logger.info(f"[Token] 已更新限制: sso={sso_value[:10]}..., heavy={remaining}")
+                    else:
+                        remaining = rate_limit_data.get("remainingTokens", -1)
+                        await self.update_limits(sso_value, normal=remaining, heavy=None)
+                        logger.info(f"[Token] 已更新限制: sso={sso_value[:10]}..., 通用={remaining}")
+
+                    if remaining == 0:
+                        self._notify_exhausted(sso_value, model, rate_limit_data.get("windowSizeSeconds"))
+
+                return rate_limit_data
+            else:
+                logger.warning(f"[Token] 获取速率限制失败，状态码: {response.status_code}")
+                return None
 
         except Exception as e:
             logger.error(f"[Token] 检查速率限制时发生错误: {str(e)}")
             return None
 
+    @staticmethod
+    def remaining_field(model: str) -> str:
+        """模型对应的剩余次数字段"""
+        return "heavyremainingQueries" if model == "grok-4-heavy" else "remainingQueries"
+
+    def consume_quota(self, sso_value: str, model: str, cost: int) -> Optional[int]:
+        """本地扣减剩余次数（不等待持久化）
+
+        Returns:
+            扣减后的剩余次数；剩余次数未知时返回 -1；Token不存在时返回 None
+        """
+        token_type, token_data = self._find_token(sso_value)
+        if not token_data:
+            return None
+
+        field = self.remaining_field(model)
+        try:
+            remaining = int(token_data.get(field, -1))
+        except (TypeError, ValueError):
+            return -1
+        if remaining < 0:
+            return -1
+
+        remaining = max(0, remaining - cost)
+        token_data[field] = remaining
+        self._index_token(token_type, sso_value)
+        self._mark_delta(sso_value, field, -cost)
+        if remaining == 0:
+            self._notify_exhausted(sso_value, model)
+        return remaining
+
+    def mark_exhausted(self, sso_value: str, model: str) -> None:
+        """将Token在该模型上的剩余次数标记为 0（移出轮换，等待对账或恢复）"""
+        token_type, token_data = self._find_token(sso_value)
+        if not token_data:
+            return
+        field = self.remaining_field(model)
+        token_data[field] = 0
+        self._index_token(token_type, sso_value)
+        self._mark_dirty(sso_value, field)
+        self._notify_exhausted(sso_value, model)
+
+    def _is_cooling(self, sso_value: str) -> bool:
+        until = self._cooldown_until.get(sso_value)
+        return until is not None and until > time.monotonic()
+
+    def cool_down(self, sso_value: str, seconds: float) -> None:
+        """将Token移出轮换一段时间（如收到 429 后），到期自动恢复"""
+        token_type, _ = self._find_token(sso_value)
+        if not token_type or seconds <= 0:
+            return
+        self._cooldown_until[sso_value] = time.monotonic() + seconds
+        self._index_token(token_type, sso_value)
+        logger.debug(f"[Token] Token {sso_value[:10]}... 冷却 {seconds:.0f} 秒")
+        try:
+            asyncio.get_running_loop().call_later(seconds, self._end_cooldown, sso_value)
+        except RuntimeError:
+            pass
+
+    def next_cooldown_end_in(self) -> Optional[float]:
+        """距最近一个Token冷却结束的秒数，无冷却中的Token时返回 None"""
+        now = time.monotonic()
+        ends = [until - now for until in self._cooldown_until.values() if until > now]
+        return min(ends) if ends else None
+
+    def end_cool_down(self, sso_value: str) -> None:
+        """提前结束Token冷却（如熔断半开探测成功），重新进入选择索引"""
+        if self._cooldown_until.pop(sso_value, None) is None:
+            return
+        token_type, _ = self._find_token(sso_value)
+        if token_type:
+            self._index_token(token_type, sso_value)
+
+    def _end_cooldown(self, sso_value: str) -> None:
+        """冷却到期，重新进入选择索引"""
+        if self._is_cooling(sso_value):
+            # 冷却期间再次被延长，由后一次定时器处理
+            return
+        self._cooldown_until.pop(sso_value, None)
+        token_type, _ = self._find_token(sso_value)
+        if token_type:
+            self._index_token(token_type, sso_value)
+
+    def _reindex_quietly(self, token_type: str, token: str) -> None:
+        """恢复临时移出的Token索引（不触发可用通知）"""
+        data = self.token_data.get(token_type, {}).get(token)
+        if data is None or not self._selectable(token):
+            return
+        for field in REMAINING_FIELDS:
+            self._indexes[(token_type, field)].update(token, data)
+
+    def add_exhausted_listener(self, listener: Callable[[str, str, Optional[int]], None]) -> None:
+        """注册配额耗尽监听器"""
+        self._exhausted_listeners.append(listener)
+
+    def _notify_exhausted(self, sso_value: str, model: str, window: Optional[int] = None) -> None:
+        """通知Token在该模型上的配额已耗尽"""
+        for listener in self._exhausted_listeners:
+            try:
+                listener(sso_value, model, window)
+            except Exception as e:
+                logger.warning(f"[Token] 配额耗尽通知失败: {e}")
+
+    def add_available_listener(self, listener: Callable[[str, str], None]) -> None:
+        """注册Token重新可选监听器（新增、配额恢复等）"""
+        self._available_listeners.append(listener)
+
+    def _notify_available(self, token_type: str, sso_value: str) -> None:
+        """通知Token已重新进入选择索引"""
+        for listener in self._available_listeners:
+            try:
+                listener(token_type, sso_value)
+            except Exception as e:
+                logger.warning(f"[Token] Token可用通知失败: {e}")
+
     async def update_limits(self, sso_value: str, normal: Optional[int] = None, heavy: Optional[int] = None) -> None:
         """更新Token限制信息"""
         try:
@@ -310,10 +833,11 @@ class GrokTokenManager:
                 if sso_value in self.token_data[token_type]:
                     if normal is not None:
                         self.token_data[token_type][sso_value]["remainingQueries"] = normal
+                        self._mark_dirty(sso_value, "remainingQueries")
                     if heavy is not None:
                         self.token_data[token_type][sso_value]["heavyremainingQueries"] = heavy
-
-                    await self._save_data()
+                        self._mark_dirty(sso_value, "heavyremainingQueries")
+                    self._index_token(token_type, sso_value)
                     logger.info(f"[Token] 已更新Token {sso_value[:10]}... 的限制信息")
                     return
 
@@ -322,17 +846,12 @@ class GrokTokenManager:
         except Exception as e:
             logger.error(f"[Token] 更新Token限制时发生错误: {str(e)}")
     
-    async def record_failure(self, auth_token: str, status_code: int, error_message: str) -> None:
+    def _count_failure(self, sso_value: str, status_code: Optional[int], error_message: str) -> None:
         """记录Token失败信息
 
         错误码说明：
-        - 401: SSO Token失效，会标记Token为expired
+        - 401: SSO Token失效，连续失败达到上限时标记Token为expired
         - 403: 服务器IP被Block，不影响Token状态
-
-        Args:
-            auth_token: 完整的认证Token (格式: sso-rw=xxx;sso=xxx)
-            status_code: HTTP状态码
-            error_message: 错误信息
         """
         try:
             # 403错误是服务器IP被Block，不是Token问题
@@ -343,11 +862,7 @@ class GrokTokenManager:
                 )
                 return
 
-            sso_value = self._extract_sso(auth_token)
-            if not sso_value:
-                return
-
-            _, token_data = self._find_token(sso_value)
+            token_type, token_data = self._find_token(sso_value)
             if not token_data:
                 logger.warning(f"[Token] 未找到SSO值为 {sso_value[:10]}... 的Token")
                 return
@@ -356,6 +871,8 @@ class GrokTokenManager:
             token_data["failedCount"] = token_data.get("failedCount", 0) + 1
             token_data["lastFailureTime"] = int(time.time() * 1000)
             token_data["lastFailureReason"] = f"{status_code}: {error_message}"
+            self._mark_delta(sso_value, "failedCount", 1)
+            self._mark_dirty(sso_value, "lastFailureTime", "lastFailureReason")
 
             logger.warning(
                 f"[Token] Token {sso_value[:10]}... 失败 (状态码: {status_code}), "
@@ -366,45 +883,30 @@ class GrokTokenManager:
             # 只有401错误（SSO Token失效）且失败次数达到上限时，标记为失效
             if status_code == TOKEN_INVALID_CODE and token_data["failedCount"] >= MAX_FAILURE_COUNT:
                 token_data["status"] = "expired"
+                self._index_token(token_type, sso_value)
+                self._mark_dirty(sso_value, "status")
                 logger.error(
                     f"[Token] SSO Token {sso_value[:10]}... 已被标记为失效 "
                     f"(连续401错误{token_data['failedCount']}次)"
                 )
 
-            await self._save_data()
-
         except Exception as e:
             logger.error(f"[Token] 记录Token失败信息时发生错误: {str(e)}")
 
-    async def reset_failure(self, auth_token: str) -> None:
-        """重置Token失败计数
-
-        当Token成功完成请求时调用此方法，用于清除失败记录。
-
-        Args:
-            auth_token: 完整的认证Token (格式: sso-rw=xxx;sso=xxx)
-        """
-        try:
-            sso_value = self._extract_sso(auth_token)
-            if not sso_value:
-                return
-
-            _, token_data = self._find_token(sso_value)
-            if not token_data:
-                logger.warning(f"[Token] 未找到SSO值为 {sso_value[:10]}... 的Token")
-                return
-
-            # 只有在有失败记录时才重置并保存
-            if token_data.get("failedCount", 0) > 0:
-                token_data["failedCount"] = 0
-                token_data["lastFailureTime"] = None
-                token_data["lastFailureReason"] = None
+    def _clear_failures(self, sso_value: str) -> None:
+        """Token成功完成请求时重置失败计数"""
+        _, token_data = self._find_token(sso_value)
+        if not token_data:
+            return
 
-                await self._save_data()
-                logger.info(f"[Token] Token {sso_value[:10]}... 失败计数已重置")
+        # 只有在有失败记录时才重置并保存
+        if token_data.get("failedCount", 0) > 0:
+            token_data["failedCount"] = 0
+            token_data["lastFailureTime"] = None
+            token_data["lastFailureReason"] = None
 
-        except Exception as e:
-            logger.error(f"[Token] 重置Token失败计数时发生错误: {str(e)}")
+            self._mark_dirty(sso_value, "failedCount", "lastFailureTime", "lastFailureReason")
+            logger.info(f"[Token] Token {sso_value[:10]}... 失败计数已重置")
 
 
 # 全局Token管理器实例
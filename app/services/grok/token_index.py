@@ -0,0 +1,176 @@
+"""Token 选择索引模块"""
+
+import random
+from bisect import bisect_left, insort
+from typing import Any, Dict, List, Optional, Tuple
+
+# 索引分类
+UNUSED = -1  # 尚未获取过限制信息的 Token
+
+
+class TokenIndex:
+    """
+    单个 Token 池在某个剩余次数字段上的增量索引
+
+    - 未使用的 Token（剩余 -1）保存在有序字典中，按加入顺序取第一个
+    - 剩余次数 > 0 的 Token 按剩余次数分桶，桶键有序，取最大桶 O(log n)
+    - 已失效或已限流（剩余 0）的 Token 不进入索引
+    - 可选 Token 另存于数组（随机抽样、轮询）并按进行中请求数分桶（最少并发）
+
+    Token 状态变化时调用 update/remove 维护索引，进行中请求数变化时调用 set_load，
+    选择开销与池大小无关。
+    """
+
+    def __init__(self, field: str, inflight: Optional[Dict[str, int]] = None):
+        self.field = field
+        self._unused: Dict[str, None] = {}
+        self._buckets: Dict[int, Dict[str, None]] = {}
+        self._keys: List[int] = []  # 升序桶键
+        self._where: Dict[str, int] = {}  # token -> 所在分类（UNUSED 或剩余次数）
+
+        # 随机抽样与轮询
+        self._members: List[str] = []
+        self._pos: Dict[str, int] = {}
+        self._cursor = 0
+
+        # 按进行中请求数分桶（与管理器共享计数）
+        self._inflight = inflight if inflight is not None else {}
+        self._loads: Dict[str, int] = {}
+        self._load_buckets: Dict[int, Dict[str, None]] = {}
+        self._load_keys: List[int] = []
+
+    def _classify(self, data: Dict[str, Any]) -> Optional[int]:
+        """计算 Token 所属分类，不可选时返回 None"""
+        if data.get("status") == "expired":
+            return None
+        try:
+            remaining = int(data.get(self.field, -1))
+        except (TypeError, ValueError):
+            return None
+        if remaining == UNUSED or remaining > 0:
+            return remaining
+        return None
+
+    def update(self, token: str, data: Dict[str, Any]) -> None:
+        """根据最新数据重新索引 Token"""
+        slot = self._classify(data)
+        if self._where.get(token) == slot and slot is not None:
+            return
+        self.remove(token)
+        if slot is None:
+            return
+        self._where[token] = slot
+        self._pos[token] = len(self._members)
+        self._members.append(token)
+        self._bucket_add(self._load_buckets, self._load_keys, self._inflight.get(token, 0), token)
+        self._loads[token] = self._inflight.get(token, 0)
+        if slot == UNUSED:
+            self._unused[token] = None
+        else:
+            self._bucket_add(self._buckets, self._keys, slot, token)
+
+    def remove(self, token: str) -> None:
+        """从索引中移除 Token"""
+        slot = self._where.pop(token, None)
+        if slot is None:
+            return
+
+        # 数组中与末尾元素交换后删除
+        pos = self._pos.pop(token)
+        last = self._members.pop()
+        if last != token:
+            self._members[pos] = last
+            self._pos[last] = pos
+
+        self._bucket_remove(self._load_buckets, self._load_keys, self._loads.pop(token), token)
+        if slot == UNUSED:
+            self._unused.pop(token, None)
+        else:
+            self._bucket_remove(self._buckets, self._keys, slot, token)
+
+    def set_load(self, token: str, load: int) -> None:
+        """更新 Token 的进行中请求数"""
+        old = self._loads.get(token)
+        if old is None or old == load:
+            return
+        self._bucket_remove(self._load_buckets, self._load_keys, old, token)
+        self._bucket_add(self._load_buckets, self._load_keys, load, token)
+        self._loads[token] = load
+
+    @staticmethod
+    def _bucket_add(buckets: Dict[int, Dict[str, None]], keys: List[int], key: int, token: str) -> None:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {}
+            insort(keys, key)
+        bucket[token] = None
+
+    @staticmethod
+    def _bucket_remove(buckets: Dict[int, Dict[str, None]], keys: List[int], key: int, token: str) -> None:
+        bucket = buckets.get(key)
+        if bucket is None:
+            return
+        bucket.pop(token, None)
+        if not bucket:
+            del buckets[key]
+            pos = bisect_left(keys, key)
+            if pos < len(keys) and keys[pos] == key:
+                del keys[pos]
+
+    def clear(self) -> None:
+        """清空索引"""
+        self._unused.clear()
+        self._buckets.clear()
+        self._keys.clear()
+        self._where.clear()
+        self._members.clear()
+        self._pos.clear()
+        self._loads.clear()
+        self._load_buckets.clear()
+        self._load_keys.clear()
+
+    def best(self) -> Tuple[Optional[str], Optional[int]]:
+        """返回最优 Token：优先未使用，否则剩余次数最多"""
+        if self._unused:
+            return next(iter(self._unused)), UNUSED
+        if self._keys:
+            remaining = self._keys[-1]
+            return next(iter(self._buckets[remaining])), remaining
+        return None, None
+
+    def remaining(self, token: str) -> Optional[int]:
+        """Token 的剩余次数（UNUSED 表示未知），不在索引中时返回 None"""
+        return self._where.get(token)
+
+    def load(self, token: str) -> int:
+        """Token 的进行中请求数"""
+        return self._loads.get(token, 0)
+
+    def max_remaining(self) -> int:
+        """已知最大剩余次数，无已知值时返回 0"""
+        return self._keys[-1] if self._keys else 0
+
+    def sample(self) -> Optional[str]:
+        """均匀随机抽取一个 Token"""
+        if not self._members:
+            return None
+        return self._members[random.randrange(len(self._members))]
+
+    def next_round_robin(self) -> Optional[str]:
+        """按顺序轮询下一个 Token"""
+        if not self._members:
+            return None
+        self._cursor = (self._cursor + 1) % len(self._members)
+        return self._members[self._cursor]
+
+    def least_loaded(self) -> Optional[str]:
+        """进行中请求数最少的 Token"""
+        if not self._load_keys:
+            return None
+        return next(iter(self._load_buckets[self._load_keys[0]]))
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self._where
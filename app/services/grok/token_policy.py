@@ -0,0 +1,99 @@
+"""Token 选择策略模块"""
+
+import random
+from enum import Enum
+from typing import Optional, Tuple
+
+from app.services.grok.latency import latency_tracker
+from app.services.grok.token_index import TokenIndex, UNUSED
+
+# 常量定义
+WEIGHTED_MAX_ATTEMPTS = 32  # 加权随机拒绝采样的最大尝试次数
+FASTEST_SAMPLE_SIZE = 4  # 最快优先策略每次抽取的候选数
+
+
+class TokenSelectPolicy(Enum):
+    """Token 选择策略"""
+    BEST = "best"                          # 优先未使用，否则剩余次数最多（默认）
+    ROUND_ROBIN = "round_robin"            # 轮询
+    LEAST_INFLIGHT = "least_inflight"      # 进行中请求最少
+    WEIGHTED_RANDOM = "weighted_random"    # 按剩余次数加权随机
+    POWER_OF_TWO = "power_of_two"          # 随机取两个，选进行中请求较少者
+    FASTEST = "fastest"                    # 随机取若干个，选估算耗时最短者（偶尔随机探索）
+
+    @classmethod
+    def parse(cls, value: str) -> "TokenSelectPolicy":
+        """解析配置值，未知值回退为默认策略"""
+        try:
+            return cls(str(value).strip().lower())
+        except ValueError:
+            return cls.BEST
+
+
+def _weight(index: TokenIndex, token: str) -> int:
+    """Token 的选择权重：剩余次数；未使用的 Token 按已知最大剩余次数计"""
+    remaining = index.remaining(token)
+    if remaining is None:
+        return 0
+    if remaining == UNUSED:
+        return max(index.max_remaining(), 1)
+    return remaining
+
+
+def _weighted_random(index: TokenIndex) -> Optional[str]:
+    """按剩余次数加权随机（拒绝采样，期望开销与池大小无关）"""
+    max_weight = max(index.max_remaining(), 1)
+    token = None
+    for _ in range(WEIGHTED_MAX_ATTEMPTS):
+        token = index.sample()
+        if token is None or random.random() * max_weight < _weight(index, token):
+            return token
+    return token
+
+
+def _power_of_two(index: TokenIndex) -> Optional[str]:
+    """随机抽取两个 Token，选进行中请求较少者（相同时选剩余次数较多者）"""
+    first, second = index.sample(), index.sample()
+    if first is None or second is None or first == second:
+        return first
+    return min(first, second, key=lambda t: (index.load(t), -_weight(index, t)))
+
+
+def _fastest(index: TokenIndex) -> Optional[str]:
+    """随机抽取若干 Token，选估算耗时 ×（进行中请求 + 1）最小者
+
+    尚无耗时样本的 Token 优先（探索），并以一定概率直接随机选择，避免长期不再测量慢 Token。
+    """
+    first = index.sample()
+    if first is None or random.random() < latency_tracker.explore_rate():
+        return first
+
+    def cost(token: str) -> float:
+        estimate = latency_tracker.token_estimate(token)
+        return -1.0 if estimate is None else estimate * (index.load(token) + 1)
+
+    candidates = {first}
+    for _ in range(FASTEST_SAMPLE_SIZE - 1):
+        candidates.add(index.sample())
+    return min(candidates, key=cost)
+
+
+def choose(index: TokenIndex, policy: TokenSelectPolicy) -> Tuple[Optional[str], Optional[int]]:
+    """按策略从索引中选择 Token，返回 (token, 剩余次数)"""
+    if policy is TokenSelectPolicy.BEST:
+        return index.best()
+
+    if policy is TokenSelectPolicy.ROUND_ROBIN:
+        token = index.next_round_robin()
+    elif policy is TokenSelectPolicy.LEAST_INFLIGHT:
+        token = index.least_loaded()
+    elif policy is TokenSelectPolicy.WEIGHTED_RANDOM:
+        token = _weighted_random(index)
+    elif policy is TokenSelectPolicy.FASTEST:
+        token = _fastest(index)
+    else:
+        token = _power_of_two(index)
+
+    if token is None:
+        return None, None
+    return token, index.remaining(token)
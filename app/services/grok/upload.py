@@ -12,6 +12,7 @@ from app.core.exception import GrokApiException
 from app.core.config import setting
 from app.core.logger import logger
 from app.services.grok.cloudflare import CloudflareClearance
+from app.services.grok.circuit import circuit_breakers
 
 # 常量定义
 UPLOAD_ENDPOINT = "https://grok.com/rest/app-chat/upload-file"
@@ -66,7 +67,7 @@ class ImageUploadManager:
             cf_clearance = setting.grok_config.get("cf_clearance", "")
             cookie = f"{auth_token};{cf_clearance}" if cf_clearance else auth_token
             
-            proxy_url = setting.grok_config.get("proxy_url", "")
+            proxy_url = circuit_breakers.choose_proxy(setting.get_service_proxies())
             if proxy_url:
                 logger.debug(f"[Upload] 使用代理: {proxy_url.split('@')[-1] if '@' in proxy_url else proxy_url}")
 
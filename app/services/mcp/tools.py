@@ -40,8 +40,8 @@ async def ask_grok_impl(
 
         logger.info(f"[MCP] ask_grok 调用, 模型: {model}")
 
-        # 调用Grok客户端(流式)
-        response_iterator = await GrokClient.openai_to_grok(request_data)
+        # 调用Grok客户端(流式，完整收集后返回，允许对冲请求)
+        response_iterator = await GrokClient.openai_to_grok(request_data, hedge=True)
 
         # 收集所有流式响应块
         content_parts = []
@@ -10,6 +10,9 @@ from app.core.storage import storage_manager
 from app.core.config import setting
 from app.services.grok.token import token_manager
 from app.services.grok.cloudflare import CloudflareClearance
+from app.services.grok.session_pool import session_pool
+from app.services.grok.rate_limit import rate_limit_refresher
+from app.services.grok.recovery import quota_recovery
 from app.api.v1.chat import router as chat_router
 from app.api.v1.models import router as models_router
 from app.api.v1.images import router as images_router
@@ -47,6 +50,13 @@ async def lifespan(app: FastAPI):
     await setting.reload()
     token_manager._load_data()
 
+    # 从数据库类存储加载Token，并订阅其他实例/节点的Token与配置变更
+    await token_manager.start()
+    await setting.start()
+
+    # 启动配额恢复调度（耗尽的Token在窗口重置后自动回到轮换）
+    quota_recovery.start()
+
     # 异步预热 Cloudflare cf_clearance（不阻塞启动）
     try:
         asyncio.create_task(CloudflareClearance.ensure())
@@ -71,6 +81,10 @@ async def lifespan(app: FastAPI):
         logger.info("[MCP] MCP服务已关闭")
         
         # 2. 关闭核心服务
+        await quota_recovery.close()
+        await rate_limit_refresher.close()
+        await session_pool.close()
+        await token_manager.shutdown()
         await storage_manager.close()
         logger.info("[grok2api] 应用关闭成功")
 
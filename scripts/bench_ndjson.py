@@ -0,0 +1,61 @@
+"""上游 NDJSON 行解析基准：对比旧路径（解码 + json.loads + 逐层 get）与各解析器
+
+用法: python scripts/bench_ndjson.py [录制的上游流文件（每行一个 JSON）]
+"""
+
+import json
+import sys
+import timeit
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.grok.ndjson import PARSERS, parse_line, use_parser
+
+# 常量定义
+ROUNDS = 200
+
+
+def sample_lines() -> List[bytes]:
+    """构造一条典型的上游流"""
+    tokens = ["思考", "中", "...", " the", " quick", " brown", " fox", "\n", "\"quoted\"", " 结束"] * 30
+    lines = [json.dumps({"result": {"response": {"userResponse": {"model": "grok-3", "message": "hi"}}}}).encode()]
+    lines += [
+        json.dumps({"result": {"response": {
+            "token": t, "isThinking": i < 100, "isSoftStop": False,
+            "responseId": "d7a1f0c4-5b6e-4f3a-9c2d-8e1b0a9f7c6d",
+            "messageTag": "header" if i == 150 else "final"
+        }}}, ensure_ascii=False).encode()
+        for i, t in enumerate(tokens)
+    ]
+    lines.append(json.dumps({"result": {"response": {"modelResponse": {"message": "".join(tokens)}}}}, ensure_ascii=False).encode())
+    return lines
+
+
+def legacy(line: bytes):
+    """原解析路径"""
+    data = json.loads(line.decode("utf-8"))
+    return data.get("error"), data.get("result", {}).get("response", {})
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        # 录制的上游流（每行一个 JSON）
+        with open(sys.argv[1], "rb") as f:
+            lines = [line.strip() for line in f if line.strip()]
+    else:
+        lines = sample_lines()
+
+    base = timeit.timeit(lambda: [legacy(line) for line in lines], number=ROUNDS)
+    print(f"{len(lines)} 行 x {ROUNDS} 轮")
+    print(f"{'legacy':>8}: {base / ROUNDS * 1000:.3f} ms/stream")
+    for name in PARSERS:
+        use_parser(name)
+        assert [parse_line(line) for line in lines] == [legacy(line) for line in lines]
+        elapsed = timeit.timeit(lambda: [parse_line(line) for line in lines], number=ROUNDS)
+        print(f"{name:>8}: {elapsed / ROUNDS * 1000:.3f} ms/stream ({base / elapsed:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
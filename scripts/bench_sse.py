@@ -0,0 +1,65 @@
+"""SSE 响应块编码微基准：对比 pydantic 构建路径与字节模板编码
+
+用法: python scripts/bench_sse.py
+"""
+
+import json
+import sys
+import time
+import timeit
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.models.openai_schema import (
+    OpenAIChatCompletionChunkResponse,
+    OpenAIChatCompletionChunkChoice,
+    OpenAIChatCompletionChunkMessage
+)
+from app.services.grok.sse import DEFAULT_STREAM_MODEL, SSEChunkEncoder
+
+# 常量定义
+ROUNDS = 20000
+SAMPLES = ["Hel", "lo", " 世界", "\"quoted\"\n", "<think>", ""]
+
+
+def pydantic_chunk(chunk_content: str, finish: str = None, index: int = 0) -> str:
+    """原 pydantic 构建路径"""
+    chunk_data = OpenAIChatCompletionChunkResponse(
+        id=f"chatcmpl-{uuid.uuid4()}",
+        created=int(time.time()),
+        model=DEFAULT_STREAM_MODEL,
+        choices=[OpenAIChatCompletionChunkChoice(
+            index=index,
+            delta=OpenAIChatCompletionChunkMessage(
+                role="assistant",
+                content=chunk_content
+            ) if chunk_content else {},
+            finish_reason=finish
+        )]
+    ).model_dump()
+    return f"data: {json.dumps(chunk_data)}\n\n"
+
+
+def main() -> None:
+    encoder = SSEChunkEncoder()
+
+    # 校验两种输出语义一致（忽略 id 与 created）
+    for sample in SAMPLES:
+        for finish in (None, "stop"):
+            old = json.loads(pydantic_chunk(sample, finish)[6:])
+            new = json.loads(encoder.encode(sample, finish)[6:])
+            for data in (old, new):
+                data.pop("id")
+                data.pop("created")
+            assert old == new, (old, new)
+
+    for name, func in (("pydantic", pydantic_chunk), ("encoder", encoder.encode)):
+        elapsed = timeit.timeit(lambda: [func(sample) for sample in SAMPLES], number=ROUNDS)
+        per_chunk = elapsed / (ROUNDS * len(SAMPLES)) * 1e6
+        print(f"{name:>8}: {per_chunk:.2f} us/chunk")
+
+
+if __name__ == "__main__":
+    main()